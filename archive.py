@@ -0,0 +1,240 @@
+"""Archive tier for reports older than a season.
+
+Old records (with their save history) and the photos only they use are
+moved out of the live tables and blob directory into pack files: append-
+only files of zlib-compressed entries, with an offset index in the report
+database. Reading one archived entry is an index lookup, one seek and one
+decompress, so an archived report opens as fast as a live one. Packs are
+never rewritten; an entry replaced by a newer one is simply left behind.
+
+Saved records pin the report template they were saved with; each pinned
+template version is kept here once. So the PDF of an archived report can be
+rebuilt on demand exactly as it was delivered, and stored PDFs can be
+dropped after PDF_RETENTION_DAYS.
+
+Run `python archive.py` from cron, or use the button on the analytics tab.
+"""
+import argparse
+import os
+import sqlite3
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+DEFAULT_DB_PATH = os.getenv("REPORT_DB_PATH", "reports.db")
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+# Reports not saved for this long are archived
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "180"))
+# Stored PDFs older than this are dropped and rebuilt when needed again
+PDF_RETENTION_DAYS = int(os.getenv("PDF_RETENTION_DAYS", "30"))
+# A new pack file is started once the current one reaches this size
+PACK_MAX_BYTES = int(os.getenv("ARCHIVE_PACK_MAX_BYTES", str(256 * 1024 * 1024)))
+COMPRESSION_LEVEL = 6
+
+# Entry header: magic, key length, compressed length; followed by the key ("kind/key") and the data
+ENTRY_MAGIC = b"RPK1"
+ENTRY_HEADER = struct.Struct(">4sHI")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS archive_index (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    pack TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    archived_at TEXT NOT NULL,
+    PRIMARY KEY (kind, key)
+);
+"""
+
+
+class PackArchive:
+    """Append-only compressed pack files plus an offset index for random access"""
+
+    def __init__(self, root=ARCHIVE_DIR, db_path=DEFAULT_DB_PATH, pack_max_bytes=PACK_MAX_BYTES):
+        self.root = root
+        self.db_path = db_path
+        self.pack_max_bytes = pack_max_bytes
+        self._local = threading.local()
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def _pack_path(self, pack):
+        return os.path.join(self.root, pack)
+
+    def _current_pack(self):
+        packs = sorted(name for name in os.listdir(self.root) if name.endswith(".pack"))
+        if packs and os.path.getsize(self._pack_path(packs[-1])) < self.pack_max_bytes:
+            return packs[-1]
+        return f"{len(packs) + 1:06d}.pack"
+
+    def put_many(self, entries, replace=True):
+        """Append (kind, key, bytes) entries; with replace=False keys already archived are skipped.
+
+        The write transaction doubles as the lock between processes: entries
+        are appended and synced before their index rows commit, so a crash
+        leaves at most some unindexed bytes at the end of a pack.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        now = datetime.utcnow().isoformat(timespec="seconds")
+        with self._transaction() as conn:
+            if not replace:
+                entries = [
+                    (kind, key, data) for kind, key, data in entries
+                    if not conn.execute("SELECT 1 FROM archive_index WHERE kind = ? AND key = ?", (kind, key)).fetchone()
+                ]
+            if not entries:
+                return 0
+            pack = self._current_pack()
+            index_rows = []
+            with open(self._pack_path(pack), "ab") as fh:
+                offset = fh.tell()
+                for kind, key, data in entries:
+                    name = f"{kind}/{key}".encode("utf-8")
+                    compressed = zlib.compress(data, COMPRESSION_LEVEL)
+                    fh.write(ENTRY_HEADER.pack(ENTRY_MAGIC, len(name), len(compressed)) + name + compressed)
+                    data_offset = offset + ENTRY_HEADER.size + len(name)
+                    index_rows.append((kind, key, pack, data_offset, len(compressed), len(data), now))
+                    offset = data_offset + len(compressed)
+                fh.flush()
+                os.fsync(fh.fileno())
+            conn.executemany(
+                "INSERT OR REPLACE INTO archive_index (kind, key, pack, offset, length, size, archived_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                index_rows
+            )
+        return len(index_rows)
+
+    def put(self, kind, key, data):
+        self.put_many([(kind, key, data)])
+
+    def get(self, kind, key):
+        """Bytes of an archived entry, or None"""
+        row = self._connection().execute(
+            "SELECT pack, offset, length FROM archive_index WHERE kind = ? AND key = ?", (kind, key)
+        ).fetchone()
+        if row is None:
+            return None
+        with open(self._pack_path(row["pack"]), "rb") as fh:
+            fh.seek(row["offset"])
+            return zlib.decompress(fh.read(row["length"]))
+
+    def contains(self, kind, key):
+        return self._connection().execute(
+            "SELECT 1 FROM archive_index WHERE kind = ? AND key = ?", (kind, key)
+        ).fetchone() is not None
+
+    def stats(self):
+        """{kind: {"entries", "size", "stored"}} - uncompressed and compressed bytes"""
+        return {
+            row["kind"]: {"entries": row["entries"], "size": row["size"], "stored": row["stored"]}
+            for row in self._connection().execute(
+                "SELECT kind, COUNT(*) AS entries, SUM(size) AS size, SUM(length) AS stored "
+                "FROM archive_index GROUP BY kind"
+            )
+        }
+
+    def rebuild_index(self):
+        """Re-create the index by scanning the packs (after losing the database); returns the entry count"""
+        rows = {}
+        now = datetime.utcnow().isoformat(timespec="seconds")
+        for pack in sorted(name for name in os.listdir(self.root) if name.endswith(".pack")):
+            with open(self._pack_path(pack), "rb") as fh:
+                offset = 0
+                while True:
+                    header = fh.read(ENTRY_HEADER.size)
+                    if len(header) < ENTRY_HEADER.size:
+                        break
+                    magic, name_length, length = ENTRY_HEADER.unpack(header)
+                    if magic != ENTRY_MAGIC:
+                        break
+                    kind, key = fh.read(name_length).decode("utf-8").split("/", 1)
+                    data_offset = offset + ENTRY_HEADER.size + name_length
+                    data = fh.read(length)
+                    if len(data) < length:
+                        break
+                    # Later entries for a key replace earlier ones
+                    rows[(kind, key)] = (kind, key, pack, data_offset, length, len(zlib.decompress(data)), now)
+                    offset = data_offset + length
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM archive_index")
+            conn.executemany(
+                "INSERT INTO archive_index (kind, key, pack, offset, length, size, archived_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows.values()
+            )
+        return len(rows)
+
+
+def archive_cutoff(days=ARCHIVE_AFTER_DAYS, now=None):
+    return ((now or datetime.utcnow()) - timedelta(days=days)).isoformat(timespec="seconds")
+
+
+def run_archive(store, blob_store, delivery_queue=None, archive_after_days=ARCHIVE_AFTER_DAYS,
+                pdf_retention_days=PDF_RETENTION_DAYS):
+    """Archive old reports and the photos only they use, then drop old stored PDFs; returns counts"""
+    report_ids = store.archive_reports(archive_cutoff(archive_after_days))
+    blobs = blob_store.archive_blobs(report_ids)
+    # Deliveries are stamped in local time
+    pdfs = delivery_queue.drop_payloads(archive_cutoff(pdf_retention_days, datetime.now())) if delivery_queue else 0
+    return {"reports": len(report_ids), "blobs": blobs, "pdfs": pdfs}
+
+
+def main(argv=None):
+    from blob_store import BlobStore
+    from delivery import DeliveryQueue
+    from report_store import ReportStore
+
+    parser = argparse.ArgumentParser(description="Move old reports into the archive and drop old stored PDFs")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH)
+    parser.add_argument("--after-days", type=int, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--pdf-retention-days", type=int, default=PDF_RETENTION_DAYS)
+    parser.add_argument("--vacuum", action="store_true", help="shrink the database file afterwards")
+    parser.add_argument("--rebuild-index", action="store_true", help="re-create the offset index from the packs")
+    args = parser.parse_args(argv)
+
+    archive = PackArchive(ARCHIVE_DIR, args.db)
+    if args.rebuild_index:
+        print(f"Indexed {archive.rebuild_index()} archive entries")
+        return
+    counts = run_archive(
+        ReportStore(args.db, archive=archive),
+        BlobStore(db_path=args.db, archive=archive),
+        DeliveryQueue(path=args.db),
+        args.after_days,
+        args.pdf_retention_days
+    )
+    print(f"Archived {counts['reports']} reports and {counts['blobs']} photos, dropped {counts['pdfs']} stored PDFs")
+    if args.vacuum:
+        # Freed pages are otherwise reused by new reports, not returned to the disk
+        sqlite3.connect(args.db, isolation_level=None).execute("VACUUM")
+    for kind, stats in sorted(archive.stats().items()):
+        print(f"  {kind}: {stats['entries']} entries, {stats['size'] / 1e6:.1f} MB in {stats['stored'] / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
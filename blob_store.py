@@ -0,0 +1,256 @@
+"""Content-addressed store for report photos and attachments.
+
+Blobs are files named by the SHA-256 of their content, so an image uploaded
+for many POs is stored once. Reports reference blobs by hash; the reference
+counts live in the report database and blobs nobody references any more are
+removed by collect_garbage() after a grace period (uploads are unreferenced
+until their report is saved).
+
+Image renditions (print-resolution JPEG, thumbnail) are produced once per
+blob and kind and cached next to the blobs. The PDF embeds the cached print
+JPEG as-is - ReportLab passes JPEG data through without decoding it.
+
+Blobs used only by archived reports move into the archive's pack files and
+are written back here the first time they are needed again.
+"""
+import hashlib
+import io
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from functools import lru_cache
+
+from archive import ARCHIVE_DIR, PackArchive
+
+DEFAULT_BLOB_ROOT = os.getenv("BLOB_STORE_PATH", "blobs")
+DEFAULT_DB_PATH = os.getenv("REPORT_DB_PATH", "reports.db")
+
+# Rendition kind -> (longest side in pixels, JPEG quality)
+RENDITIONS = {
+    "print": (1600, 85),
+    "thumb": (320, 75)
+}
+
+GC_GRACE_SECONDS = 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mime TEXT,
+    refcount INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blob_refs (
+    owner TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    archived INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (owner, sha256)
+);
+CREATE TABLE IF NOT EXISTS renditions (
+    sha256 TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    PRIMARY KEY (sha256, kind)
+);
+"""
+
+
+class BlobStore:
+    """SHA-256 addressed files with reference counts and cached image renditions"""
+
+    def __init__(self, root=DEFAULT_BLOB_ROOT, db_path=DEFAULT_DB_PATH, archive=None):
+        self.root = root
+        self.db_path = db_path
+        self.archive = archive or PackArchive(ARCHIVE_DIR, db_path)
+        self._local = threading.local()
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        if "archived" not in {row[1] for row in conn.execute("PRAGMA table_info(blob_refs)")}:
+            conn.execute("ALTER TABLE blob_refs ADD COLUMN archived INTEGER NOT NULL DEFAULT 0")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _lock(self, key):
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def path(self, sha256, kind=None):
+        """File path of a blob, or of one of its renditions"""
+        if kind is None:
+            return os.path.join(self.root, sha256[:2], sha256)
+        return os.path.join(self.root, "renditions", kind, sha256[:2], f"{sha256}.jpg")
+
+    @staticmethod
+    def _write_atomic(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def put(self, data, mime=None):
+        """Store bytes (a no-op if identical content exists); returns the SHA-256 hex digest"""
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self.path(sha256)
+        if not os.path.exists(path):
+            self._write_atomic(path, data)
+        self._connection().execute(
+            "INSERT OR IGNORE INTO blobs (sha256, size, mime, refcount, created_at) VALUES (?, ?, ?, 0, ?)",
+            (sha256, len(data), mime, time.time())
+        )
+        return sha256
+
+    def get(self, sha256):
+        self._restore(sha256)
+        with open(self.path(sha256), "rb") as fh:
+            return fh.read()
+
+    def exists(self, sha256):
+        return os.path.exists(self.path(sha256)) or self.archive.contains("blob", sha256)
+
+    def _restore(self, sha256):
+        """Write an archived blob back to its file if it is not there"""
+        path = self.path(sha256)
+        if os.path.exists(path):
+            return
+        with self._lock((sha256, None)):
+            if not os.path.exists(path):
+                data = self.archive.get("blob", sha256)
+                if data is not None:
+                    self._write_atomic(path, data)
+
+    def set_refs(self, owner, hashes):
+        """Make `owner` (e.g. a report id) reference exactly `hashes`, updating refcounts"""
+        new = set(hashes)
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            old = {row[0] for row in conn.execute("SELECT sha256 FROM blob_refs WHERE owner = ?", (owner,))}
+            # A saved report is live again, whatever it was before
+            conn.execute("UPDATE blob_refs SET archived = 0 WHERE owner = ?", (owner,))
+            for sha256 in new - old:
+                conn.execute("INSERT INTO blob_refs (owner, sha256) VALUES (?, ?)", (owner, sha256))
+                conn.execute("UPDATE blobs SET refcount = refcount + 1 WHERE sha256 = ?", (sha256,))
+            for sha256 in old - new:
+                conn.execute("DELETE FROM blob_refs WHERE owner = ? AND sha256 = ?", (owner, sha256))
+                conn.execute("UPDATE blobs SET refcount = refcount - 1 WHERE sha256 = ?", (sha256,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def rendition(self, sha256, kind="print"):
+        """(path, width, height) of a cached JPEG rendition, creating it on first use"""
+        row = self._connection().execute(
+            "SELECT width, height FROM renditions WHERE sha256 = ? AND kind = ?", (sha256, kind)
+        ).fetchone()
+        path = self.path(sha256, kind)
+        if row and os.path.exists(path):
+            return path, row[0], row[1]
+
+        self._restore(sha256)
+        with self._lock((sha256, kind)):
+            from PIL import Image, ImageOps
+
+            max_side, quality = RENDITIONS[kind]
+            with Image.open(self.path(sha256)) as image:
+                image = ImageOps.exif_transpose(image)
+                if image.mode not in ("RGB", "L"):
+                    background = Image.new("RGB", image.size, "white")
+                    background.paste(image, mask=image.convert("RGBA").getchannel("A"))
+                    image = background
+                image.thumbnail((max_side, max_side))
+                out = io.BytesIO()
+                image.save(out, "JPEG", quality=quality, optimize=True, progressive=kind == "thumb")
+                width, height = image.size
+            self._write_atomic(path, out.getvalue())
+            self._connection().execute(
+                "INSERT OR REPLACE INTO renditions (sha256, kind, width, height) VALUES (?, ?, ?, ?)",
+                (sha256, kind, width, height)
+            )
+        return path, width, height
+
+    def archive_blobs(self, owners):
+        """Mark `owners` (archived report ids) archived and move blobs only archived owners use
+        into the archive, deleting their files and renditions; returns the number moved"""
+        conn = self._connection()
+        conn.executemany("UPDATE blob_refs SET archived = 1 WHERE owner = ?", [(owner,) for owner in owners])
+        rows = conn.execute(
+            """
+            SELECT DISTINCT sha256 FROM blob_refs r WHERE archived = 1
+              AND NOT EXISTS (SELECT 1 FROM blob_refs o WHERE o.sha256 = r.sha256 AND o.archived = 0)
+            """
+        ).fetchall()
+        moved = 0
+        for (sha256,) in rows:
+            path = self.path(sha256)
+            if not os.path.exists(path):
+                continue
+            with open(path, "rb") as fh:
+                # Content-addressed: a blob archived before keeps its pack entry
+                self.archive.put_many([("blob", sha256, fh.read())], replace=False)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Re-check under the write lock; a live report may have just referenced it
+                if conn.execute(
+                    "SELECT 1 FROM blob_refs WHERE sha256 = ? AND archived = 0", (sha256,)
+                ).fetchone():
+                    conn.execute("COMMIT")
+                    continue
+                conn.execute("DELETE FROM renditions WHERE sha256 = ?", (sha256,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            for path in [path] + [self.path(sha256, kind) for kind in RENDITIONS]:
+                if os.path.exists(path):
+                    os.remove(path)
+            moved += 1
+        return moved
+
+    def collect_garbage(self, grace_seconds=GC_GRACE_SECONDS):
+        """Delete unreferenced blobs (and renditions) older than the grace period; returns the count"""
+        conn = self._connection()
+        rows = conn.execute(
+            "SELECT sha256 FROM blobs WHERE refcount <= 0 AND created_at < ?", (time.time() - grace_seconds,)
+        ).fetchall()
+        for (sha256,) in rows:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Re-check under the write lock; a report may have just referenced it
+                if conn.execute("SELECT refcount FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()[0] > 0:
+                    conn.execute("COMMIT")
+                    continue
+                conn.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+                conn.execute("DELETE FROM renditions WHERE sha256 = ?", (sha256,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            for path in [self.path(sha256)] + [self.path(sha256, kind) for kind in RENDITIONS]:
+                if os.path.exists(path):
+                    os.remove(path)
+        return len(rows)
+
+
+@lru_cache(maxsize=None)
+def default_blob_store():
+    """Process-wide store at BLOB_STORE_PATH, for code without app state (PDF builds, workers)"""
+    return BlobStore()
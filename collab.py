@@ -0,0 +1,157 @@
+"""Live shared editing of one report by several sessions.
+
+Sessions that open the same saved report join a room holding the shared
+field values. Every field has a version; an edit is accepted only against
+the version the editor last saw, so two people changing the same field at
+once cannot silently overwrite each other - the later edit is rejected and
+that session gets the current value instead. Accepting an edit locks the
+field for the editor for a few seconds, which keeps a comment someone is
+still writing from being taken over mid-sentence.
+
+Other members are told about accepted changes through their notify
+callback (the app uses it to rerun their page), so nobody polls. Fields in
+different sections merge naturally: Sales, Technical and QC each edit
+their own comments and signatures and see the others' within a rerun.
+
+Someone joining a room takes its shared values, except for fields they had
+already changed since opening or saving the report: those keep their local
+value and are marked as conflicts until they choose which value to keep.
+
+Rooms live in the memory of one server process. When the app runs several
+server processes behind a load balancer, only sessions served by the same
+process edit together; the others do not see each other at all.
+"""
+import os
+import threading
+import time
+
+from report_record import DATE_FIELDS, RATING_FIELDS, TEXT_FIELDS
+
+COLLAB_FIELDS = ["risk_schema"] + TEXT_FIELDS + RATING_FIELDS + DATE_FIELDS
+
+LOCK_SECONDS = float(os.getenv("COLLAB_LOCK_SECONDS", "15"))
+
+
+def unsaved_conflicts(local, base, shared):
+    """Fields whose local value was edited since `base` and differs from the shared value.
+
+    `base` holds the values last loaded or saved; without one, every field
+    that differs from the shared value counts as edited.
+    """
+    return [
+        field for field, value in local.items()
+        if field in shared and value != shared[field] and value != base.get(field, shared[field])
+    ]
+
+
+class CollabRoom:
+    """Shared values, field versions, locks and members of one report"""
+
+    def __init__(self, report_id, values):
+        self.report_id = report_id
+        self.values = {field: values.get(field) for field in COLLAB_FIELDS}
+        self.versions = {field: 0 for field in COLLAB_FIELDS}
+        self.seq = 0
+        # field -> (session id, display name, expiry time)
+        self.locks = {}
+        # session id -> (display name, notify callback)
+        self.members = {}
+
+    def lock_holder(self, field, session_id, now):
+        """(session id, name) of another session holding a live lock on `field`, or None"""
+        lock = self.locks.get(field)
+        if lock and lock[0] != session_id and lock[2] > now:
+            return lock[0], lock[1]
+        return None
+
+
+class CollabHub:
+    """Process-wide registry of collaboration rooms"""
+
+    def __init__(self, lock_seconds=LOCK_SECONDS):
+        self.lock_seconds = lock_seconds
+        self._rooms = {}
+        self._lock = threading.Lock()
+
+    def join(self, report_id, session_id, name, notify, values):
+        """Enter (or refresh membership of) a report's room, creating it from `values`.
+
+        notify() is called after other members change fields; it returns False
+        once the session is gone, which removes it from the room. Returns the
+        room's current (values, versions).
+        """
+        with self._lock:
+            room = self._rooms.get(report_id)
+            if room is None:
+                room = self._rooms[report_id] = CollabRoom(report_id, values)
+            room.members[session_id] = (name, notify)
+            return dict(room.values), dict(room.versions)
+
+    def leave(self, report_id, session_id):
+        with self._lock:
+            room = self._rooms.get(report_id)
+            if room is None:
+                return
+            room.members.pop(session_id, None)
+            room.locks = {field: lock for field, lock in room.locks.items() if lock[0] != session_id}
+            if not room.members:
+                del self._rooms[report_id]
+
+    def update(self, report_id, session_id, changes):
+        """Apply {field: (value, base version)} edits from one session.
+
+        Returns {field: (accepted, current value, current version)}. An edit
+        is rejected if another session changed the field since `base version`
+        or holds its lock. Other members are notified once per call.
+        """
+        now = time.time()
+        results = {}
+        with self._lock:
+            room = self._rooms.get(report_id)
+            if room is None or session_id not in room.members:
+                return results
+            name = room.members[session_id][0]
+            for field, (value, base_version) in changes.items():
+                if field not in room.versions:
+                    continue
+                if room.lock_holder(field, session_id, now) or room.versions[field] != base_version:
+                    results[field] = (False, room.values[field], room.versions[field])
+                    continue
+                room.seq += 1
+                room.values[field] = value
+                room.versions[field] = room.seq
+                room.locks[field] = (session_id, name, now + self.lock_seconds)
+                results[field] = (True, value, room.seq)
+            accepted = any(result[0] for result in results.values())
+            others = [(sid, notify) for sid, (_, notify) in room.members.items() if sid != session_id]
+
+        if accepted:
+            self._notify(report_id, others)
+        return results
+
+    def presence(self, report_id, session_id):
+        """(names of the other members, {field: name} of fields locked by others)"""
+        now = time.time()
+        with self._lock:
+            room = self._rooms.get(report_id)
+            if room is None:
+                return [], {}
+            names = [name for sid, (name, _) in room.members.items() if sid != session_id]
+            locked = {}
+            for field in room.locks:
+                holder = room.lock_holder(field, session_id, now)
+                if holder:
+                    locked[field] = holder[1]
+            return names, locked
+
+    def _notify(self, report_id, members):
+        gone = []
+        for session_id, notify in members:
+            try:
+                alive = notify()
+            except Exception:
+                alive = False
+            if alive is False:
+                gone.append(session_id)
+        for session_id in gone:
+            self.leave(report_id, session_id)
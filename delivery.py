@@ -0,0 +1,600 @@
+"""Outbound delivery of finished reports to factories, agents and the ERP.
+
+Deliveries are rows in the report database, so they survive restarts and
+several app processes can share one queue. A background worker claims due
+rows in batches per channel and destination and sends each batch over one
+pooled connection:
+
+- "email": an SMTP message with the PDF attached, to one recipient
+- "erp": an HTTP POST of the PDF to ERP_UPLOAD_URL
+
+Every attempt is recorded on the row. Temporary failures are retried with
+exponential backoff (Retry-After is honoured); permanent ones - a refused
+recipient, a 4xx from the ERP - and rows out of attempts are marked failed.
+A row either carries its PDF (identical PDFs are stored once) or has it
+rendered by the worker when sent, so queueing hundreds of reports at the
+end of the day is only a few inserts.
+
+Connection settings come from the environment; point SMTP_HOST/SMTP_PORT
+and ERP_UPLOAD_URL at local stand-ins to test.
+"""
+import hashlib
+import http.client
+import os
+import random
+import smtplib
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from email.message import EmailMessage
+from urllib.parse import urlsplit
+
+DEFAULT_DB_PATH = os.getenv("REPORT_DB_PATH", "reports.db")
+
+SMTP_HOST = os.getenv("SMTP_HOST", "")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USER = os.getenv("SMTP_USER", "")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") == "1"
+SMTP_SENDER = os.getenv("SMTP_SENDER", "qc-reports@localhost")
+ERP_UPLOAD_URL = os.getenv("ERP_UPLOAD_URL", "")
+ERP_UPLOAD_TOKEN = os.getenv("ERP_UPLOAD_TOKEN", "")
+
+# Deliveries sent over one connection per batch
+BATCH_SIZE = int(os.getenv("DELIVERY_BATCH_SIZE", "20"))
+MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "8"))
+# Backoff: RETRY_BASE * 2^(attempt-1) seconds with jitter, at most RETRY_MAX
+RETRY_BASE = float(os.getenv("DELIVERY_RETRY_BASE", "30"))
+RETRY_MAX = float(os.getenv("DELIVERY_RETRY_MAX", "3600"))
+# Pooled connections idle this long are closed
+IDLE_SECONDS = 60.0
+# Claimed rows not finished in this time (crashed worker) are sent again
+CLAIM_SECONDS = 600.0
+CONNECT_TIMEOUT = 30.0
+
+CHANNELS = ["email", "erp"]
+DELIVERY_STATUSES = ["pending", "sending", "sent", "failed"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS delivery_payloads (
+    sha256 TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS deliveries (
+    delivery_id TEXT PRIMARY KEY,
+    report_id TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    subject TEXT,
+    filename TEXT NOT NULL,
+    pdf_lang TEXT NOT NULL DEFAULT 'en',
+    payload_sha256 TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    claimed_at REAL,
+    last_error TEXT,
+    response TEXT,
+    created_at TEXT NOT NULL,
+    sent_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_deliveries_due ON deliveries(status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS idx_deliveries_report ON deliveries(report_id);
+"""
+
+
+class DeliveryError(Exception):
+    """A failed send; `permanent` errors are not retried, `retry_after` overrides the backoff"""
+
+    def __init__(self, message, permanent=False, retry_after=None):
+        super().__init__(message)
+        self.permanent = permanent
+        self.retry_after = retry_after
+
+
+def backoff_seconds(attempts):
+    """Delay before the next attempt after `attempts` failures"""
+    delay = min(RETRY_BASE * 2 ** (attempts - 1), RETRY_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def parse_recipients(text):
+    """Email addresses from comma, semicolon or line separated text"""
+    parts = (text or "").replace(";", ",").replace("\n", ",").split(",")
+    return [part.strip() for part in parts if "@" in part]
+
+
+class SMTPTransport:
+    """One pooled SMTP connection; send_batch sends several messages over it"""
+
+    channel = "email"
+
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, user=SMTP_USER, password=SMTP_PASSWORD,
+                 starttls=SMTP_STARTTLS, sender=SMTP_SENDER):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self.sender = sender
+        self._smtp = None
+        self._last_used = 0.0
+
+    @property
+    def configured(self):
+        return bool(self.host)
+
+    def destination(self, recipient):
+        # One connection serves every recipient
+        return self.host
+
+    def _connection(self):
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (OSError, smtplib.SMTPException):
+                pass
+            self.close()
+        smtp = smtplib.SMTP(self.host, self.port, timeout=CONNECT_TIMEOUT)
+        if self.starttls:
+            smtp.starttls()
+        if self.user:
+            smtp.login(self.user, self.password)
+        self._smtp = smtp
+        return smtp
+
+    def send_batch(self, items):
+        """Send [(delivery row, pdf bytes)]; returns {delivery id: response text or DeliveryError}"""
+        if not self.configured:
+            raise DeliveryError("SMTP_HOST is not set")
+        try:
+            smtp = self._connection()
+        except (OSError, smtplib.SMTPException) as e:
+            self.close()
+            raise DeliveryError(f"SMTP connection failed: {e}")
+
+        results = {}
+        for row, pdf_bytes in items:
+            message = EmailMessage()
+            message["From"] = self.sender
+            message["To"] = row["recipient"]
+            message["Subject"] = row["subject"] or row["filename"]
+            message.set_content(
+                "Please find the production risk assessment report attached.\n\n"
+                "This report is confidential and property of the company. Unauthorized distribution is prohibited."
+            )
+            message.add_attachment(pdf_bytes, maintype="application", subtype="pdf", filename=row["filename"])
+            try:
+                smtp.send_message(message)
+                results[row["delivery_id"]] = "250 accepted"
+            except smtplib.SMTPRecipientsRefused as e:
+                code, reply = next(iter(e.recipients.values()))
+                results[row["delivery_id"]] = DeliveryError(f"{code} {reply.decode(errors='replace')}", permanent=code >= 500)
+            except smtplib.SMTPResponseException as e:
+                results[row["delivery_id"]] = DeliveryError(
+                    f"{e.smtp_code} {e.smtp_error.decode(errors='replace')}", permanent=e.smtp_code >= 500
+                )
+            except (OSError, smtplib.SMTPException) as e:
+                # Connection lost: this and the remaining messages are retried later
+                self.close()
+                for remaining, _ in items:
+                    results.setdefault(remaining["delivery_id"], DeliveryError(f"SMTP connection lost: {e}"))
+                break
+        self._last_used = time.time()
+        return results
+
+    def close_idle(self, now):
+        if self._smtp is not None and now - self._last_used > IDLE_SECONDS:
+            self.close()
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (OSError, smtplib.SMTPException):
+                pass
+            self._smtp = None
+
+
+class HTTPTransport:
+    """Keep-alive HTTP connections per host for ERP uploads"""
+
+    channel = "erp"
+
+    def __init__(self, url=ERP_UPLOAD_URL, token=ERP_UPLOAD_TOKEN):
+        # Upload endpoint for new deliveries; rows keep the URL they were queued with
+        self.url = url
+        self.token = token
+        # (scheme, netloc) -> (connection, last used)
+        self._connections = {}
+
+    @property
+    def configured(self):
+        return bool(self.url)
+
+    def destination(self, recipient):
+        parts = urlsplit(recipient)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def _connection(self, url):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        pooled = self._connections.get(key)
+        if pooled:
+            return pooled[0]
+        connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        connection = connection_class(parts.netloc, timeout=CONNECT_TIMEOUT)
+        self._connections[key] = (connection, time.time())
+        return connection
+
+    def _drop(self, url):
+        parts = urlsplit(url)
+        pooled = self._connections.pop((parts.scheme, parts.netloc), None)
+        if pooled:
+            pooled[0].close()
+
+    def _post(self, row, pdf_bytes):
+        parts = urlsplit(row["recipient"])
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        headers = {
+            "Content-Type": "application/pdf",
+            "Content-Disposition": f'attachment; filename="{row["filename"]}"',
+            "X-Report-Id": row["report_id"],
+            "X-Delivery-Id": row["delivery_id"]
+        }
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        connection = self._connection(row["recipient"])
+        connection.request("POST", path, body=pdf_bytes, headers=headers)
+        response = connection.getresponse()
+        # Read the body fully so the connection can be reused
+        body = response.read()
+        if response.will_close:
+            self._drop(row["recipient"])
+        return response.status, response.getheader("Retry-After"), body
+
+    def send_batch(self, items):
+        """Send [(delivery row, pdf bytes)]; returns {delivery id: response text or DeliveryError}"""
+        results = {}
+        for row, pdf_bytes in items:
+            try:
+                try:
+                    status, retry_after, body = self._post(row, pdf_bytes)
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    # The server closed an idle keep-alive connection; retry once on a new one
+                    self._drop(row["recipient"])
+                    status, retry_after, body = self._post(row, pdf_bytes)
+            except (OSError, http.client.HTTPException) as e:
+                self._drop(row["recipient"])
+                results[row["delivery_id"]] = DeliveryError(f"Upload failed: {e}")
+                continue
+            text = f"{status} {body[:200].decode('utf-8', errors='replace')}".strip()
+            if 200 <= status < 300:
+                results[row["delivery_id"]] = text
+            elif status in (408, 429) or status >= 500:
+                results[row["delivery_id"]] = DeliveryError(
+                    text, retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None
+                )
+            else:
+                results[row["delivery_id"]] = DeliveryError(text, permanent=True)
+        now = time.time()
+        for key, (connection, _) in list(self._connections.items()):
+            self._connections[key] = (connection, now)
+        return results
+
+    def close_idle(self, now):
+        for key, (connection, last_used) in list(self._connections.items()):
+            if now - last_used > IDLE_SECONDS:
+                connection.close()
+                del self._connections[key]
+
+    def close(self):
+        for connection, _ in self._connections.values():
+            connection.close()
+        self._connections.clear()
+
+
+class DeliveryQueue:
+    """Durable outbound queue with a background sender thread"""
+
+    def __init__(self, render=None, path=DEFAULT_DB_PATH, transports=None, batch_size=BATCH_SIZE,
+                 max_attempts=MAX_ATTEMPTS):
+        # render(report_id, pdf_lang) -> pdf bytes, for deliveries queued without a PDF
+        self.render = render
+        self.path = path
+        self.transports = transports or {transport.channel: transport for transport in (SMTPTransport(), HTTPTransport())}
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.worker_id = uuid.uuid4().hex
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def configured_channels(self):
+        return [channel for channel, transport in self.transports.items() if transport.configured]
+
+    def enqueue(self, report_id, targets, filename, subject=None, pdf_bytes=None, pdf_lang="en"):
+        """Queue a report for [(channel, recipient)] targets; returns the new delivery ids.
+
+        Targets already waiting for this report are not queued twice. Without
+        `pdf_bytes` the PDF is rendered in `pdf_lang` when the row is sent.
+        """
+        sha256 = hashlib.sha256(pdf_bytes).hexdigest() if pdf_bytes is not None else None
+        now = time.time()
+        created_at = datetime.now().isoformat(timespec="seconds")
+        delivery_ids = []
+        with self._transaction() as conn:
+            if pdf_bytes is not None:
+                conn.execute(
+                    "INSERT OR IGNORE INTO delivery_payloads (sha256, data) VALUES (?, ?)",
+                    (sha256, sqlite3.Binary(pdf_bytes))
+                )
+            for channel, recipient in targets:
+                if channel not in self.transports:
+                    raise ValueError(f"Unknown delivery channel: {channel}")
+                waiting = conn.execute(
+                    "SELECT delivery_id FROM deliveries WHERE report_id = ? AND channel = ? AND recipient = ?"
+                    " AND status IN ('pending', 'sending')",
+                    (report_id, channel, recipient)
+                ).fetchone()
+                if waiting:
+                    if sha256:
+                        # Send the newest PDF
+                        conn.execute(
+                            "UPDATE deliveries SET payload_sha256 = ?, filename = ?, subject = ? WHERE delivery_id = ?",
+                            (sha256, filename, subject, waiting["delivery_id"])
+                        )
+                    continue
+                delivery_id = uuid.uuid4().hex
+                conn.execute(
+                    """
+                    INSERT INTO deliveries (delivery_id, report_id, channel, recipient, subject, filename,
+                                            pdf_lang, payload_sha256, next_attempt_at, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (delivery_id, report_id, channel, recipient, subject, filename, pdf_lang, sha256, now, created_at)
+                )
+                delivery_ids.append(delivery_id)
+        self._wake.set()
+        return delivery_ids
+
+    def retry(self, delivery_id):
+        """Send a failed delivery again now"""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE deliveries SET status = 'pending', attempts = 0, next_attempt_at = ? "
+                "WHERE delivery_id = ? AND status = 'failed'",
+                (time.time(), delivery_id)
+            )
+        self._wake.set()
+
+    def deliveries(self, report_id):
+        """Delivery rows of one report, newest first (without payloads)"""
+        rows = self._connection().execute(
+            """
+            SELECT delivery_id, channel, recipient, status, attempts, last_error, response, created_at, sent_at
+            FROM deliveries WHERE report_id = ? ORDER BY created_at DESC
+            """,
+            (report_id,)
+        )
+        return [dict(row) for row in rows]
+
+    def status_counts(self):
+        """{status: number of deliveries}"""
+        rows = self._connection().execute("SELECT status, COUNT(*) AS n FROM deliveries GROUP BY status")
+        return {row["status"]: row["n"] for row in rows}
+
+    def recent_recipients(self, report_ids, channel="email"):
+        """Addresses that earlier reports were sent to (used to prefill a factory's contacts)"""
+        if not report_ids:
+            return []
+        placeholders = ", ".join("?" * len(report_ids))
+        rows = self._connection().execute(
+            f"""
+            SELECT recipient, MAX(created_at) AS last_used FROM deliveries
+            WHERE channel = ? AND report_id IN ({placeholders}) AND status != 'failed'
+            GROUP BY recipient ORDER BY last_used DESC
+            """,
+            [channel] + list(report_ids)
+        )
+        return [row["recipient"] for row in rows]
+
+    # Worker
+
+    def drop_payloads(self, before):
+        """Delete stored PDFs only finished deliveries created before `before` (ISO time) use.
+
+        Their rows keep everything else; a retry renders the PDF again (an
+        archived report with its pinned template). Returns the number dropped.
+        """
+        with self._transaction() as conn:
+            dropped = conn.execute(
+                """
+                DELETE FROM delivery_payloads WHERE sha256 NOT IN (
+                    SELECT payload_sha256 FROM deliveries WHERE payload_sha256 IS NOT NULL
+                      AND (status IN ('pending', 'sending') OR created_at >= ?)
+                )
+                """,
+                (before,)
+            ).rowcount
+            conn.execute(
+                "UPDATE deliveries SET payload_sha256 = NULL WHERE payload_sha256 IS NOT NULL "
+                "AND payload_sha256 NOT IN (SELECT sha256 FROM delivery_payloads)"
+            )
+        return dropped
+
+    def start(self):
+        """Start the background sender (once)"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="delivery-queue", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        for transport in self.transports.values():
+            transport.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                sent_any = self.process_due()
+            except Exception:
+                sent_any = False
+            now = time.time()
+            for transport in self.transports.values():
+                transport.close_idle(now)
+            if sent_any:
+                continue
+            self._wake.wait(self._seconds_until_due())
+            self._wake.clear()
+
+    def _seconds_until_due(self):
+        row = self._connection().execute(
+            "SELECT MIN(next_attempt_at) AS due FROM deliveries WHERE status = 'pending'"
+        ).fetchone()
+        if row["due"] is None:
+            return IDLE_SECONDS
+        return min(max(row["due"] - time.time(), 0.5), IDLE_SECONDS)
+
+    def _claim(self):
+        """Claim one batch of due deliveries sharing a channel and destination"""
+        now = time.time()
+        with self._transaction() as conn:
+            # Rows claimed by a worker that died mid-send
+            conn.execute(
+                "UPDATE deliveries SET status = 'pending' WHERE status = 'sending' AND claimed_at < ?",
+                (now - CLAIM_SECONDS,)
+            )
+            rows = conn.execute(
+                "SELECT * FROM deliveries WHERE status = 'pending' AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT ?",
+                (now, self.batch_size * 4)
+            ).fetchall()
+            if not rows:
+                return []
+            first = rows[0]
+            transport = self.transports.get(first["channel"])
+            destination = transport.destination(first["recipient"]) if transport else None
+            batch = [
+                row for row in rows
+                if row["channel"] == first["channel"]
+                and (transport is None or transport.destination(row["recipient"]) == destination)
+            ][:self.batch_size]
+            conn.executemany(
+                "UPDATE deliveries SET status = 'sending', claimed_at = ? WHERE delivery_id = ?",
+                [(now, row["delivery_id"]) for row in batch]
+            )
+        return [dict(row) for row in batch]
+
+    def _payload(self, row):
+        if row["payload_sha256"]:
+            found = self._connection().execute(
+                "SELECT data FROM delivery_payloads WHERE sha256 = ?", (row["payload_sha256"],)
+            ).fetchone()
+            if found:
+                return bytes(found["data"])
+        if self.render is None:
+            raise DeliveryError("No PDF queued and no renderer available", permanent=True)
+        pdf_bytes = self.render(row["report_id"], row["pdf_lang"])
+        sha256 = hashlib.sha256(pdf_bytes).hexdigest()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO delivery_payloads (sha256, data) VALUES (?, ?)",
+                (sha256, sqlite3.Binary(pdf_bytes))
+            )
+            # Other rows waiting for the same rendering reuse it
+            conn.execute(
+                "UPDATE deliveries SET payload_sha256 = ? WHERE report_id = ? AND pdf_lang = ? "
+                "AND payload_sha256 IS NULL AND status IN ('pending', 'sending')",
+                (sha256, row["report_id"], row["pdf_lang"])
+            )
+        return pdf_bytes
+
+    def process_due(self):
+        """Send one batch of due deliveries; returns True if there was one"""
+        batch = self._claim()
+        if not batch:
+            return False
+
+        results = {}
+        items = []
+        for row in batch:
+            try:
+                items.append((row, self._payload(row)))
+            except DeliveryError as e:
+                results[row["delivery_id"]] = e
+            except Exception as e:
+                results[row["delivery_id"]] = DeliveryError(f"Rendering failed: {e}")
+
+        transport = self.transports.get(batch[0]["channel"])
+        if items:
+            try:
+                if transport is None:
+                    raise DeliveryError(f"Unknown delivery channel: {batch[0]['channel']}", permanent=True)
+                results.update(transport.send_batch(items))
+            except DeliveryError as e:
+                for row, _ in items:
+                    results.setdefault(row["delivery_id"], e)
+
+        self._record(batch, results)
+        return True
+
+    def _record(self, batch, results):
+        now = time.time()
+        sent_at = datetime.now().isoformat(timespec="seconds")
+        with self._transaction() as conn:
+            for row in batch:
+                result = results.get(row["delivery_id"], DeliveryError("Not sent"))
+                attempts = row["attempts"] + 1
+                if not isinstance(result, DeliveryError):
+                    conn.execute(
+                        "UPDATE deliveries SET status = 'sent', attempts = ?, response = ?, last_error = NULL, "
+                        "sent_at = ? WHERE delivery_id = ?",
+                        (attempts, result, sent_at, row["delivery_id"])
+                    )
+                elif result.permanent or attempts >= self.max_attempts:
+                    conn.execute(
+                        "UPDATE deliveries SET status = 'failed', attempts = ?, last_error = ? WHERE delivery_id = ?",
+                        (attempts, str(result), row["delivery_id"])
+                    )
+                else:
+                    delay = result.retry_after if result.retry_after is not None else backoff_seconds(attempts)
+                    conn.execute(
+                        "UPDATE deliveries SET status = 'pending', attempts = ?, last_error = ?, next_attempt_at = ? "
+                        "WHERE delivery_id = ?",
+                        (attempts, str(result), now + delay, row["delivery_id"])
+                    )
@@ -0,0 +1,599 @@
+"""Weekly per-factory digest PDFs for management.
+
+Each digest summarizes one factory's week: new assessments, CAPs still
+missing on open reports and risk stages that keep coming back. The numbers
+come from per-factory state kept in the report database and updated
+incrementally - every run only reads reports saved since the previous run,
+subtracting a changed report's old contribution and adding the new one - so
+the cost of a run follows the week's activity, not the size of the history.
+
+Digests use the report styles and the PDFWithHeaderFooter header/footer of
+pdf_report, and are rendered in parallel (in render pool workers when a pool
+is given). DigestScheduler runs once a week (DIGEST_WEEKDAY/DIGEST_HOUR,
+China time) for the week that just ended; a week is claimed in the database
+so several app processes produce it only once. Digests are written to
+DIGEST_DIR/<week start>/<factory>-<hash>.pdf. Run by hand or from cron with
+
+    python digest.py [--week 2025-03-03] [--workers 4]
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from xml.sax.saxutils import escape
+
+import pytz
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import inch
+from reportlab.platypus import LongTable, Paragraph, Spacer, Table, TableStyle
+
+from pdf_import import IMPORT_AUTHOR
+from pdf_report import CHINA_TZ, PDFWithHeaderFooter, build_styles, font_variant, register_pdf_font
+from report_record import ALL_RISK_STAGES, is_open, normalize_name, stage_status
+from risk_scoring import RISK_LEVEL_COLORS, overall_score, risk_level
+
+DEFAULT_DB_PATH = os.getenv("REPORT_DB_PATH", "reports.db")
+DIGEST_DIR = os.getenv("DIGEST_DIR", "digests")
+DIGEST_LANGUAGE = os.getenv("DIGEST_LANGUAGE", "en")
+# Monday 07:00 China time by default
+DIGEST_WEEKDAY = int(os.getenv("DIGEST_WEEKDAY", "0"))
+DIGEST_HOUR = int(os.getenv("DIGEST_HOUR", "7"))
+DIGEST_WORKERS = int(os.getenv("DIGEST_WORKERS", "4"))
+# A run still marked running after this long is assumed dead and redone
+STALE_RUN_SECONDS = 3600
+
+# Seconds of already processed changes re-read on each update
+WATERMARK_OVERLAP = 60
+
+# A stage raised in at least this many reports of a factory is a repeat risk
+REPEAT_THRESHOLD = 2
+
+STAGE_TITLES = {stage["key"]: stage["title"] for stage in ALL_RISK_STAGES}
+
+SCHEMA = """
+-- Digest view of each saved report
+CREATE TABLE IF NOT EXISTS digest_reports (
+    report_id TEXT PRIMARY KEY,
+    factory TEXT NOT NULL,
+    po_number TEXT,
+    style TEXT,
+    brand TEXT,
+    assessment_date TEXT,
+    created_at TEXT,
+    is_open INTEGER NOT NULL,
+    overall_score INTEGER NOT NULL,
+    -- {stage: [raised, CAP missing while open]} this report adds to digest_stage_counts
+    stages TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_digest_reports_created ON digest_reports(factory, created_at);
+CREATE INDEX IF NOT EXISTS idx_digest_reports_open ON digest_reports(factory, is_open);
+
+-- Per factory and stage: reports raising the stage, and open reports still missing its CAP
+CREATE TABLE IF NOT EXISTS digest_stage_counts (
+    factory TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    report_count INTEGER NOT NULL DEFAULT 0,
+    open_cap_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (factory, stage)
+);
+
+CREATE TABLE IF NOT EXISTS digest_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+
+CREATE TABLE IF NOT EXISTS digest_runs (
+    week_start TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    digest_count INTEGER,
+    error TEXT
+);
+"""
+
+
+def factory_slug(factory):
+    return re.sub(r"[^\w-]+", "_", factory).strip("_") or "unnamed"
+
+
+def digest_filename(factory):
+    """PDF file name of a factory's digest; the hash keeps "ABC Co." and "ABC Co" apart"""
+    digest_hash = hashlib.sha1(factory.encode("utf-8")).hexdigest()[:8]
+    return f"{factory_slug(factory)}-{digest_hash}.pdf"
+
+
+def last_week(now=None):
+    """Monday of the most recent full Monday-Sunday week (China time)"""
+    today = (now or datetime.now(CHINA_TZ)).date()
+    return today - timedelta(days=today.weekday() + 7)
+
+
+def day_start_utc(day):
+    """Start of a China-time calendar day as a UTC ISO string, comparable with report timestamps"""
+    start = CHINA_TZ.localize(datetime.combine(day, datetime.min.time()))
+    return start.astimezone(pytz.utc).replace(tzinfo=None).isoformat(timespec="seconds")
+
+
+def week_bounds_utc(week_start):
+    """(start, end) of a China-time week as UTC ISO strings, comparable with report timestamps"""
+    return day_start_utc(week_start), day_start_utc(week_start + timedelta(days=7))
+
+
+def assessment_start_utc(record):
+    """Start of a report's assessment date as a UTC ISO string, or None without a valid date"""
+    try:
+        return day_start_utc(date.fromisoformat(record.get("assessment_date") or ""))
+    except ValueError:
+        return None
+
+
+def digest_row(record, created_at, imported=False):
+    """Digest view of one report, including its {stage: [raised, CAP missing while open]}.
+
+    An imported report is a new assessment in the week of its assessment
+    date, not the week it was imported.
+    """
+    if imported:
+        created_at = assessment_start_utc(record)
+    open_report = is_open(record)
+    stages = {
+        stage["key"]: [1, 1 if open_report and not has_cap else 0]
+        for stage, has_risk, has_cap in stage_status(record)
+        if has_risk
+    }
+    return {
+        "report_id": record["report_id"],
+        "factory": normalize_name(record.get("factory")),
+        "po_number": record.get("po_number") or "",
+        "style": record.get("style") or "",
+        "brand": record.get("brand") or "",
+        "assessment_date": record.get("assessment_date") or "",
+        "created_at": created_at,
+        "is_open": 1 if open_report else 0,
+        "overall_score": overall_score(record),
+        "stages": json.dumps(stages)
+    }
+
+
+class DigestBuilder:
+    """Incrementally maintained per-factory digest state, and the digests built from it"""
+
+    def __init__(self, store, path=DEFAULT_DB_PATH):
+        # ReportStore the changes are read from; the state lives in the same database
+        self.store = store
+        self.path = path
+        self._local = threading.local()
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def _apply_stages(self, conn, factory, stages, sign):
+        conn.executemany(
+            """
+            INSERT INTO digest_stage_counts (factory, stage, report_count, open_cap_count)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (factory, stage) DO UPDATE SET
+                report_count = report_count + excluded.report_count,
+                open_cap_count = open_cap_count + excluded.open_cap_count
+            """,
+            [(factory, stage, sign * raised, sign * missing) for stage, (raised, missing) in stages.items()]
+        )
+
+    def update_state(self, batch_size=500):
+        """Fold reports saved since the last update into the digest state; returns how many were read"""
+        conn = self._connection()
+        found = conn.execute("SELECT value FROM digest_state WHERE key = 'watermark'").fetchone()
+        watermark = found["value"] if found else None
+        if watermark:
+            # Re-read a little before the watermark: a save stamped just before it may commit after
+            # the last run read, and folding a report in again is harmless
+            watermark = (datetime.fromisoformat(watermark) - timedelta(seconds=WATERMARK_OVERLAP)).isoformat()
+        processed = 0
+        batch = []
+
+        def flush():
+            authors = self.store.first_authors(record["report_id"] for record, _, _ in batch)
+            with self._transaction() as conn:
+                for record, created_at, _ in batch:
+                    old = conn.execute(
+                        "SELECT factory, stages FROM digest_reports WHERE report_id = ?", (record["report_id"],)
+                    ).fetchone()
+                    if old:
+                        self._apply_stages(conn, old["factory"], json.loads(old["stages"]), -1)
+                    row = digest_row(record, created_at, authors.get(record["report_id"]) == IMPORT_AUTHOR)
+                    self._apply_stages(conn, row["factory"], json.loads(row["stages"]), 1)
+                    conn.execute(
+                        f"INSERT OR REPLACE INTO digest_reports ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})",
+                        list(row.values())
+                    )
+                conn.execute(
+                    "INSERT OR REPLACE INTO digest_state (key, value) VALUES ('watermark', ?)", (batch[-1][2],)
+                )
+            batch.clear()
+
+        for change in self.store.iter_changes(watermark, batch_size):
+            batch.append(change)
+            processed += 1
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+        return processed
+
+    def factories_to_report(self, week_start):
+        """Factories with new assessments in the week or open CAPs"""
+        start, end = week_bounds_utc(week_start)
+        rows = self._connection().execute(
+            """
+            SELECT DISTINCT factory FROM digest_reports WHERE created_at >= ? AND created_at < ?
+            UNION
+            SELECT factory FROM digest_stage_counts GROUP BY factory HAVING SUM(open_cap_count) > 0
+            ORDER BY factory
+            """,
+            (start, end)
+        )
+        return [row["factory"] for row in rows]
+
+    def digest(self, factory, week_start):
+        """JSON-serializable contents of one factory's digest for the week starting `week_start`"""
+        conn = self._connection()
+        start, end = week_bounds_utc(week_start)
+        new_reports = [
+            dict(row) for row in conn.execute(
+                """
+                SELECT po_number, style, brand, assessment_date, overall_score FROM digest_reports
+                WHERE factory = ? AND created_at >= ? AND created_at < ? ORDER BY assessment_date, po_number
+                """,
+                (factory, start, end)
+            )
+        ]
+        open_caps = []
+        for row in conn.execute(
+            """
+            SELECT po_number, style, assessment_date, stages FROM digest_reports
+            WHERE factory = ? AND is_open = 1 ORDER BY assessment_date, po_number
+            """,
+            (factory,)
+        ):
+            for stage, (_, missing) in json.loads(row["stages"]).items():
+                if missing:
+                    open_caps.append({
+                        "po_number": row["po_number"], "style": row["style"],
+                        "assessment_date": row["assessment_date"], "stage": STAGE_TITLES.get(stage, stage)
+                    })
+        repeat_stages = [
+            {"stage": STAGE_TITLES.get(row["stage"], row["stage"]), "reports": row["report_count"],
+             "open_caps": row["open_cap_count"]}
+            for row in conn.execute(
+                """
+                SELECT stage, report_count, open_cap_count FROM digest_stage_counts
+                WHERE factory = ? AND report_count >= ? ORDER BY report_count DESC, open_cap_count DESC
+                """,
+                (factory, REPEAT_THRESHOLD)
+            )
+        ]
+        return {
+            "factory": factory,
+            "week_start": week_start.isoformat(),
+            "week_end": (week_start + timedelta(days=6)).isoformat(),
+            "new_reports": new_reports,
+            "open_caps": open_caps,
+            "repeat_stages": repeat_stages
+        }
+
+
+def build_digest_pdf(digest, pdf_lang="en", translate=None, on_warning=None):
+    """Lay out one factory digest with the report styles and header/footer; returns a BytesIO"""
+    buffer = io.BytesIO()
+    translate_pdf_content = translate or (lambda text, lang: text)
+    warn = on_warning or (lambda message: None)
+    chinese_font, font_warnings = register_pdf_font(pdf_lang)
+    for warning in font_warnings:
+        warn(warning)
+    report_styles = build_styles(pdf_lang, chinese_font)
+    palette = report_styles["colors"]
+    normal_style = report_styles["normal"]
+    bold_font = report_styles["bold_font"]
+
+    def cell(text, bold=False):
+        return Paragraph(text, font_variant(normal_style, bold_font) if bold else normal_style)
+
+    def table(headers, rows, widths, level_column=None):
+        data = [[cell(translate_pdf_content(header, pdf_lang), bold=True) for header in headers]]
+        data += [[cell(str(value)) for value in row] for row in rows]
+        style = [
+            ('BACKGROUND', (0, 0), (-1, 0), palette["secondary"]),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+            ('GRID', (0, 0), (-1, -1), 0.5, palette["grid"]),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, palette["alternate_row"]])
+        ]
+        if level_column is not None:
+            for i, row in enumerate(rows, start=1):
+                level = row[level_column].split(" (")[0]
+                style.append(('BACKGROUND', (level_column, i), (level_column, i),
+                              colors.HexColor(RISK_LEVEL_COLORS.get(level, RISK_LEVEL_COLORS["Not rated"]))))
+        # Header row repeats on every page
+        long_table = LongTable(data, colWidths=[width * inch for width in widths], repeatRows=1)
+        long_table.setStyle(TableStyle(style))
+        return long_table
+
+    def none_text():
+        return Paragraph(translate_pdf_content("None.", pdf_lang), normal_style)
+
+    doc = PDFWithHeaderFooter(
+        buffer,
+        pagesize=A4,
+        pageCompression=1,
+        topMargin=0.8*inch,
+        bottomMargin=0.8*inch,
+        header_text=f"WEEKLY DIGEST - {digest['factory']}",
+        location=digest["factory"],
+        pdf_language=pdf_lang,
+        chinese_font=chinese_font,
+        generated_at=datetime.now(CHINA_TZ),
+        report_styles=report_styles
+    )
+
+    elements = [
+        Spacer(1, 10),
+        Paragraph(escape(digest["factory"]), report_styles["company"]),
+        Paragraph(translate_pdf_content("Weekly Factory Risk Digest", pdf_lang), report_styles["title"]),
+        Paragraph(
+            translate_pdf_content(f"Week {digest['week_start']} to {digest['week_end']}", pdf_lang),
+            report_styles["subtitle"]
+        )
+    ]
+
+    summary = Table(
+        [
+            [cell(translate_pdf_content(label, pdf_lang), bold=True) for label in
+             ("New assessments", "Open CAPs", "Repeat risk stages")],
+            [cell(str(len(digest[key]))) for key in ("new_reports", "open_caps", "repeat_stages")]
+        ],
+        colWidths=[2.3*inch] * 3
+    )
+    summary.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), palette["label_background"]),
+        ('GRID', (0, 0), (-1, -1), 0.5, palette["basic_grid"]),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER')
+    ]))
+    elements += [summary, Spacer(1, 15)]
+
+    elements.append(Paragraph(f"1. {translate_pdf_content('NEW ASSESSMENTS', pdf_lang)}", report_styles["heading"]))
+    if digest["new_reports"]:
+        elements.append(table(
+            ["PO / Order Number", "Style / Model", "Brand / Trademark", "Assessment Date", "Overall Result"],
+            [
+                [escape(report["po_number"]), escape(report["style"]), escape(report["brand"]),
+                 report["assessment_date"] or "",
+                 f"{risk_level(report['overall_score'])} ({report['overall_score']})"]
+                for report in digest["new_reports"]
+            ],
+            [1.4, 1.5, 1.4, 1.2, 1.4],
+            level_column=4
+        ))
+    else:
+        elements.append(none_text())
+    elements.append(Spacer(1, 15))
+
+    elements.append(Paragraph(f"2. {translate_pdf_content('OPEN CAPS', pdf_lang)}", report_styles["heading"]))
+    if digest["open_caps"]:
+        elements.append(table(
+            ["PO / Order Number", "Style / Model", "Risk Stage", "Assessment Date"],
+            [
+                [escape(cap["po_number"]), escape(cap["style"]),
+                 translate_pdf_content(cap["stage"], pdf_lang), cap["assessment_date"] or ""]
+                for cap in digest["open_caps"]
+            ],
+            [1.6, 1.8, 2.3, 1.2]
+        ))
+    else:
+        elements.append(none_text())
+    elements.append(Spacer(1, 15))
+
+    elements.append(Paragraph(f"3. {translate_pdf_content('REPEAT RISK STAGES', pdf_lang)}", report_styles["heading"]))
+    if digest["repeat_stages"]:
+        elements.append(table(
+            ["Risk Stage", "Reports", "Open CAPs"],
+            [
+                [translate_pdf_content(stage["stage"], pdf_lang), stage["reports"], stage["open_caps"]]
+                for stage in digest["repeat_stages"]
+            ],
+            [3.9, 1.5, 1.5]
+        ))
+    else:
+        elements.append(none_text())
+
+    doc.build(elements)
+    buffer.seek(0)
+    return buffer
+
+
+def render_digest(digest, pdf_lang="en"):
+    """Render one digest in this process; returns (pdf bytes, warnings)"""
+    warnings = []
+    buffer = build_digest_pdf(digest, pdf_lang, on_warning=warnings.append)
+    return buffer.getvalue(), warnings
+
+
+class DigestScheduler:
+    """Produces every factory's digest once a week, in parallel"""
+
+    def __init__(self, builder, render_pool=None, out_dir=DIGEST_DIR, pdf_lang=DIGEST_LANGUAGE,
+                 workers=DIGEST_WORKERS, on_digest=None):
+        self.builder = builder
+        # RenderPool whose workers lay out the digests; without one they are laid out on threads here
+        self.render_pool = render_pool
+        self.out_dir = out_dir
+        self.pdf_lang = pdf_lang
+        self.workers = workers
+        # on_digest(factory, week_start, path, pdf bytes) after each digest is written, e.g. to email it
+        self.on_digest = on_digest
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _render(self, digest):
+        if self.render_pool is not None:
+            return self.render_pool.render(digest, self.pdf_lang, document="digest")
+        return render_digest(digest, self.pdf_lang)
+
+    def _claim(self, week_start, force):
+        now = time.time()
+        with self.builder._transaction() as conn:
+            run = conn.execute(
+                "SELECT status, started_at FROM digest_runs WHERE week_start = ?", (week_start.isoformat(),)
+            ).fetchone()
+            if run and not force and (run["status"] == "done" or now - run["started_at"] < STALE_RUN_SECONDS):
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO digest_runs (week_start, status, started_at) VALUES (?, 'running', ?)",
+                (week_start.isoformat(), now)
+            )
+        return True
+
+    def _finish(self, week_start, status, digest_count=None, error=None):
+        with self.builder._transaction() as conn:
+            conn.execute(
+                "UPDATE digest_runs SET status = ?, finished_at = ?, digest_count = ?, error = ? WHERE week_start = ?",
+                (status, time.time(), digest_count, error, week_start.isoformat())
+            )
+
+    def run(self, week_start=None, force=False):
+        """Build the week's digests (last week by default); returns {factory: path}.
+
+        Returns {} without doing anything if the week was already produced
+        (or is being produced elsewhere), unless `force`.
+        """
+        week_start = week_start or last_week()
+        if not self._claim(week_start, force):
+            return {}
+        try:
+            self.builder.update_state()
+            digests = [self.builder.digest(factory, week_start) for factory in self.builder.factories_to_report(week_start)]
+            week_dir = os.path.join(self.out_dir, week_start.isoformat())
+            os.makedirs(week_dir, exist_ok=True)
+
+            paths = {}
+            with ThreadPoolExecutor(max_workers=max(1, self.workers), thread_name_prefix="digest") as executor:
+                for digest, (pdf_bytes, _) in zip(digests, executor.map(self._render, digests)):
+                    path = os.path.join(week_dir, digest_filename(digest["factory"]))
+                    with open(path, "wb") as fh:
+                        fh.write(pdf_bytes)
+                    paths[digest["factory"]] = path
+                    if self.on_digest:
+                        self.on_digest(digest["factory"], week_start, path, pdf_bytes)
+        except Exception as e:
+            self._finish(week_start, "failed", error=str(e))
+            raise
+        self._finish(week_start, "done", len(paths))
+        return paths
+
+    def runs(self, limit=10):
+        """Most recent digest runs"""
+        rows = self.builder._connection().execute(
+            "SELECT week_start, status, digest_count, error FROM digest_runs ORDER BY week_start DESC LIMIT ?",
+            (limit,)
+        )
+        return [dict(row) for row in rows]
+
+    def digest_files(self, week_start):
+        """{factory file name: path} of the digests written for a week"""
+        week_dir = os.path.join(self.out_dir, week_start)
+        if not os.path.isdir(week_dir):
+            return {}
+        return {name: os.path.join(week_dir, name) for name in sorted(os.listdir(week_dir)) if name.endswith(".pdf")}
+
+    def next_run_at(self, now=None):
+        """Next DIGEST_WEEKDAY DIGEST_HOUR:00 (China time)"""
+        now = now or datetime.now(CHINA_TZ)
+        run_at = now.replace(hour=DIGEST_HOUR, minute=0, second=0, microsecond=0)
+        run_at += timedelta(days=(DIGEST_WEEKDAY - now.weekday()) % 7)
+        if run_at <= now:
+            run_at += timedelta(days=7)
+        return run_at
+
+    def start(self):
+        """Run in the background from now on; a missed run for last week is made up at once"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="digest-scheduler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            # The week before the latest scheduled run time; does nothing once it was produced
+            latest_run_at = self.next_run_at() - timedelta(days=7)
+            try:
+                self.run(last_week(latest_run_at))
+            except Exception:
+                pass
+            wait = (self.next_run_at() - datetime.now(CHINA_TZ)).total_seconds()
+            self._stop.wait(min(max(wait, 1), 3600))
+
+
+def main(argv=None):
+    from render_pool import RenderPool
+    from report_store import ReportStore
+
+    parser = argparse.ArgumentParser(description="Build the weekly per-factory risk digests")
+    parser.add_argument("--week", help="Monday of the week (YYYY-MM-DD), default last week")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Report database path")
+    parser.add_argument("--out", default=DIGEST_DIR, help="Output directory")
+    parser.add_argument("--lang", default=DIGEST_LANGUAGE)
+    parser.add_argument("--workers", type=int, default=DIGEST_WORKERS, help="Parallel render processes")
+    parser.add_argument("--force", action="store_true", help="Rebuild a week that was already produced")
+    args = parser.parse_args(argv)
+
+    week_start = datetime.strptime(args.week, "%Y-%m-%d").date() if args.week else None
+    render_pool = RenderPool(workers=args.workers) if args.workers > 1 and os.name == "posix" else None
+    scheduler = DigestScheduler(
+        DigestBuilder(ReportStore(args.db), args.db), render_pool=render_pool, out_dir=args.out,
+        pdf_lang=args.lang, workers=args.workers
+    )
+    try:
+        paths = scheduler.run(week_start, force=args.force)
+    finally:
+        if render_pool:
+            render_pool.close()
+    for factory, path in paths.items():
+        print(f"{factory}: {path}")
+    print(f"Wrote {len(paths)} digests", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
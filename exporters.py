@@ -0,0 +1,172 @@
+"""Machine-readable exports (JSON, CSV, XLSX) of report records.
+
+Single reports are exported to bytes for the app's download buttons. Bulk
+exports stream records from the report store in batches and write rows as
+they arrive, so memory use stays flat regardless of history size.
+
+Usage:
+    python exporters.py --format csv --out reports.csv
+    python exporters.py --format xlsx --out reports.xlsx --db reports.db
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+
+from report_record import (
+    ALL_RISK_STAGES, BASIC_FIELDS, COMMENT_FIELDS, SIGNATURE_FIELDS, DATE_FIELDS,
+    risk_field, cap_field, severity_field, likelihood_field
+)
+from risk_scoring import stage_scores, risk_level
+
+EXPORT_FORMATS = ["json", "csv", "xlsx"]
+
+MIME_TYPES = {
+    "json": "application/json",
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+}
+
+
+def export_columns():
+    """Flat column order used by CSV and XLSX exports (every stage of every schema)"""
+    columns = ["report_id", "city", "risk_schema"] + BASIC_FIELDS + DATE_FIELDS
+    for stage in ALL_RISK_STAGES:
+        key = stage["key"]
+        columns += [
+            risk_field(key), cap_field(key), severity_field(key), likelihood_field(key),
+            f"{key}_score", f"{key}_level"
+        ]
+    columns += ["overall_score", "overall_level"] + COMMENT_FIELDS + SIGNATURE_FIELDS
+    return columns
+
+
+def record_to_row(record, columns=None):
+    """Flatten a record (plus computed scores) into a list of cell values"""
+    scores = stage_scores(record)
+    values = dict(record)
+    for key, score in scores.items():
+        values[f"{key}_score"] = score
+        values[f"{key}_level"] = risk_level(score)
+    values["overall_score"] = max(scores.values(), default=0)
+    values["overall_level"] = risk_level(values["overall_score"])
+    row = []
+    for column in columns or export_columns():
+        value = values.get(column)
+        row.append("" if value is None else value)
+    return row
+
+
+# Single report exports
+
+def export_json(record):
+    """One report as pretty-printed JSON bytes"""
+    return json.dumps(record, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def export_csv(record):
+    """One report as a CSV header plus one row"""
+    buffer = io.StringIO()
+    write_csv([record], buffer)
+    # UTF-8 BOM so Excel opens Chinese text correctly
+    return buffer.getvalue().encode("utf-8-sig")
+
+
+def export_xlsx(record):
+    """One report as an XLSX workbook"""
+    buffer = io.BytesIO()
+    write_xlsx([record], buffer)
+    return buffer.getvalue()
+
+
+def export_report(record, fmt):
+    """Dispatch a single report export by format name"""
+    exporters = {"json": export_json, "csv": export_csv, "xlsx": export_xlsx}
+    if fmt not in exporters:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    return exporters[fmt](record)
+
+
+# Streaming bulk exports
+
+def write_jsonl(records, fh):
+    """Write records as JSON Lines to a text file handle; returns the row count"""
+    count = 0
+    for record in records:
+        fh.write(json.dumps(record, ensure_ascii=False))
+        fh.write("\n")
+        count += 1
+    return count
+
+
+def write_csv(records, fh):
+    """Write records as CSV rows to a text file handle; returns the row count"""
+    columns = export_columns()
+    writer = csv.writer(fh)
+    writer.writerow(columns)
+    count = 0
+    for record in records:
+        writer.writerow(record_to_row(record, columns))
+        count += 1
+    return count
+
+
+def write_xlsx(records, target):
+    """Write records to an XLSX file path or binary handle; returns the row count.
+
+    File targets use xlsxwriter's constant-memory mode, which flushes each row
+    to disk as soon as it is written.
+    """
+    import xlsxwriter
+
+    in_memory = hasattr(target, "write")
+    workbook = xlsxwriter.Workbook(target, {"in_memory": in_memory, "constant_memory": not in_memory})
+    sheet = workbook.add_worksheet("Reports")
+    columns = export_columns()
+    sheet.write_row(0, 0, columns, workbook.add_format({"bold": True}))
+    count = 0
+    for record in records:
+        count += 1
+        sheet.write_row(count, 0, record_to_row(record, columns))
+    workbook.close()
+    return count
+
+
+def bulk_export(store, fmt, target, batch_size=1000):
+    """Stream every saved report from `store` into `target` (path or file handle)"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    records = store.iter_reports(batch_size=batch_size)
+    if fmt == "xlsx":
+        return write_xlsx(records, target)
+
+    writer = write_jsonl if fmt == "json" else write_csv
+    if hasattr(target, "write"):
+        return writer(records, target)
+    with open(target, "w", encoding="utf-8-sig" if fmt == "csv" else "utf-8", newline="") as fh:
+        return writer(records, fh)
+
+
+def main(argv=None):
+    from report_store import ReportStore, DEFAULT_DB_PATH
+
+    parser = argparse.ArgumentParser(description="Export saved risk assessment reports")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument("--out", default="-", help="Output file ('-' for stdout, json/csv only)")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Report database path")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    store = ReportStore(args.db)
+    if args.out == "-":
+        if args.format == "xlsx":
+            raise SystemExit("XLSX export needs an output file")
+        count = bulk_export(store, args.format, sys.stdout, args.batch_size)
+    else:
+        count = bulk_export(store, args.format, args.out, args.batch_size)
+    print(f"Exported {count} reports", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Report and interface languages.
+
+Each language declares its display name, the target named in translation
+prompts, the fonts its script needs in PDFs (first available wins) and an
+optional catalog of fixed PDF labels in locales/<code>.json. Fonts are only
+registered with ReportLab, and catalogs only read, the first time a
+language is used in a process - English needs neither, so adding languages
+costs nothing at startup or for English reports.
+"""
+import json
+import os
+from functools import lru_cache
+
+LOCALES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "locales")
+# Extra directories searched for TrueType fonts (os.pathsep separated)
+PDF_FONT_PATH = os.getenv("PDF_FONT_PATH", "")
+
+
+class Language:
+    """One report language"""
+
+    def __init__(self, code, name, translation_target=None, fonts=(), chinese_place_names=False, cjk=False):
+        self.code = code
+        self.name = name
+        # How the translation prompt names the language
+        self.translation_target = translation_target or name
+        # ("cid", font name) for ReportLab's built-in Asian fonts (not embedded),
+        # ("ttf", font name, file) for TrueType fonts (subset and embedded)
+        self.fonts = fonts
+        # Show Chinese city names next to the English ones
+        self.chinese_place_names = chinese_place_names
+        # Lines break between any two characters, never before closing punctuation
+        self.cjk = cjk
+
+
+LANGUAGES = {language.code: language for language in [
+    Language("en", "English"),
+    Language(
+        "zh", "Mandarin", "Simplified Chinese",
+        fonts=(("cid", "STSong-Light"), ("ttf", "SimSun", "simsun.ttc"), ("ttf", "YaHei", "msyh.ttc")),
+        chinese_place_names=True,
+        cjk=True
+    ),
+    Language(
+        "zh-Hant", "Traditional Chinese", "Traditional Chinese",
+        fonts=(("cid", "MSung-Light"), ("ttf", "MingLiU", "mingliu.ttc"), ("ttf", "JhengHei", "msjh.ttc")),
+        chinese_place_names=True,
+        cjk=True
+    ),
+    # Helvetica's Latin-1 encoding lacks most Vietnamese letters (ư, ơ, ạ, ...)
+    Language(
+        "vi", "Vietnamese",
+        fonts=(("ttf", "NotoSans", "noto/NotoSans-Regular.ttf"), ("ttf", "NotoSans", "NotoSans-Regular.ttf"),
+               ("ttf", "DejaVuSans", "DejaVuSans.ttf"), ("ttf", "Arial", "arial.ttf"))
+    ),
+    # Plain Latin alphabet, Helvetica covers it
+    Language("id", "Indonesian"),
+    # ReportLab does not shape Indic scripts, so conjuncts render as separate letters
+    Language(
+        "bn", "Bengali",
+        fonts=(("ttf", "NotoSansBengali", "noto/NotoSansBengali-Regular.ttf"),
+               ("ttf", "NotoSansBengali", "NotoSansBengali-Regular.ttf"), ("ttf", "Vrinda", "vrinda.ttf"))
+    ),
+]}
+
+DEFAULT_LANGUAGE = "en"
+
+
+def get_language(code):
+    """Language for a code, English for unknown codes"""
+    return LANGUAGES.get(code) or LANGUAGES[DEFAULT_LANGUAGE]
+
+
+def language_name(code):
+    return get_language(code).name
+
+
+def translation_target(code):
+    """Language name for translation prompts (unknown codes are passed through)"""
+    language = LANGUAGES.get(code)
+    return language.translation_target if language else code
+
+
+@lru_cache(maxsize=None)
+def load_catalog(code):
+    """{English label: translation} shipped for a language, read once per process ({} if none)"""
+    try:
+        with open(os.path.join(LOCALES_DIR, f"{code}.json"), encoding="utf-8") as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return {}
+
+
+@lru_cache(maxsize=None)
+def register_language_font(code):
+    """Register the first available font of a language once per process; returns (font name, warnings)"""
+    language = get_language(code)
+    if not language.fonts:
+        return 'Helvetica', ()
+
+    from reportlab import rl_config
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    for directory in filter(None, PDF_FONT_PATH.split(os.pathsep)):
+        if directory not in rl_config.TTFSearchPath:
+            rl_config.TTFSearchPath.append(directory)
+
+    warnings = []
+    for font in language.fonts:
+        try:
+            if font[0] == "cid":
+                pdfmetrics.registerFont(UnicodeCIDFont(font[1]))
+            else:
+                pdfmetrics.registerFont(TTFont(font[1], font[2]))
+            return font[1], ()
+        except Exception as e:
+            warnings.append(f"{font[1]} not available: {str(e)}")
+    warnings.append(f"{language.name} fonts not found. Using Helvetica as fallback.")
+    return 'Helvetica', tuple(warnings)
@@ -0,0 +1,485 @@
+"""Load-testing harness for the Production Risk Assessment app.
+
+Starts the app with ``streamlit run`` against a stub translation backend,
+replays recorded session scripts over the Streamlit websocket protocol with
+increasing concurrency, and reports rerun latency, PDF latency, CPU and RSS
+for each level.
+
+Usage:
+    python load_test.py --concurrency 1,10,25,50
+    python load_test.py --sessions load_test_sessions/qc_followup.json --json results.json
+
+Needs the ``websockets`` package (installed with Streamlit's server extras) and,
+for CPU/RSS sampling, ``psutil``.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+APP_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "x.py")
+DEFAULT_SESSIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "load_test_sessions", "*.json")
+
+
+def free_port():
+    """Return a free local TCP port"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, pct):
+    """Return the pct-th percentile of values (nearest rank)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+# Stub translation backend
+class StubTranslationHandler(BaseHTTPRequestHandler):
+    """Minimal OpenAI-compatible chat completions endpoint"""
+    latency = 0.0
+    calls = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        with StubTranslationHandler.lock:
+            StubTranslationHandler.calls += 1
+
+        if StubTranslationHandler.latency:
+            time.sleep(StubTranslationHandler.latency)
+
+        messages = payload.get("messages", [])
+        source = messages[-1]["content"] if messages else ""
+        body = json.dumps({
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": f"[译] {source}"},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": len(source.split()), "completion_tokens": len(source.split()), "total_tokens": 2 * len(source.split())}
+        }).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_backend(latency):
+    """Start the stub translation server in a background thread"""
+    StubTranslationHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", free_port()), StubTranslationHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+# App server
+def start_app_server(port, stub_url, extra_env=None):
+    """Launch the Streamlit app headlessly and wait until it is healthy"""
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": "load-test-stub",
+        "OPENAI_BASE_URL": stub_url,
+    })
+    env.update(extra_env or {})
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "streamlit", "run", APP_SCRIPT,
+            "--server.headless", "true",
+            "--server.port", str(port),
+            "--server.address", "127.0.0.1",
+            "--browser.gatherUsageStats", "false",
+        ],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    health_url = f"http://127.0.0.1:{port}/_stcore/health"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Streamlit server exited during startup")
+        try:
+            with urllib.request.urlopen(health_url, timeout=1) as response:
+                if response.status == 200:
+                    return process
+        except OSError:
+            time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError("Streamlit server did not become healthy within 60s")
+
+
+class ResourceSampler:
+    """Sample CPU and RSS of the server process tree while a level runs"""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.cpu_samples = []
+        self.rss_samples = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _processes(self):
+        root = psutil.Process(self.pid)
+        return [root] + root.children(recursive=True)
+
+    def _run(self):
+        known = {}
+        while not self._stop.is_set():
+            try:
+                processes = self._processes()
+            except psutil.NoSuchProcess:
+                return
+            cpu = 0.0
+            rss = 0
+            for proc in processes:
+                try:
+                    if proc.pid not in known:
+                        known[proc.pid] = proc
+                        proc.cpu_percent(None)
+                    cpu += known[proc.pid].cpu_percent(None)
+                    rss += proc.memory_info().rss
+                except psutil.NoSuchProcess:
+                    known.pop(proc.pid, None)
+            self.cpu_samples.append(cpu)
+            self.rss_samples.append(rss)
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if psutil is None:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def summary(self):
+        if not self.cpu_samples:
+            return {"cpu_avg_pct": None, "cpu_max_pct": None, "rss_peak_mb": None}
+        return {
+            "cpu_avg_pct": round(statistics.mean(self.cpu_samples), 1),
+            "cpu_max_pct": round(max(self.cpu_samples), 1),
+            "rss_peak_mb": round(max(self.rss_samples) / (1024 * 1024), 1),
+        }
+
+
+# Session replay
+class SessionReplayer:
+    """Drive one browser-less Streamlit session from a recorded script"""
+
+    def __init__(self, base_url, script, metrics, timeout=120):
+        self.base_url = base_url
+        self.script = script
+        self.metrics = metrics
+        self.timeout = timeout
+        self.widget_ids = {}
+        self.widget_labels = {}
+        self.widget_kinds = {}
+        self.widget_values = {}
+        self.download_urls = []
+        self.auto_reruns = {}
+        self.ws = None
+
+    def _remember_element(self, element):
+        kind = element.WhichOneof("type")
+        if not kind:
+            return
+        proto = getattr(element, kind)
+        if kind == "exception":
+            self.metrics["errors"].append(proto.message)
+            return
+        if kind == "download_button" and proto.url:
+            self.download_urls.append(proto.url)
+        element_id = getattr(proto, "id", "")
+        if not element_id:
+            return
+        self.widget_kinds[element_id] = kind
+        label = getattr(proto, "label", "")
+        if label:
+            self.widget_labels[label] = element_id
+        # Keyed widget ids end with "-<user key>"
+        if "-" in element_id:
+            self.widget_ids[element_id.rsplit("-", 1)[-1]] = element_id
+
+    def _resolve(self, name):
+        if name in self.widget_ids:
+            return self.widget_ids[name]
+        for label, element_id in self.widget_labels.items():
+            if name in label:
+                return element_id
+        raise KeyError(f"No widget with key or label '{name}'")
+
+    def _widget_state(self, element_id, value):
+        state = WidgetState(id=element_id)
+        kind = self.widget_kinds.get(element_id)
+        if value is True and kind in ("button", "download_button"):
+            state.trigger_value = True
+        elif isinstance(value, bool):
+            state.bool_value = value
+        elif isinstance(value, int):
+            state.int_value = value
+        elif isinstance(value, float):
+            state.double_value = value
+        elif isinstance(value, list):
+            state.string_array_value.data.extend(str(v) for v in value)
+        else:
+            state.string_value = str(value)
+        return state
+
+    async def _rerun(self, triggers=None, fragment_id=None):
+        """Send current widget values (plus one-shot triggers) and wait for the run to finish"""
+        msg = BackMsg()
+        client_state = msg.rerun_script
+        client_state.query_string = ""
+        client_state.page_script_hash = ""
+        if fragment_id:
+            client_state.fragment_id = fragment_id
+            client_state.is_auto_rerun = True
+        states = dict(self.widget_values)
+        states.update(triggers or {})
+        for element_id, value in states.items():
+            client_state.widget_states.widgets.append(self._widget_state(element_id, value))
+
+        # Media URLs from earlier runs expire; keep only this run's downloads
+        self.download_urls = []
+        started = time.perf_counter()
+        await self.ws.send(msg.SerializeToString())
+        await self._wait_for_script_finished()
+        return time.perf_counter() - started
+
+    async def _wait_for_script_finished(self):
+        while True:
+            raw = await asyncio.wait_for(self.ws.recv(), timeout=self.timeout)
+            msg = ForwardMsg()
+            msg.ParseFromString(raw)
+            kind = msg.WhichOneof("type")
+            if kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+                self._remember_element(msg.delta.new_element)
+            elif kind == "auto_rerun":
+                self.auto_reruns[msg.auto_rerun.fragment_id] = msg.auto_rerun.interval
+            elif kind == "stop_auto_rerun":
+                self.auto_reruns.pop(msg.stop_auto_rerun.fragment_id, None)
+            elif kind == "script_finished":
+                if msg.script_finished == ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    continue
+                return
+
+    async def _wait_for_download(self):
+        """Follow the page's auto-rerunning fragments until a download button appears"""
+        deadline = time.perf_counter() + self.timeout
+        while not self.download_urls and time.perf_counter() < deadline:
+            if self.auto_reruns:
+                fragment_id, interval = next(iter(self.auto_reruns.items()))
+                await asyncio.sleep(interval)
+                await self._rerun(fragment_id=fragment_id)
+            else:
+                # No polling fragment on the page: rerun like a user pressing refresh
+                await asyncio.sleep(0.5)
+                await self._rerun()
+
+    async def _fetch_downloads(self):
+        urls, self.download_urls = self.download_urls, []
+        for url in urls:
+            full_url = url if url.startswith("http") else f"http://{self.base_url}{url}"
+            await asyncio.to_thread(lambda: urllib.request.urlopen(full_url, timeout=self.timeout).read())
+
+    async def run(self):
+        stream_url = f"ws://{self.base_url}/_stcore/stream"
+        async with websockets.connect(stream_url, subprotocols=["streamlit"], max_size=None) as ws:
+            self.ws = ws
+            self.metrics["rerun"].append(await self._rerun())
+
+            for step in self.script["steps"]:
+                if "think" in step:
+                    await asyncio.sleep(step["think"] * random.uniform(0.5, 1.5))
+                elif "set" in step:
+                    for name, value in step["set"].items():
+                        self.widget_values[self._resolve(name)] = value
+                        self.metrics["rerun"].append(await self._rerun())
+                elif "type" in step:
+                    # Simulate a user committing a long text field in several edits
+                    element_id = self._resolve(step["type"]["key"])
+                    text = step["type"]["text"]
+                    chunks = max(1, int(step["type"].get("edits", 3)))
+                    for i in range(1, chunks + 1):
+                        self.widget_values[element_id] = text[: len(text) * i // chunks]
+                        self.metrics["rerun"].append(await self._rerun())
+                elif "click" in step:
+                    element_id = self._resolve(step["click"])
+                    self.widget_kinds.setdefault(element_id, "button")
+                    started = time.perf_counter()
+                    await self._rerun({element_id: True})
+                    if step.get("pdf"):
+                        # PDFs are rendered as background jobs the page polls for
+                        await self._wait_for_download()
+                        elapsed = time.perf_counter() - started
+                        if not self.download_urls:
+                            self.metrics["errors"].append(f"{self.script.get('name')}: no PDF download after '{step['click']}'")
+                            continue
+                        download_started = time.perf_counter()
+                        await self._fetch_downloads()
+                        elapsed += time.perf_counter() - download_started
+                        self.metrics["pdf"].append(elapsed)
+                    else:
+                        self.metrics["rerun"].append(time.perf_counter() - started)
+
+
+async def run_level(base_url, scripts, concurrency, timeout):
+    """Run `concurrency` sessions at once, cycling through the recorded scripts"""
+    metrics = {"rerun": [], "pdf": [], "errors": [], "failed_sessions": 0}
+
+    async def one(index):
+        script = scripts[index % len(scripts)]
+        try:
+            await SessionReplayer(base_url, script, metrics, timeout).run()
+        except Exception as e:
+            metrics["failed_sessions"] += 1
+            metrics["errors"].append(f"{script.get('name', 'session')}: {e}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(concurrency)))
+    metrics["wall_time"] = time.perf_counter() - started
+    return metrics
+
+
+def summarize(concurrency, metrics, resources):
+    """Turn raw level metrics into a report row"""
+    row = {
+        "concurrency": concurrency,
+        "reruns": len(metrics["rerun"]),
+        "rerun_p50_ms": round(percentile(metrics["rerun"], 50) * 1000, 1),
+        "rerun_p95_ms": round(percentile(metrics["rerun"], 95) * 1000, 1),
+        "pdfs": len(metrics["pdf"]),
+        "pdf_p50_ms": round(percentile(metrics["pdf"], 50) * 1000, 1),
+        "pdf_p95_ms": round(percentile(metrics["pdf"], 95) * 1000, 1),
+        "pdf_max_ms": round(max(metrics["pdf"], default=0) * 1000, 1),
+        "failed_sessions": metrics["failed_sessions"],
+        "errors": len(metrics["errors"]),
+        "wall_time_s": round(metrics["wall_time"], 2),
+    }
+    row.update(resources)
+    return row
+
+
+def print_table(rows):
+    """Print report rows as an aligned text table"""
+    columns = [
+        "concurrency", "reruns", "rerun_p50_ms", "rerun_p95_ms", "pdfs", "pdf_p50_ms",
+        "pdf_p95_ms", "pdf_max_ms", "cpu_avg_pct", "cpu_max_pct", "rss_peak_mb",
+        "failed_sessions", "errors", "wall_time_s",
+    ]
+    widths = {c: max(len(c), *(len(str(r.get(c))) for r in rows)) for c in columns}
+    print("  ".join(c.rjust(widths[c]) for c in columns))
+    for row in rows:
+        print("  ".join(str(row.get(c)).rjust(widths[c]) for c in columns))
+
+
+def load_scripts(patterns):
+    """Load recorded session scripts from JSON files"""
+    scripts = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            with open(path, encoding="utf-8") as fh:
+                script = json.load(fh)
+            script.setdefault("name", os.path.splitext(os.path.basename(path))[0])
+            scripts.append(script)
+    if not scripts:
+        raise SystemExit(f"No session scripts found for {patterns}")
+    return scripts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the risk assessment app with concurrent sessions")
+    parser.add_argument("--sessions", nargs="+", default=[DEFAULT_SESSIONS], help="Session script files or globs")
+    parser.add_argument("--concurrency", default="1,5,10,25,50", help="Comma-separated concurrency levels")
+    parser.add_argument("--port", type=int, default=0, help="Port for the app server (default: random free port)")
+    parser.add_argument("--stub-latency", type=float, default=0.2, help="Seconds the stub translation backend waits per call")
+    parser.add_argument("--timeout", type=float, default=180, help="Seconds to wait for a single rerun")
+    parser.add_argument("--json", dest="json_path", help="Also write results to this JSON file")
+    args = parser.parse_args(argv)
+
+    if websockets is None:
+        raise SystemExit("The load test needs the 'websockets' package: pip install websockets")
+    if psutil is None:
+        print("psutil not installed - CPU and RSS will not be sampled")
+
+    scripts = load_scripts(args.sessions)
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+
+    stub = start_stub_backend(args.stub_latency)
+    stub_url = f"http://127.0.0.1:{stub.server_address[1]}/v1"
+    port = args.port or free_port()
+    server = start_app_server(port, stub_url)
+    base_url = f"127.0.0.1:{port}"
+
+    rows = []
+    try:
+        for concurrency in levels:
+            sampler = ResourceSampler(server.pid)
+            sampler.start()
+            metrics = asyncio.run(run_level(base_url, scripts, concurrency, args.timeout))
+            sampler.stop()
+            row = summarize(concurrency, metrics, sampler.summary())
+            row["translation_calls"] = StubTranslationHandler.calls
+            rows.append(row)
+            print(f"concurrency={concurrency}: {row['reruns']} reruns, {row['pdfs']} PDFs, "
+                  f"{row['failed_sessions']} failed sessions")
+            for error in metrics["errors"][:5]:
+                print(f"  error: {error}")
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        stub.shutdown()
+
+    print()
+    print_table(rows)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as fh:
+            json.dump(rows, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""Master data (factories, brands, styles, staff) with fast autocomplete.
+
+Names are stored in the report database with a usage count. Each process
+loads them once into an in-memory index and picks up rows added or used
+since its last refresh:
+
+- a sorted key list for prefix search over the full name, every word of it,
+  every position of Chinese names and, when pypinyin is installed, the full
+  pinyin and pinyin initials ("dg" finds 东莞...)
+- a trigram index for matches in the middle of a name or with small typos
+
+Spelling variants that only differ in case or spacing are one entry.
+"""
+import bisect
+import os
+import sqlite3
+import threading
+import time
+
+from report_record import normalize_name
+
+try:
+    from pypinyin import lazy_pinyin, Style
+except ImportError:
+    lazy_pinyin = None
+
+DEFAULT_DB_PATH = os.getenv("REPORT_DB_PATH", "reports.db")
+
+MASTER_KINDS = ["factory", "brand", "style", "staff"]
+
+# Record field -> master data kind
+MASTER_FIELDS = {
+    "factory": "factory",
+    "brand": "brand",
+    "style": "style",
+    "sales": "staff"
+}
+
+REFRESH_INTERVAL = 5.0
+# Prefix hits considered before ranking by usage
+MAX_PREFIX_SCAN = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS master_data (
+    kind TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    name TEXT NOT NULL,
+    usage_count INTEGER NOT NULL DEFAULT 0,
+    seq INTEGER NOT NULL,
+    PRIMARY KEY (kind, name_key)
+);
+CREATE INDEX IF NOT EXISTS idx_master_data_seq ON master_data(seq);
+"""
+
+
+def name_key(name):
+    """Identity of a name: case- and whitespace-insensitive"""
+    return normalize_name(name).casefold()
+
+
+def is_cjk(char):
+    return "㐀" <= char <= "鿿" or "豈" <= char <= "﫿"
+
+
+def trigrams(text):
+    text = f" {text} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def search_keys(key):
+    """Strings whose prefixes should find this entry"""
+    keys = {key}
+    words = key.split(" ")
+    for i in range(1, len(words)):
+        keys.add(" ".join(words[i:]))
+    for i, char in enumerate(key):
+        if i and is_cjk(char):
+            keys.add(key[i:])
+    if lazy_pinyin and any(is_cjk(char) for char in key):
+        keys.add("".join(lazy_pinyin(key)))
+        keys.add("".join(lazy_pinyin(key, style=Style.FIRST_LETTER)))
+    return keys
+
+
+class _KindIndex:
+    """In-memory index over the names of one kind"""
+
+    def __init__(self):
+        self.keys = []
+        self.names = []
+        self.usage = []
+        self.ids = {}
+        self.prefix_keys = []
+        self.trigrams = {}
+        self.dirty = False
+
+    def upsert(self, key, name, usage_count):
+        """Add or update an entry; call sort() once the batch is done"""
+        entry_id = self.ids.get(key)
+        if entry_id is not None:
+            self.usage[entry_id] = usage_count
+            return
+        entry_id = len(self.names)
+        self.ids[key] = entry_id
+        self.keys.append(key)
+        self.names.append(name)
+        self.usage.append(usage_count)
+        for search_key in search_keys(key):
+            self.prefix_keys.append((search_key, entry_id))
+        for gram in trigrams(key):
+            self.trigrams.setdefault(gram, []).append(entry_id)
+        self.dirty = True
+
+    def sort(self):
+        # The list is sorted plus an appended tail, which timsort merges in linear time
+        if self.dirty:
+            self.prefix_keys.sort()
+            self.dirty = False
+
+    def search(self, query, limit):
+        # Prefix matches first, most used first
+        found = {}
+        start = bisect.bisect_left(self.prefix_keys, (query, -1))
+        for search_key, entry_id in self.prefix_keys[start:start + MAX_PREFIX_SCAN]:
+            if not search_key.startswith(query):
+                break
+            found.setdefault(entry_id, 0 if search_key == self.keys[entry_id] else 1)
+        ranked = sorted(found, key=lambda entry_id: (found[entry_id], -self.usage[entry_id], self.names[entry_id]))
+        if len(ranked) >= limit or len(query) < 3:
+            return ranked[:limit]
+
+        # Then trigram overlap for infix matches and typos. Grams shared by a
+        # large part of the names (common words) are skipped when rarer ones exist.
+        query_grams = trigrams(query)
+        common = max(100, len(self.names) // 20)
+        rare_grams = [gram for gram in query_grams if len(self.trigrams.get(gram, ())) <= common]
+        if len(rare_grams) >= len(query_grams) // 2:
+            query_grams = rare_grams
+        overlap = {}
+        for gram in query_grams:
+            for entry_id in self.trigrams.get(gram, ()):
+                if entry_id not in found:
+                    overlap[entry_id] = overlap.get(entry_id, 0) + 1
+        threshold = max(1, len(query_grams) // 2)
+        fuzzy = sorted(
+            (entry_id for entry_id, count in overlap.items() if count >= threshold),
+            key=lambda entry_id: (-overlap[entry_id], -self.usage[entry_id], self.names[entry_id])
+        )
+        return (ranked + fuzzy)[:limit]
+
+
+class MasterData:
+    """Persistent master data shared by all sessions of a process"""
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._indexes = {kind: _KindIndex() for kind in MASTER_KINDS}
+        self._last_seq = 0
+        self._last_refresh = 0.0
+        self._connection().executescript(SCHEMA)
+        self.refresh(force=True)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def refresh(self, force=False):
+        """Index entries added or used since the last refresh (including by other processes)"""
+        now = time.monotonic()
+        if not force and now - self._last_refresh < REFRESH_INTERVAL:
+            return
+        rows = self._connection().execute(
+            "SELECT kind, name_key, name, usage_count, seq FROM master_data WHERE seq > ? ORDER BY seq",
+            (self._last_seq,)
+        ).fetchall()
+        with self._lock:
+            for kind, key, name, usage_count, seq in rows:
+                if kind in self._indexes:
+                    self._indexes[kind].upsert(key, name, usage_count)
+                self._last_seq = max(self._last_seq, seq)
+            for index in self._indexes.values():
+                index.sort()
+            self._last_refresh = now
+
+    def add(self, kind, name):
+        """Add a name (or count another use of it)"""
+        name = normalize_name(name)
+        if kind not in self._indexes or not name:
+            return
+        key = name_key(name)
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("""
+                INSERT INTO master_data (kind, name_key, name, usage_count, seq)
+                VALUES (?, ?, ?, 1, (SELECT COALESCE(MAX(seq), 0) + 1 FROM master_data))
+                ON CONFLICT (kind, name_key) DO UPDATE SET
+                    usage_count = usage_count + 1,
+                    seq = excluded.seq
+            """, (kind, key, name))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self.refresh(force=True)
+
+    def add_record(self, record):
+        """Add the master data names used in a report record"""
+        for field, kind in MASTER_FIELDS.items():
+            self.add(kind, record.get(field))
+
+    def search(self, kind, query, limit=5):
+        """Names of `kind` matching what the user typed, best first"""
+        query = name_key(query)
+        if not query or kind not in self._indexes:
+            return []
+        self.refresh()
+        with self._lock:
+            index = self._indexes[kind]
+            return [index.names[entry_id] for entry_id in index.search(query, limit)]
+
+    def canonical(self, kind, name):
+        """Stored spelling of a name, or None if unknown"""
+        with self._lock:
+            index = self._indexes.get(kind)
+            entry_id = index.ids.get(name_key(name)) if index else None
+            return index.names[entry_id] if entry_id is not None else None
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(index.names) for index in self._indexes.values())
@@ -0,0 +1,261 @@
+"""Combined multi-report PDFs for factory and season reviews.
+
+All reports go into one document: a cover page with a table of contents,
+then every report, each with a bookmark in the PDF outline. Sections are
+laid out one at a time - a report's flowables are only created when the
+layout reaches it - so memory stays flat however many reports are compiled.
+
+The table of contents comes first but its page numbers are only known once
+each section is laid out, so every TOC line draws a form XObject that the
+section's first page defines later (a forward reference resolved when the
+PDF is saved). This needs a single layout pass instead of ReportLab's
+multiBuild, which keeps the whole story around for a second pass.
+
+Saved PDFs can be merged with bookmarks too (optional pypdf dependency).
+"""
+import io
+from datetime import datetime
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import inch
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.platypus import Flowable, PageBreak, Paragraph, Spacer
+
+from pdf_report import (
+    CHINA_TZ, PDFWithHeaderFooter, build_styles, register_pdf_font, report_story, report_template_name
+)
+from report_record import CHINESE_CITIES
+
+TOC_LINE_HEIGHT = 16
+
+
+def section_title(record, index):
+    """Outline/TOC title of one report"""
+    parts = [record.get(field) for field in ("po_number", "factory", "style")]
+    title = " - ".join(part for part in parts if part)
+    return title or f"Report {index + 1}"
+
+
+class SectionStart(Flowable):
+    """Zero-size marker at the start of a report: bookmark, outline entry and TOC page number"""
+
+    def __init__(self, index, title, record, font_name):
+        super().__init__()
+        self.index = index
+        self.title = title
+        self.record = record
+        self.font_name = font_name
+        self.width = self.height = 0
+
+    def wrap(self, available_width, available_height):
+        return 0, 0
+
+    def draw(self):
+        canv = self.canv
+        key = f"report{self.index}"
+        canv.bookmarkPage(key)
+        canv.addOutlineEntry(self.title, key, level=0)
+        # Define the page number form the TOC line drew earlier
+        canv.beginForm(f"tocpage{self.index}", lowerx=-60, lowery=-4, upperx=0, uppery=12)
+        canv.setFont(self.font_name, 10)
+        canv.drawRightString(0, 0, str(canv.getPageNumber()))
+        canv.endForm()
+
+
+class UnusedTOCPages(Flowable):
+    """Blank page numbers (and a link target) for TOC lines whose report was gone by the layout pass"""
+
+    def __init__(self, indexes):
+        super().__init__()
+        self.indexes = list(indexes)
+        self.width = self.height = 0
+
+    def wrap(self, available_width, available_height):
+        return 0, 0
+
+    def draw(self):
+        for index in self.indexes:
+            self.canv.bookmarkPage(f"report{index}")
+            self.canv.beginForm(f"tocpage{index}", lowerx=-60, lowery=-4, upperx=0, uppery=12)
+            self.canv.endForm()
+
+
+class TOCLine(Flowable):
+    """One table of contents line linking to a report; its page number is drawn by reference"""
+
+    def __init__(self, index, title, font_name):
+        super().__init__()
+        self.index = index
+        self.title = title
+        self.font_name = font_name
+
+    def wrap(self, available_width, available_height):
+        self.width = available_width
+        return available_width, TOC_LINE_HEIGHT
+
+    def draw(self):
+        canv = self.canv
+        canv.setFont(self.font_name, 10)
+        max_title_width = self.width - 0.9 * inch
+        title = self.title
+        while title and stringWidth(title, self.font_name, 10) > max_title_width:
+            title = title[:-2]
+        if title != self.title:
+            title = title.rstrip() + "..."
+        canv.drawString(0, 4, title)
+
+        # Dotted leader between title and page number
+        canv.saveState()
+        canv.setStrokeColor(colors.HexColor('#bbbbbb'))
+        canv.setDash(1, 2)
+        canv.line(stringWidth(title, self.font_name, 10) + 6, 4, self.width - 0.5 * inch, 4)
+        canv.restoreState()
+
+        canv.saveState()
+        canv.translate(self.width, 4)
+        canv.doForm(f"tocpage{self.index}")
+        canv.restoreState()
+        canv.linkRect("", f"report{self.index}", (0, 0, self.width, TOC_LINE_HEIGHT), relative=1)
+
+
+class LazyStory(list):
+    """Story list that pulls the next section from a generator when it runs empty.
+
+    The document builder only ever checks the length and takes items from the
+    front, so at most one section's flowables exist at a time.
+    """
+
+    def __init__(self, sections):
+        super().__init__()
+        self._sections = iter(sections)
+
+    def __len__(self):
+        while not list.__len__(self):
+            try:
+                self.extend(next(self._sections))
+            except StopIteration:
+                break
+        return list.__len__(self)
+
+
+class CompiledPDF(PDFWithHeaderFooter):
+    """Header/footer document whose footer location and branding follow the current report"""
+
+    def afterFlowable(self, flowable):
+        if isinstance(flowable, SectionStart):
+            self.selected_city = flowable.record.get("city") or "Shanghai"
+            self.chinese_city = CHINESE_CITIES.get(self.selected_city, "")
+            self.report_styles = build_styles(
+                self.pdf_language, self.chinese_font, report_template_name(flowable.record)
+            )
+
+
+def section_key(record, index):
+    """What matches a record across the two reads: its report id, else its position"""
+    return record.get("report_id") or index
+
+
+def compile_reports(records, target=None, pdf_lang="en", title=None, translate=None,
+                    on_warning=None, progress=None, generated_at=None):
+    """Lay out many report records as one PDF with outline and TOC.
+
+    The TOC needs every title up front, so records are read twice: once
+    keeping only the titles, then again for layout, matched to the first read
+    by report id. `records` is a sequence or a function returning a fresh
+    iterator of them (e.g. a store query).
+    Writes to `target` (path or binary handle) or returns a BytesIO.
+    progress(done, total) is called after each report is laid out.
+    """
+    read_records = records if callable(records) else (lambda: iter(records))
+    buffer = target if target is not None else io.BytesIO()
+    translate_pdf_content = translate or (lambda text, lang: text)
+    warn = on_warning or (lambda message: None)
+    notify = progress or (lambda done, total: None)
+    current_time = generated_at or datetime.now(CHINA_TZ)
+
+    chinese_font, font_warnings = register_pdf_font(pdf_lang)
+    for warning in font_warnings:
+        warn(warning)
+    report_styles = build_styles(pdf_lang, chinese_font)
+    toc_font = report_styles["normal_font"]
+
+    titles = []
+    indexes = {}
+    first_city = None
+    for i, record in enumerate(read_records()):
+        if i == 0:
+            first_city = record.get("city")
+        titles.append(section_title(record, i))
+        indexes.setdefault(section_key(record, i), i)
+    first_city = first_city or "Shanghai"
+
+    doc = CompiledPDF(
+        buffer,
+        pagesize=A4,
+        pageCompression=1,
+        topMargin=0.8*inch,
+        bottomMargin=0.8*inch,
+        location=first_city,
+        pdf_language=pdf_lang,
+        selected_city=first_city,
+        chinese_city=CHINESE_CITIES.get(first_city, ""),
+        chinese_font=chinese_font,
+        generated_at=current_time,
+        title=title or "Risk Assessment Review"
+    )
+
+    def sections():
+        # Cover page and table of contents
+        cover = [
+            Spacer(1, 10),
+            Paragraph(translate_pdf_content(title or "Risk Assessment Review", pdf_lang), report_styles["title"]),
+            Paragraph(
+                translate_pdf_content(f"{len(titles)} reports, compiled {current_time.strftime('%Y-%m-%d')}", pdf_lang),
+                report_styles["subtitle"]
+            ),
+            Paragraph(translate_pdf_content("CONTENTS", pdf_lang), report_styles["heading"]),
+            Spacer(1, 8)
+        ]
+        cover += [TOCLine(i, section_title_text, toc_font) for i, section_title_text in enumerate(titles)]
+        yield cover
+
+        # Reports saved in between are left out, ones gone since keep a blank page number
+        laid_out = set()
+        for position, record in enumerate(read_records()):
+            i = indexes.get(section_key(record, position))
+            if i is None or i in laid_out:
+                continue
+            section = [PageBreak(), SectionStart(i, titles[i], record, toc_font)]
+            section += report_story(record, pdf_lang, chinese_font, translate_pdf_content, current_time)
+            yield section
+            laid_out.add(i)
+            notify(len(laid_out), len(titles))
+        if len(laid_out) < len(titles):
+            yield [UnusedTOCPages(i for i in range(len(titles)) if i not in laid_out)]
+
+    doc.build(LazyStory(sections()))
+    if target is None:
+        buffer.seek(0)
+        return buffer
+    return target
+
+
+def merge_saved_pdfs(pdfs, target):
+    """Merge saved PDFs (iterable of (title, path or bytes)) into `target` with one bookmark each.
+
+    Needs pypdf; no table of contents is generated for merged files.
+    """
+    try:
+        from pypdf import PdfReader, PdfWriter
+    except ImportError:
+        raise RuntimeError("Merging saved PDFs needs pypdf (pip install pypdf)")
+
+    writer = PdfWriter()
+    count = 0
+    for title, pdf in pdfs:
+        source = io.BytesIO(pdf) if isinstance(pdf, (bytes, bytearray)) else pdf
+        writer.append(PdfReader(source), outline_item=title)
+        count += 1
+    writer.write(target)
+    return count
@@ -0,0 +1,786 @@
+"""Bulk import of report PDFs into structured records.
+
+Reads PDFs in the report layout (generate_pdf / build_pdf): basic
+information table, risk matrix, department comments, conclusion and
+signature table. Text is read per drawn line with its position and size,
+lines are grouped back into table cells and paragraphs, and the known
+table structure is mapped onto record fields. Sections are found by their
+numbered headings; headings in English or a shipped catalog language are
+recognized by name, others (older machine-translated reports) are taken in
+the default section order. Ratings are not in the PDFs, so imported
+reports are unrated.
+
+Files are parsed in a process pool and saved from the main process. Every
+file's outcome is checkpointed in the report database, so an interrupted
+run resumes where it stopped; failures are kept with their error and can
+be exported or retried.
+
+    python pdf_import.py /srv/old-reports --errors import_errors.csv
+
+Needs pypdfium2 (pip install pypdfium2).
+"""
+import argparse
+import csv
+import ctypes
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+
+from languages import LANGUAGES, load_catalog
+from pdf_report import MAX_CHUNK_CHARS, chunk_cut
+from report_record import (
+    BASIC_FIELDS, COMMENT_FIELDS, DEFAULT_RISK_SCHEMA, RISK_SCHEMAS, SIGNATURE_FIELDS, cap_field,
+    compile_risk_schema, record_from_state, record_schema, risk_field
+)
+from translation_memory import normalize_text
+
+try:
+    import pypdfium2 as pdfium
+    import pypdfium2.raw as pdfium_c
+except ImportError:
+    pdfium = None
+
+DEFAULT_DB_PATH = os.getenv("REPORT_DB_PATH", "reports.db")
+IMPORT_WORKERS = int(os.getenv("PDF_IMPORT_WORKERS", str(os.cpu_count() or 2)))
+# Files parsed ahead of the saves per worker, so memory stays flat for any number of files
+IN_FLIGHT_PER_WORKER = 4
+# Author of the imported report versions
+IMPORT_AUTHOR = "pdf-import"
+
+# Page bands drawn by PDFWithHeaderFooter.afterPage (points from the page edge)
+HEADER_BAND = 0.6 * 72
+FOOTER_BAND = 0.7 * 72
+HEADING_SIZES = (13, 15)
+# Justified lines end this close to the column edge (glyph side bearings)
+JUSTIFY_SLACK = 2.0
+SUBHEADING_SIZES = (11.5, 12.5)
+
+SECTION_TITLES = {
+    "basic": "BASIC INFORMATION",
+    "risk": "RISK ASSESSMENT MATRIX",
+    "comments": "DEPARTMENT COMMENTS",
+    "conclusion": "CONCLUSION & APPROVALS"
+}
+# Basic information table cells, row by row
+BASIC_TABLE_FIELDS = BASIC_FIELDS + ["assessment_date"]
+SIGNATURE_DATE_FIELDS = ["sales_date", "tech_date", "qc_date"]
+NOTE_TEXTS = [
+    "Note: QC will send this report to office together with final inspection report. "
+    "Office assistant will upload to ERP system and send email to factory/agent accordingly.",
+    "This report is confidential and property of the company. Unauthorized distribution is prohibited."
+]
+
+FOOTER_LOCATION = re.compile(r"^(?:Location|地点):\s*(.+?)(?:\s*\(.*\))?\s*$")
+NUMBERED = re.compile(r"^\d+\.\s*")
+DATE_VALUE = re.compile(r"\d{4}-\d{2}-\d{2}")
+SENTENCE_ENDS = "。！？；"
+# CJK punctuation that may hang past the column edge instead of starting a line
+CJK_CLOSING = "。，、；：！？）》」』】〕〉”’"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pdf_imports (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    sha256 TEXT,
+    status TEXT NOT NULL,
+    report_id TEXT,
+    error TEXT,
+    imported_at TEXT NOT NULL
+);
+"""
+
+
+class PDFImportError(Exception):
+    """A PDF is not a report this importer can read"""
+
+
+class TextLine:
+    """One drawn line of text: page, left edge and baseline, right edge, font size"""
+
+    __slots__ = ("page", "x", "y", "right", "size", "text")
+
+    def __init__(self, page, x, y, right, size, text):
+        self.page = page
+        self.x = x
+        self.y = y
+        self.right = right
+        self.size = size
+        self.text = text
+
+
+class Cell:
+    """Consecutive lines of one table cell or paragraph"""
+
+    def __init__(self, line):
+        self.x = line.x
+        self.size = line.size
+        self.lines = [line]
+        self.text = ""
+        # Whether the last paragraph may go on in the next cell (see _ends_continued)
+        self.continued = False
+
+
+def _label_key(text):
+    return normalize_text(text).rstrip(":：").strip()
+
+
+@lru_cache(maxsize=None)
+def label_variants(label):
+    """Normalized forms of a fixed PDF label in English and every shipped catalog"""
+    variants = {_label_key(label)}
+    for code in LANGUAGES:
+        translated = load_catalog(code).get(label)
+        if translated:
+            variants.add(_label_key(translated))
+    return frozenset(variants)
+
+
+@lru_cache(maxsize=None)
+def _note_patterns():
+    # Notes may be laid out anywhere; their words are matched across line breaks
+    texts = {text for note in NOTE_TEXTS for text in [note] + [load_catalog(code).get(note) for code in LANGUAGES] if text}
+    return [re.compile(r"\s*".join(re.escape(word) for word in text.split())) for text in texts]
+
+
+def _is_cjk(char):
+    return "⺀" <= char <= "鿿" or "豈" <= char <= "﫿" or "＀" <= char <= "￯"
+
+
+def _object_text(obj, textpage):
+    # Buffer length is in bytes of UTF-16, terminator included
+    length = pdfium_c.FPDFTextObj_GetText(obj.raw, textpage.raw, None, 0)
+    buffer = (ctypes.c_ushort * (length // 2))()
+    pdfium_c.FPDFTextObj_GetText(obj.raw, textpage.raw, buffer, length)
+    return bytes(buffer)[:max(length - 2, 0)].decode("utf-16-le", "replace")
+
+
+def pdf_lines(data):
+    """(city from the footer, body text lines in drawing order) of a PDF.
+
+    Header and footer bands are left out; so is anything drawn as a form
+    XObject (page bands, title block and notes in multi-report documents).
+    """
+    if pdfium is None:
+        raise RuntimeError("Importing PDFs needs pypdfium2 (pip install pypdfium2)")
+    try:
+        document = pdfium.PdfDocument(data)
+    except pdfium.PdfiumError as e:
+        raise PDFImportError(f"Not a readable PDF: {e}")
+
+    city = None
+    lines = []
+    try:
+        for page_index in range(len(document)):
+            page = document[page_index]
+            textpage = page.get_textpage()
+            page_height = page.get_height()
+            size = ctypes.c_float()
+            for obj in page.get_objects(max_depth=1):
+                if obj.type != pdfium_c.FPDF_PAGEOBJ_TEXT:
+                    continue
+                text = _object_text(obj, textpage)
+                if not text.strip():
+                    continue
+                scale, _, _, _, x, y = obj.get_matrix().get()
+                pdfium_c.FPDFTextObj_GetFontSize(obj.raw, size)
+                font_size = round(size.value * scale, 1)
+                if y < FOOTER_BAND or y > page_height - HEADER_BAND:
+                    match = FOOTER_LOCATION.match(text.strip()) if y < FOOTER_BAND else None
+                    if match and city is None:
+                        city = match.group(1)
+                    continue
+                right = obj.get_bounds()[2]
+                previous = lines[-1] if lines else None
+                if (previous and previous.page == page_index and abs(previous.y - y) < 0.5
+                        and previous.size == font_size and 0 <= x - previous.right < font_size):
+                    # Font changes within a line are separate text objects
+                    previous.text += text
+                    previous.right = right
+                else:
+                    lines.append(TextLine(page_index, x, y, right, font_size, text))
+            textpage.close()
+            page.close()
+    finally:
+        document.close()
+    return city, lines
+
+
+def group_cells(lines):
+    """Group lines into cells: same left edge and size, each line below the previous one or on a later page"""
+    cells = []
+    for line in lines:
+        cell = cells[-1] if cells else None
+        last = cell.lines[-1] if cell else None
+        if (cell and abs(line.x - cell.x) < 1.5 and line.size == cell.size
+                and (line.page > last.page or 0 < last.y - line.y < 3 * line.size)):
+            cell.lines.append(line)
+        else:
+            cells.append(Cell(line))
+    return cells
+
+
+def _chunk_joiner(line, following):
+    """" " or "" if text_chunks, cutting one long line, cuts `line` + joiner + `following` right after `line`.
+
+    `line` is the text since the last real line break, so text_chunks is
+    replayed from where it started cutting.
+    """
+    for joiner in (" ", ""):
+        rest = line + joiner + following
+        offset = 0
+        while len(rest) > MAX_CHUNK_CHARS:
+            cut = chunk_cut(rest)
+            if offset + cut == len(line) + len(joiner):
+                return joiner
+            if offset + cut > len(line):
+                break
+            remaining = rest[cut:].lstrip()
+            offset += len(rest) - len(remaining)
+            rest = remaining
+    return None
+
+
+def _ends_continued(line, right_edge):
+    """Whether a paragraph ending in `line` may be a text_chunks piece going on in the next one.
+
+    Those end justified (a last line of a single word cannot be stretched);
+    PDFs made before that show them as ordinary paragraph ends.
+    """
+    return right_edge - line.right <= JUSTIFY_SLACK or " " not in line.text.strip()
+
+
+def _join_chunks(pieces):
+    """Join (text, continued) paragraphs by line breaks, except where text_chunks had cut one long line"""
+    joined = None
+    for text, continued in pieces:
+        if joined is None:
+            joined = text
+        else:
+            joiner = _chunk_joiner(joined.rsplit("\n", 1)[-1], text.split("\n", 1)[0]) if last_continued else None
+            joined += ("\n" if joiner is None else joiner) + text
+        last_continued = continued
+    return joined or ""
+
+
+def _reflow(cell, right_edge):
+    """Cell text with wrapped lines joined and paragraphs on their own lines.
+
+    User text is justified: every line of a paragraph but the last runs to
+    the column edge. In cells where most lines do, a short line ends a
+    paragraph; elsewhere one that ended short of the edge by more than the
+    next word did. CJK lines are never stretched, so one of those ends a
+    paragraph when the next character would have fit. Sets cell.continued
+    for the last paragraph.
+    """
+    inner = cell.lines[:-1]
+    justified = sum(right_edge - line.right <= JUSTIFY_SLACK for line in inner) * 2 > len(inner)
+    # [text, last line] per paragraph
+    paragraphs = []
+    previous = None
+    for line in cell.lines:
+        piece = line.text.strip()
+        if previous is None or not paragraphs[-1][0]:
+            paragraphs = [[piece, line]]
+        elif piece:
+            text = paragraphs[-1][0]
+            first = piece.split(" ", 1)[0]
+            first_width = (line.right - line.x) * len(first) / len(piece)
+            cjk = _is_cjk(text[-1]) or _is_cjk(piece[0])
+            if cjk and _is_cjk(text[-1]) and _is_cjk(piece[0]) and text[-1] not in SENTENCE_ENDS:
+                # CJK text wraps anywhere, often well short of the edge
+                paragraphs[-1] = [text + piece, line]
+            elif _is_cjk(text[-1]):
+                # CJK lines are not stretched; one ends a paragraph if the next character would have fit
+                next_width = line.size if _is_cjk(piece[0]) else first_width
+                if previous.right + next_width <= right_edge:
+                    paragraphs.append([piece, line])
+                else:
+                    paragraphs[-1] = [text + ("" if cjk else " ") + piece, line]
+            elif justified and previous.right < right_edge - JUSTIFY_SLACK:
+                paragraphs.append([piece, line])
+            elif not justified and previous.page == line.page and previous.right + first_width + line.size * 0.5 < right_edge:
+                paragraphs.append([piece, line])
+            else:
+                paragraphs[-1] = [text + ("" if cjk else " ") + piece, line]
+        previous = line
+
+    text = _join_chunks([(text, _ends_continued(last, right_edge)) for text, last in paragraphs])
+    cell.continued = bool(paragraphs) and _ends_continued(paragraphs[-1][1], right_edge)
+    for pattern in _note_patterns():
+        text = pattern.sub("", text)
+    return text.strip()
+
+
+def _fill_text(cells):
+    """Set the text of each cell, reflowed against the right edge of its column"""
+    edges = {}
+    hanging_edges = {}
+    for cell in cells:
+        key = round(cell.x / 3)
+        for line in cell.lines:
+            # Lines ending in hanging CJK punctuation run past the edge
+            found = hanging_edges if line.text.rstrip()[-1:] in CJK_CLOSING else edges
+            found[key] = max(found.get(key, 0), line.right)
+    for key, right in hanging_edges.items():
+        edges.setdefault(key, right)
+    for cell in cells:
+        cell.text = _reflow(cell, edges[round(cell.x / 3)])
+
+
+def _free_text(cells):
+    """User text of body cells ("-" is printed for empty text)"""
+    text = _join_chunks([(cell.text, cell.continued) for cell in cells if cell.text])
+    return "" if text == "-" else text
+
+
+def _is_size(cell, sizes):
+    return sizes[0] <= cell.size <= sizes[1]
+
+
+def split_sections(cells):
+    """{section name: cells} from the numbered section headings"""
+    headings = [
+        i for i, cell in enumerate(cells)
+        if _is_size(cell, HEADING_SIZES) and NUMBERED.match(cell.lines[0].text.strip())
+    ]
+    if not headings:
+        raise PDFImportError("No numbered report sections found")
+
+    names = []
+    for i in headings:
+        key = _label_key(NUMBERED.sub("", " ".join(line.text.strip() for line in cells[i].lines)))
+        name = next((name for name, title in SECTION_TITLES.items() if key in label_variants(title)), None)
+        if name and name in names:
+            raise PDFImportError("More than one report in this PDF")
+        names.append(name)
+    # Headings in other languages take the remaining sections in the default order
+    remaining = [name for name in SECTION_TITLES if name not in names]
+    names = [name or (remaining.pop(0) if remaining else None) for name in names]
+
+    bounds = headings[1:] + [len(cells)]
+    return {name: cells[start + 1:end] for name, start, end in zip(names, headings, bounds) if name}
+
+
+def _columns(cells):
+    """Left edges of the first table row (cells up to where the left edge moves back)"""
+    anchors = []
+    for cell in cells:
+        if anchors and cell.x <= anchors[-1] + 1.5:
+            break
+        anchors.append(cell.x)
+    return anchors
+
+
+def _column(cell, anchors):
+    return min(range(len(anchors)), key=lambda i: abs(anchors[i] - cell.x))
+
+
+def _table_rows(cells, anchors):
+    """[[cells of column 0], [column 1], ...] per row; a row starts at each first-column cell"""
+    rows = []
+    for cell in cells:
+        column = _column(cell, anchors)
+        if column == 0 or not rows:
+            rows.append([[] for _ in anchors])
+        rows[-1][column].append(cell)
+    return rows
+
+
+def parse_basic(cells):
+    """Basic information fields: label and value cells, two pairs per row"""
+    body = []
+    for cell in cells:
+        if not _is_size(cell, (8.5, 9.5)):
+            break
+        body.append(cell)
+    if not body:
+        raise PDFImportError("Basic information table is empty")
+
+    # Label columns are the ones whose cells end with a colon
+    labels = {}
+    for cell in body:
+        key = round(cell.x / 3)
+        labels.setdefault(key, []).append(cell.text.endswith((":", "：")))
+    label_columns = {key for key, flags in labels.items() if sum(flags) * 2 > len(flags)}
+
+    fields = {}
+    field_index = -1
+    for cell in body:
+        if round(cell.x / 3) in label_columns:
+            field_index += 1
+            if field_index >= len(BASIC_TABLE_FIELDS):
+                break
+        elif field_index >= 0:
+            field = BASIC_TABLE_FIELDS[field_index]
+            fields[field] = "\n".join(filter(None, [fields.get(field), cell.text]))
+    return fields
+
+
+def _stage_key(title):
+    return _label_key(NUMBERED.sub("", title))
+
+
+def match_risk_schema(titles, fallback=DEFAULT_RISK_SCHEMA):
+    """Name of the risk schema whose stage titles best match the matrix rows"""
+    best = None
+    for name in RISK_SCHEMAS:
+        stages = compile_risk_schema(name).stages
+        matched = sum(
+            1 for title, stage in zip(titles, stages) if _stage_key(title) in {
+                _stage_key(variant) for variant in label_variants(stage["title"])
+            }
+        )
+        # Titles in unknown languages: same stage count, then the fallback schema
+        score = (matched, len(stages) == len(titles), name == fallback)
+        if best is None or score > best[0]:
+            best = (score, name)
+    return best[1]
+
+
+def parse_risk(cells, fallback_schema=DEFAULT_RISK_SCHEMA):
+    """Risk stage descriptions and CAPs keyed by record field, and the schema name"""
+    anchors = _columns(cells)
+    if len(anchors) < 3:
+        raise PDFImportError("Risk matrix header not found")
+    header = [_label_key(cell.text) for cell in cells[:len(anchors)]]
+
+    stages = []
+    skip = 0
+    for cell in cells[len(anchors):]:
+        if skip:
+            skip -= 1
+            continue
+        column = _column(cell, anchors)
+        if column == 0:
+            if _label_key(cell.text) == header[0]:
+                # Header row repeated on a new page
+                skip = len(anchors) - 1
+                continue
+            if not NUMBERED.match(cell.text):
+                # Overall result table below the matrix
+                break
+            stages.append({"title": cell.text, "content": [], "cap": []})
+        elif stages and column in (1, 2):
+            stages[-1]["content" if column == 1 else "cap"].append(cell)
+
+    if not stages:
+        raise PDFImportError("Risk matrix has no stages")
+    schema = compile_risk_schema(match_risk_schema([stage["title"] for stage in stages], fallback_schema))
+    fields = {}
+    for stage, parsed in zip(schema.stages, stages):
+        fields[risk_field(stage["key"])] = _free_text(parsed["content"])
+        fields[cap_field(stage["key"])] = _free_text(parsed["cap"])
+    return schema.name, fields
+
+
+def parse_comments(cells):
+    """Sales, technical and QC comments: the text under each subheading in turn"""
+    fields = {}
+    current = None
+    body = []
+    subheadings = iter(COMMENT_FIELDS[:3])
+    for cell in cells + [None]:
+        if cell is None or _is_size(cell, SUBHEADING_SIZES):
+            if current:
+                fields[current] = _free_text(body)
+            current = next(subheadings, None) if cell is not None else None
+            body = []
+        else:
+            body.append(cell)
+    return fields
+
+
+def _signature_value(text):
+    return "" if not text.strip("_ \n") else text
+
+
+def parse_conclusion(cells):
+    """Conclusion text and the signature table (name and date per department)"""
+    fields = {}
+    start = next((i for i, cell in enumerate(cells) if _is_size(cell, SUBHEADING_SIZES)), None)
+    if start is None:
+        return fields
+    body = cells[start + 1:]
+    if not body:
+        return fields
+    # Conclusion paragraphs share a left edge; the signature table is indented
+    # by its cell padding and the notes below it are back at the text edge
+    text_x = body[0].x
+    table = next((i for i, cell in enumerate(body) if abs(cell.x - text_x) >= 1.5), len(body))
+    end = next((i for i in range(table, len(body)) if abs(body[i].x - text_x) < 1.5), len(body))
+    fields["conclusion"] = _free_text(body[:table])
+
+    anchors = []
+    for x in sorted(cell.x for cell in body[table:end]):
+        if not anchors or x - anchors[-1] >= 1.5:
+            anchors.append(x)
+    # Label, name, label, date; without any name drawn the name column is missing
+    columns = {4: (1, 3), 3: (None, 2)}.get(len(anchors))
+    if columns:
+        name_column, date_column = columns
+        rows = _table_rows(body[table:end], anchors)
+        for row, name_field, date_field in zip(rows, SIGNATURE_FIELDS, SIGNATURE_DATE_FIELDS):
+            name = "\n".join(cell.text for cell in row[name_column]) if name_column else ""
+            fields[name_field] = _signature_value(name)
+            date_match = DATE_VALUE.search(" ".join(cell.text for cell in row[date_column]))
+            fields[date_field] = date_match.group(0) if date_match else None
+    return fields
+
+
+def parse_report_pdf(data, fallback_schema=DEFAULT_RISK_SCHEMA):
+    """Report record (without report_id) read back from a report PDF.
+
+    `fallback_schema` decides between risk schemas with the same number of
+    stages when the stage titles are in a language the catalogs don't have.
+    """
+    city, lines = pdf_lines(data)
+    if not lines:
+        raise PDFImportError("No text in this PDF (scanned?)")
+    cells = group_cells(lines)
+    _fill_text(cells)
+    sections = split_sections(cells)
+    if "basic" not in sections:
+        raise PDFImportError("Basic information section not found")
+
+    state = {"selected_city": city or "", "risk_schema": DEFAULT_RISK_SCHEMA}
+    state.update(parse_basic(sections["basic"]))
+    date_match = DATE_VALUE.search(state.get("assessment_date") or "")
+    state["assessment_date"] = date_match.group(0) if date_match else None
+    if "risk" in sections:
+        state["risk_schema"], risk_fields = parse_risk(sections["risk"], fallback_schema)
+        state.update(risk_fields)
+    if "comments" in sections:
+        state.update(parse_comments(sections["comments"]))
+    if "conclusion" in sections:
+        state.update(parse_conclusion(sections["conclusion"]))
+    record = record_from_state(state)
+    del record["report_id"]
+    return record
+
+
+def parse_pdf_file(path, fallback_schema=DEFAULT_RISK_SCHEMA):
+    """Worker: (sha256, record, error) for one file"""
+    try:
+        with open(path, "rb") as fh:
+            data = fh.read()
+    except OSError as e:
+        return None, None, str(e)
+    sha256 = hashlib.sha256(data).hexdigest()
+    try:
+        return sha256, parse_report_pdf(data, fallback_schema), None
+    except PDFImportError as e:
+        return sha256, None, str(e)
+    except Exception as e:
+        return sha256, None, f"{type(e).__name__}: {e}"
+
+
+def iter_pdf_paths(sources):
+    """PDF files under the given files and directories, in a stable order, without listing them all first"""
+    for source in sources:
+        if os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(".pdf"):
+                        yield os.path.abspath(os.path.join(root, name))
+        else:
+            yield os.path.abspath(source)
+
+
+class ImportLog:
+    """Per-file import outcomes in the report database, the checkpoint for resuming"""
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def outcomes(self):
+        """{path: (size, mtime, status)} of every file seen before"""
+        return {
+            row["path"]: (row["size"], row["mtime"], row["status"])
+            for row in self._connection().execute("SELECT path, size, mtime, status FROM pdf_imports")
+        }
+
+    def record(self, path, size, mtime, sha256, status, report_id=None, error=None):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO pdf_imports (path, size, mtime, sha256, status, report_id, error, imported_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, size, mtime, sha256, status, report_id, error,
+                 datetime.utcnow().isoformat(timespec="seconds"))
+            )
+
+    def failures(self):
+        return self._connection().execute(
+            "SELECT path, error, imported_at FROM pdf_imports WHERE status = 'failed' ORDER BY path"
+        ).fetchall()
+
+    def write_errors(self, target):
+        """Write failed files and their errors as CSV; returns the row count"""
+        rows = self.failures()
+        with open(target, "w", encoding="utf-8-sig", newline="") as fh:
+            writer = csv.writer(fh)
+            writer.writerow(["path", "error", "attempted_at"])
+            writer.writerows(tuple(row) for row in rows)
+        return len(rows)
+
+
+def _same_assessment(record, other):
+    schema = record_schema(record)
+    return record_schema(other).name == schema.name and all(
+        " ".join((record.get(field) or "").split()) == " ".join((other.get(field) or "").split())
+        for field in schema.risk_fields
+    )
+
+
+def save_imported(store, record, sha256):
+    """Save an imported record unless it is already in the store; returns (status, report_id).
+
+    The report id comes from the file's content, so importing the same PDF
+    twice finds the first import. A report saved in the app with the same
+    PO/style/factory and risk text is the PDF's own source and is kept instead.
+    """
+    report_id = sha256[:32]
+    if store.get_report(report_id) is not None:
+        return "duplicate", report_id
+    for duplicate in store.find_duplicates(record):
+        existing = store.get_report(duplicate["report_id"])
+        if existing and _same_assessment(record, existing):
+            return "duplicate", duplicate["report_id"]
+    record = dict(record, report_id=report_id)
+    return "imported", store.save_report(record, author=IMPORT_AUTHOR)
+
+
+def import_pdfs(sources, store, log, workers=IMPORT_WORKERS, retry_failed=False, progress=None,
+                fallback_schema=DEFAULT_RISK_SCHEMA):
+    """Import every PDF under `sources` that has not been imported yet; returns counts per outcome.
+
+    Files are parsed in `workers` processes while the main process saves
+    the results, with a bounded number of files in flight. A worker dying
+    on a malformed file fails the files it had in flight (retry them with
+    retry_failed) and the pool is restarted.
+    """
+    notify = progress or (lambda counts: None)
+    counts = {"imported": 0, "duplicate": 0, "failed": 0, "skipped": 0}
+    seen = log.outcomes()
+    pending = {}
+
+    def finish(future):
+        path, size, mtime = pending.pop(future)
+        try:
+            sha256, record, error = future.result()
+        except BrokenProcessPool:
+            sha256, record, error = None, None, "Worker process crashed"
+        report_id = None
+        if record is not None:
+            try:
+                status, report_id = save_imported(store, record, sha256)
+            except Exception as e:
+                status, error = "failed", f"Saving failed: {e}"
+        else:
+            status = "failed"
+        log.record(path, size, mtime, sha256, status, report_id, error)
+        counts[status] += 1
+        notify(counts)
+
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        for path in iter_pdf_paths(sources):
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                log.record(path, 0, 0, None, "failed", error=str(e))
+                counts["failed"] += 1
+                continue
+            previous = seen.get(path)
+            if previous and previous[:2] == (stat.st_size, stat.st_mtime) and (
+                    previous[2] != "failed" or not retry_failed):
+                counts["skipped"] += 1
+                continue
+            try:
+                future = pool.submit(parse_pdf_file, path, fallback_schema)
+            except BrokenProcessPool:
+                pool.shutdown(wait=False)
+                pool = ProcessPoolExecutor(max_workers=workers)
+                future = pool.submit(parse_pdf_file, path, fallback_schema)
+            pending[future] = (path, stat.st_size, stat.st_mtime)
+            if len(pending) >= workers * IN_FLIGHT_PER_WORKER:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish(future)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                finish(future)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    return counts
+
+
+def main(argv=None):
+    from report_store import ReportStore
+
+    parser = argparse.ArgumentParser(description="Import report PDFs into the report store")
+    parser.add_argument("sources", nargs="+", help="PDF files or directories (searched recursively)")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Report database path")
+    parser.add_argument("--workers", type=int, default=IMPORT_WORKERS, help="Parallel parsing processes")
+    parser.add_argument("--retry-failed", action="store_true", help="parse files that failed before again")
+    parser.add_argument("--errors", help="write the files that failed, with their errors, to this CSV file")
+    parser.add_argument("--risk-schema", choices=sorted(RISK_SCHEMAS), default=DEFAULT_RISK_SCHEMA,
+                        help="product line for reports whose stage titles are not recognized")
+    args = parser.parse_args(argv)
+
+    if pdfium is None:
+        parser.error("Importing PDFs needs pypdfium2 (pip install pypdfium2)")
+
+    def progress(counts):
+        done = counts["imported"] + counts["duplicate"] + counts["failed"]
+        if done % 100 == 0:
+            print(f"{done} files: {counts['imported']} imported, {counts['duplicate']} duplicates, "
+                  f"{counts['failed']} failed", file=sys.stderr)
+
+    log = ImportLog(args.db)
+    counts = import_pdfs(
+        args.sources, ReportStore(args.db), log, max(1, args.workers), args.retry_failed, progress,
+        args.risk_schema
+    )
+    print(f"Imported {counts['imported']} reports; {counts['duplicate']} already in the store, "
+          f"{counts['failed']} failed, {counts['skipped']} done in an earlier run")
+    if args.errors:
+        print(f"Wrote {log.write_errors(args.errors)} failed files to {args.errors}")
+
+
+if __name__ == "__main__":
+    main()
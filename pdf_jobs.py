@@ -0,0 +1,122 @@
+"""Background PDF generation jobs.
+
+The app submits a report record and gets a job id back immediately; the
+render runs on a worker thread (which in turn uses the render pool when
+enabled) and the page polls the job on later reruns. Jobs live in the
+process-wide JobManager, so they survive reruns and widget changes, and
+submitting the same record and language twice returns the existing job.
+"""
+import hashlib
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Stages reported by the render while it runs; "done"/"failed" are set by the job itself
+RUNNING_STAGES = ["queued", "translating", "layout"]
+JOB_STAGES = RUNNING_STAGES + ["done"]
+
+STAGE_LABELS = {
+    "queued": "Waiting for a render worker",
+    "translating": "Translating labels",
+    "layout": "Laying out pages",
+    "done": "Finished",
+    "failed": "Failed"
+}
+
+
+def job_key(record, pdf_lang):
+    """Content hash identifying identical render requests"""
+    payload = json.dumps({"record": record, "lang": pdf_lang}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class PDFJob:
+    """State of one background render"""
+
+    def __init__(self, key, record, pdf_lang, meta=None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.record = record
+        self.pdf_lang = pdf_lang
+        self.meta = meta or {}
+        self.stage = "queued"
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self.pdf_bytes = None
+        self.warnings = []
+        self.error = None
+
+    @property
+    def finished(self):
+        return self.stage in ("done", "failed")
+
+    @property
+    def progress(self):
+        """Completion fraction for a progress bar"""
+        if self.stage == "failed":
+            return 1.0
+        return (JOB_STAGES.index(self.stage) + 1) / len(JOB_STAGES)
+
+
+class JobManager:
+    """Runs render jobs on background threads and keeps their results for a while"""
+
+    def __init__(self, render, max_workers=4, keep_seconds=3600):
+        # render(record, pdf_lang, progress) -> (pdf bytes, warnings)
+        self.render = render
+        self.keep_seconds = keep_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pdf-job")
+        self._jobs = {}
+        self._by_key = {}
+        self._lock = threading.Lock()
+
+    def submit(self, record, pdf_lang, meta=None):
+        """Queue a render and return its job id (an identical pending or finished job is reused)"""
+        key = job_key(record, pdf_lang)
+        with self._lock:
+            self._prune()
+            existing = self._jobs.get(self._by_key.get(key))
+            if existing and existing.stage != "failed":
+                return existing.id
+            job = PDFJob(key, record, pdf_lang, meta)
+            self._jobs[job.id] = job
+            self._by_key[key] = job.id
+        self._executor.submit(self._run, job)
+        return job.id
+
+    def get(self, job_id):
+        """The job with this id, or None if unknown or expired"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job):
+        def progress(stage):
+            # The render reports "done" before its bytes reach us; that stage is ours to set
+            if stage in RUNNING_STAGES:
+                job.stage = stage
+
+        pdf_bytes, warnings, error = None, [], None
+        try:
+            pdf_bytes, warnings = self.render(job.record, job.pdf_lang, progress)
+        except Exception as e:
+            error = str(e)
+        # Pollers read a finished job's result and finish time, so set those before the stage
+        with self._lock:
+            job.pdf_bytes = pdf_bytes
+            job.warnings = list(warnings)
+            job.error = error
+            job.finished_at = time.time()
+            job.stage = "failed" if error is not None else "done"
+
+    def _prune(self):
+        cutoff = time.time() - self.keep_seconds
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and job.finished_at is not None and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            job = self._jobs.pop(job_id)
+            if self._by_key.get(job.key) == job_id:
+                del self._by_key[job.key]
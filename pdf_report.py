@@ -0,0 +1,953 @@
+"""PDF report rendering with ReportLab.
+
+Independent of Streamlit so reports can be built in the app, in render
+worker processes and in offline tools from a report record.
+"""
+import hashlib
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from datetime import datetime
+from xml.sax.saxutils import escape
+from functools import lru_cache
+
+import pytz
+from reportlab import rl_config
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.platypus import (
+    SimpleDocTemplate, Table, LongTable, TableStyle, Paragraph, Spacer, PageBreak, Image, Flowable
+)
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_JUSTIFY
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+from blob_store import default_blob_store
+from languages import get_language, register_language_font
+from report_templates import (
+    DEFAULT_TEMPLATE, DEFAULT_TEMPLATE_NAME, get_template, pinned_template_name, template_name_for_brand
+)
+from report_record import CHINESE_CITIES, cap_field, record_schema, risk_field
+from risk_scoring import RISK_LEVEL_COLORS, MAX_SCORE, stage_scores, overall_score, risk_level
+
+CHINA_TZ = pytz.timezone('Asia/Shanghai')
+
+# Output profile. Streams are always Flate-compressed; ASCII85 wrapping only
+# adds ~25% for 7-bit transports nobody here uses. ReportLab already subsets
+# embedded TrueType fonts, and the CID fonts used for Mandarin are not
+# embedded at all.
+rl_config.useA85 = 0
+# Linearize (fast first page display) and pack objects into object streams, needs pikepdf
+PDF_LINEARIZE = os.getenv("PDF_LINEARIZE", "0") == "1"
+# Convert to PDF/A-2b for archiving, needs Ghostscript on PATH
+PDF_ARCHIVE_PDFA = os.getenv("PDF_ARCHIVE_PDFA", "0") == "1"
+# Reports bigger than this get a warning (0 disables the check)
+PDF_SIZE_BUDGET_KB = int(os.getenv("PDF_SIZE_BUDGET_KB", "500"))
+
+# Longest chunk of user text laid out as one Paragraph. Splitting a paragraph
+# across pages re-wraps the whole remainder, so one huge paragraph makes
+# layout quadratic; bounded chunks keep it linear in the text length. A
+# chunk of CJK text this long still fits on one page in a risk table column.
+MAX_CHUNK_CHARS = 600
+
+# Static content (page bands, title block, notes) becomes a shared form XObject
+# from this use in a document on; a form object costs a few hundred bytes, about
+# what drawing the content directly twice costs
+STATIC_FORM_MIN_USES = 3
+
+
+def register_pdf_font(pdf_lang):
+    """Register the font for a PDF language once per process; returns (font name, warnings)"""
+    return register_language_font(pdf_lang)
+
+
+@lru_cache(maxsize=None)
+def _register_template_font(name, path):
+    """Register a template's TrueType font once per process; False if it can't be loaded"""
+    try:
+        pdfmetrics.registerFont(TTFont(name, path))
+        return True
+    except Exception:
+        return False
+
+
+def _template_font(template, kind):
+    name = template["fonts"][kind]
+    path = template["font_files"].get(name)
+    if path and not _register_template_font(name, path):
+        return DEFAULT_TEMPLATE["fonts"][kind]
+    return name
+
+
+@lru_cache(maxsize=None)
+def build_styles(pdf_lang, chinese_font, template_name=DEFAULT_TEMPLATE_NAME):
+    """Compiled report template for a PDF language: paragraph styles, colours, logo,
+    column widths and static table styles, built once per process and shared by all builds"""
+    template = get_template(template_name)
+    palette = {name: colors.HexColor(value) for name, value in template["colors"].items()}
+    styles = getSampleStyleSheet()
+    
+    # Create styles with appropriate fonts; brand fonts only cover Latin scripts
+    script_font = chinese_font if get_language(pdf_lang).fonts else None
+    title_font = script_font or _template_font(template, "bold")
+    normal_font = script_font or _template_font(template, "regular")
+    bold_font = script_font or _template_font(template, "bold")
+    
+    # Improved title style
+    title_style = ParagraphStyle(
+        f'CustomTitle_{template_name}',
+        parent=styles['Heading1'],
+        fontSize=22,
+        textColor=palette["primary"],
+        spaceAfter=10,
+        alignment=TA_CENTER,
+        fontName=title_font,
+        underlineWidth=1,
+        underlineColor=palette["secondary"],
+        underlineOffset=-3
+    )
+    
+    # Company header style
+    company_style = ParagraphStyle(
+        f'CompanyStyle_{template_name}',
+        parent=styles['Heading1'],
+        fontSize=16,
+        textColor=palette["company"],
+        spaceAfter=5,
+        alignment=TA_CENTER,
+        fontName=bold_font
+    )
+    
+    # Subtitle style
+    subtitle_style = ParagraphStyle(
+        f'CustomSubtitle_{template_name}',
+        parent=styles['Normal'],
+        fontSize=11,
+        textColor=palette["secondary"],
+        alignment=TA_CENTER,
+        spaceAfter=20,
+        fontName=bold_font
+    )
+    
+    # Heading style for sections
+    heading_style = ParagraphStyle(
+        f'CustomHeading_{template_name}',
+        parent=styles['Heading2'],
+        fontSize=14,
+        textColor=colors.white,
+        spaceAfter=8,
+        spaceBefore=12,
+        fontName=bold_font,
+        borderPadding=6,
+        borderColor=palette["primary"],
+        borderWidth=1,
+        borderRadius=4,
+        backColor=palette["primary"],
+        alignment=TA_LEFT
+    )
+    
+    # Subheading style
+    subheading_style = ParagraphStyle(
+        f'CustomSubheading_{template_name}',
+        parent=styles['Heading3'],
+        fontSize=12,
+        textColor=palette["subheading"],
+        spaceAfter=6,
+        fontName=bold_font,
+        alignment=TA_LEFT
+    )
+    
+    # Risk description style
+    risk_desc_style = ParagraphStyle(
+        f'RiskDescription_{template_name}',
+        parent=styles['Normal'],
+        fontSize=9,
+        textColor=palette["text"],
+        leading=12,
+        alignment=TA_JUSTIFY,
+        fontName=normal_font,
+        wordWrap="CJK" if get_language(pdf_lang).cjk else None
+    )
+    
+    # A chunk of a long line that goes on in the next chunk ends justified, as
+    # ReportLab does for a paragraph split across pages
+    risk_continued_style = ParagraphStyle(
+        f'RiskDescriptionContinued_{template_name}',
+        parent=risk_desc_style,
+        justifyLastLine=1
+    )
+    
+    # Normal style
+    normal_style = ParagraphStyle(
+        f'NormalStyle_{template_name}',
+        parent=styles['Normal'],
+        fontSize=9,
+        leading=12,
+        fontName=normal_font
+    )
+    
+    # Logo scaled into its box, or None if the template has none (or it is missing)
+    logo = None
+    if template["logo"] and os.path.exists(template["logo"]):
+        logo_width, logo_height = ImageReader(template["logo"]).getSize()
+        scale = min(template["logo_size"][0] * inch / logo_width, template["logo_size"][1] * inch / logo_height)
+        logo = (template["logo"], logo_width * scale, logo_height * scale)
+    
+    # Risk matrix style commands that do not depend on the stages
+    risk_table_style = [
+        ('BACKGROUND', (0, 0), (-1, 0), palette["secondary"]),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+        ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), bold_font),
+        ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ('BOX', (0, 0), (-1, -1), 0.5, palette["grid"]),
+        ('LINEAFTER', (0, 0), (-2, -1), 0.5, palette["grid"]),
+        ('LINEBELOW', (0, 0), (-1, 0), 0.5, palette["grid"]),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ('LEFTPADDING', (0, 0), (-1, -1), 6),
+        ('RIGHTPADDING', (0, 0), (-1, -1), 6)
+    ]
+    
+    return {
+        "template": template_name,
+        "normal_font": normal_font,
+        "bold_font": bold_font,
+        "title": title_style,
+        "company": company_style,
+        "subtitle": subtitle_style,
+        "heading": heading_style,
+        "subheading": subheading_style,
+        "risk_desc": risk_desc_style,
+        "risk_continued": risk_continued_style,
+        "normal": normal_style,
+        "colors": palette,
+        "company_name": template["company_name"],
+        "header_text": template["header_text"],
+        "logo": logo,
+        "sections": tuple(template["sections"]),
+        "page_breaks": frozenset(template["page_breaks"]),
+        "column_widths": {
+            table: tuple(width * inch for width in widths) for table, widths in template["column_widths"].items()
+        },
+        "risk_table_style": risk_table_style
+    }
+
+
+_font_variants = {}
+
+
+def font_variant(style, font_name):
+    """Copy of `style` using `font_name`, cached so builds don't recreate styles per cell"""
+    key = (id(style), font_name)
+    cached = _font_variants.get(key)
+    if cached is None:
+        # Keep a reference to the parent so its id cannot be reused
+        cached = (style, ParagraphStyle(f"{style.name}_{font_name}", parent=style, fontName=font_name))
+        _font_variants[key] = cached
+    return cached[1]
+
+
+def chunk_cut(line):
+    """Where text_chunks cuts a line longer than MAX_CHUNK_CHARS: after a sentence or word if possible"""
+    for sep in (". ", "。", "; ", "；", " "):
+        position = line.rfind(sep, MAX_CHUNK_CHARS // 2, MAX_CHUNK_CHARS)
+        if position > 0:
+            return position + len(sep)
+    return MAX_CHUNK_CHARS
+
+
+def text_chunks(text):
+    """Split user text into escaped paragraph chunks of at most MAX_CHUNK_CHARS.
+
+    Line breaks are kept; long lines are cut at sentence or word boundaries.
+    Returns (chunk, continued) pairs; continued chunks are cut from a line
+    that goes on in the next chunk.
+    """
+    chunks = []
+    for line in (text or "").splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        while len(line) > MAX_CHUNK_CHARS:
+            cut = chunk_cut(line)
+            chunks.append((escape(line[:cut].strip()), True))
+            line = line[cut:].strip()
+        if line:
+            chunks.append((escape(line), False))
+    return chunks
+
+
+def draw_static(canv, key, draw, width=None, height=None):
+    """Draw content that only depends on `key`. The first uses in a document draw it
+    directly; from STATIC_FORM_MIN_USES on it is a form XObject, defined once and
+    referenced by every later page or report."""
+    name = "S" + hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:12]
+    if not canv.hasForm(name):
+        uses = canv.__dict__.setdefault("_static_uses", {})
+        uses[name] = uses.get(name, 0) + 1
+        if uses[name] < STATIC_FORM_MIN_USES:
+            canv.saveState()
+            draw(canv)
+            canv.restoreState()
+            return
+        if width is None:
+            canv.beginForm(name)
+        else:
+            # The bounding box clips, leave room for descenders and overhangs
+            canv.beginForm(name, -inch, -inch, width + inch, height + inch)
+        draw(canv)
+        canv.endForm()
+    canv.doForm(name)
+
+
+class StaticLayout:
+    """Laid-out flowables of a static block, once per process and width"""
+
+    def __init__(self, build):
+        self.build = build
+        # width -> ([(y, flowable, width, height)], height, space before, space after)
+        self._layouts = {}
+        # Also held while drawing: the laid-out flowables are shared by all builds
+        self.lock = threading.Lock()
+
+    def get(self, width):
+        with self.lock:
+            layout = self._layouts.get(width)
+            if layout is None:
+                flowables = self.build()
+                placed = []
+                y = 0
+                for i, flowable in enumerate(flowables):
+                    # Spacing as a frame would add it, minus the block's own outer spacing
+                    if i:
+                        y += flowable.getSpaceBefore()
+                    flowable_width, flowable_height = flowable.wrap(width, 1e6)
+                    placed.append((y, flowable, flowable_width, flowable_height))
+                    y += flowable_height
+                    if i < len(flowables) - 1:
+                        y += flowable.getSpaceAfter()
+                layout = (placed, y, flowables[0].getSpaceBefore(), flowables[-1].getSpaceAfter())
+                self._layouts[width] = layout
+            return layout
+
+
+class StaticBlock(Flowable):
+    """Flowables identical in every report of a template and language (title block,
+    closing notes), kept together. The layout is shared by all builds of the process
+    (see static_block) and drawn with draw_static."""
+
+    def __init__(self, key, layout):
+        super().__init__()
+        self.key = key
+        self.layout = layout
+
+    def wrap(self, availWidth, availHeight):
+        self.width = availWidth
+        self.height = self.layout.get(availWidth)[1]
+        return self.width, self.height
+
+    def getSpaceBefore(self):
+        return self.layout.get(self.width)[2] if self.width else 0
+
+    def getSpaceAfter(self):
+        return self.layout.get(self.width)[3] if self.width else 0
+
+    def draw(self):
+        placed, height = self.layout.get(self.width)[:2]
+        width = self.width
+
+        def draw_block(canv):
+            for y, flowable, flowable_width, flowable_height in placed:
+                flowable.drawOn(canv, 0, height - y - flowable_height, _sW=width - flowable_width)
+
+        with self.layout.lock:
+            draw_static(self.canv, (self.key, width), draw_block, width, height)
+
+
+_static_layouts = {}
+_static_layouts_lock = threading.Lock()
+
+
+def static_block(key, build):
+    """A StaticBlock for `key` - everything its content depends on (template, language,
+    font, texts). build() returns its flowables the first time the key is laid out; the
+    flowable itself is new per build, since ReportLab keeps layout state on flowables."""
+    with _static_layouts_lock:
+        layout = _static_layouts.get(key)
+        if layout is None:
+            layout = _static_layouts[key] = StaticLayout(build)
+    return StaticBlock(key, layout)
+
+
+def record_date(record, field):
+    """Date field of a record as a date object (today if missing)"""
+    value = record.get(field)
+    if isinstance(value, str) and value:
+        try:
+            return datetime.strptime(value[:10], '%Y-%m-%d').date()
+        except ValueError:
+            return value
+    return value or datetime.now(CHINA_TZ).date()
+
+
+# Enhanced PDF Generation with Headers and Footers
+class PDFWithHeaderFooter(SimpleDocTemplate):
+    def __init__(self, *args, **kwargs):
+        self.header_text = kwargs.pop('header_text', '')
+        self.location = kwargs.pop('location', '')
+        self.pdf_language = kwargs.pop('pdf_language', 'en')
+        self.selected_city = kwargs.pop('selected_city', '')
+        self.chinese_city = kwargs.pop('chinese_city', '')
+        self.chinese_font = kwargs.pop('chinese_font', 'Helvetica')
+        self.generated_at = kwargs.pop('generated_at', None)
+        # Compiled template (from build_styles) for header/footer branding
+        self.report_styles = kwargs.pop('report_styles', None) or build_styles(self.pdf_language, self.chinese_font)
+        # List to receive a content hash per page, if given
+        self.page_hashes = kwargs.pop('page_hashes', None)
+        super().__init__(*args, **kwargs)
+        
+    def afterPage(self):
+        """Add header and footer, once per page"""
+        palette = self.report_styles["colors"]
+        page_width, page_height = self.pagesize
+        header_title = self.header_text or self.report_styles["header_text"]
+        
+        def draw_bands(canv):
+            # Add header on all pages except first
+            if self.page > 1:
+                # Header with gradient effect
+                canv.setFillColor(palette["primary"])
+                canv.rect(0, page_height - 0.6*inch, page_width, 0.6*inch, fill=1, stroke=0)
+                
+                # Template (or language script) font
+                canv.setFont(self.report_styles["bold_font"], 12)
+                canv.setFillColor(colors.white)
+                canv.drawCentredString(page_width/2.0, page_height - 0.4*inch, header_title)
+            
+            # Footer on all pages: background with subtle gradient
+            canv.setFillColor(palette["footer_background"])
+            canv.rect(0, 0, page_width, 0.7*inch, fill=1, stroke=0)
+            
+            # Top border
+            canv.setStrokeColor(palette["primary"])
+            canv.setLineWidth(1)
+            canv.line(0, 0.7*inch, page_width, 0.7*inch)
+        
+        # The bands are the same on every page of a template, so they are
+        # drawn once per document as a form XObject that pages reference
+        draw_static(
+            self.canv,
+            ("page_bands", self.page > 1, self.pagesize, self.report_styles["template"], self.report_styles["bold_font"],
+             header_title),
+            draw_bands
+        )
+        
+        # Footer text - template (or language script) font
+        self.canv.saveState()
+        font_size = 8
+        self.canv.setFont(self.report_styles["normal_font"], font_size)
+            
+        self.canv.setFillColor(palette["footer_text"])
+        
+        # Left: Location - Show Chinese city only for Chinese PDFs
+        current_time = self.generated_at or datetime.now(CHINA_TZ)
+        
+        if get_language(self.pdf_language).chinese_place_names and self.chinese_city:
+            location_info = f"地点: {self.selected_city} ({self.chinese_city})"
+        else:
+            location_info = f"Location: {self.selected_city}"
+        
+        self.canv.drawString(0.5*inch, 0.25*inch, location_info)
+        
+        # Center: Timestamp
+        timestamp = f"Generated: {current_time.strftime('%Y-%m-%d %H:%M:%S')}"
+        self.canv.drawCentredString(page_width/2.0, 0.25*inch, timestamp)
+        
+        # Right: Page number
+        page_num = f"Page {self.page}"
+        self.canv.drawRightString(page_width - 0.5*inch, 0.25*inch, page_num)
+        
+        self.canv.restoreState()
+        
+        if self.page_hashes is not None:
+            # Everything drawn on this page (the canvas' operator list), so previews can tell which pages changed
+            page_code = "\n".join(self.canv._code).encode("utf-8", "surrogateescape")
+            self.page_hashes.append(hashlib.sha1(page_code).hexdigest())
+
+
+def to_pdfa(pdf_bytes):
+    """PDF/A-2b conversion through Ghostscript (which embeds all fonts); None if unavailable"""
+    gs = shutil.which("gs")
+    if not gs:
+        return None
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "in.pdf")
+        target = os.path.join(tmp, "out.pdf")
+        with open(source, "wb") as fh:
+            fh.write(pdf_bytes)
+        subprocess.run(
+            [gs, "-dPDFA=2", "-dBATCH", "-dNOPAUSE", "-dQUIET", "-sColorConversionStrategy=RGB",
+             "-dPDFACompatibilityPolicy=1", "-sDEVICE=pdfwrite", f"-sOutputFile={target}", source],
+            check=True, timeout=120
+        )
+        with open(target, "rb") as fh:
+            return fh.read()
+
+
+def optimize_pdf(pdf_bytes, linearize=PDF_LINEARIZE, pdfa=PDF_ARCHIVE_PDFA, warn=None):
+    """Apply the optional output steps (PDF/A, linearization); returns the new bytes"""
+    warn = warn or (lambda message: None)
+    if pdfa:
+        try:
+            converted = to_pdfa(pdf_bytes)
+            if converted is None:
+                warn("PDF/A output requested but Ghostscript is not installed.")
+            else:
+                pdf_bytes = converted
+        except (subprocess.SubprocessError, OSError) as e:
+            warn(f"PDF/A conversion failed: {str(e)}")
+    if linearize:
+        try:
+            import pikepdf
+        except ImportError:
+            warn("PDF linearization requested but pikepdf is not installed.")
+            return pdf_bytes
+        with pikepdf.open(io.BytesIO(pdf_bytes)) as pdf:
+            pdf.remove_unreferenced_resources()
+            out = io.BytesIO()
+            pdf.save(
+                out,
+                linearize=True,
+                compress_streams=True,
+                object_stream_mode=pikepdf.ObjectStreamMode.generate
+            )
+            pdf_bytes = out.getvalue()
+    return pdf_bytes
+
+
+def report_template_name(record):
+    """Template of a report: the one pinned when it was saved, else chosen by its brand"""
+    if record.get("template_pin"):
+        return pinned_template_name(record["template_pin"])
+    return template_name_for_brand(record.get("brand"))
+
+
+def report_story(record, pdf_lang, chinese_font, translate_pdf_content, current_time):
+    """Flowables of one report; used by build_pdf and by compiled multi-report documents"""
+    selected_city = record.get("city") or "Shanghai"
+    chinese_city = CHINESE_CITIES.get(selected_city, "")
+    
+    elements = []
+    report_styles = build_styles(pdf_lang, chinese_font, report_template_name(record))
+    palette = report_styles["colors"]
+    column_widths = report_styles["column_widths"]
+    normal_font = report_styles["normal_font"]
+    bold_font = report_styles["bold_font"]
+    title_style = report_styles["title"]
+    company_style = report_styles["company"]
+    subtitle_style = report_styles["subtitle"]
+    heading_style = report_styles["heading"]
+    subheading_style = report_styles["subheading"]
+    risk_desc_style = report_styles["risk_desc"]
+    risk_continued_style = report_styles["risk_continued"]
+    normal_style = report_styles["normal"]
+    
+    # Fixed content is laid out once per template, language and text and
+    # shared by the reports of a document as form XObjects (see StaticBlock)
+    styles_key = (report_styles["template"], pdf_lang, chinese_font)
+    
+    # Company Header
+    elements.append(Spacer(1, 10))
+    report_title = translate_pdf_content("Production Risk Assessment Report", pdf_lang)
+    
+    def title_block():
+        block = []
+        if report_styles["logo"]:
+            logo_path, logo_width, logo_height = report_styles["logo"]
+            block.append(Image(logo_path, width=logo_width, height=logo_height))
+            block.append(Spacer(1, 6))
+        block.append(Paragraph(escape(report_styles["company_name"]), company_style))
+        
+        # Title
+        block.append(Paragraph(report_title, title_style))
+        return block
+    
+    elements.append(static_block(styles_key + ("title", report_title), title_block))
+    
+    # Location and date
+    if get_language(pdf_lang).chinese_place_names:
+        location_text = translate_pdf_content(f"地点: {selected_city} ({chinese_city})", pdf_lang)
+    else:
+        location_text = f"Location: {selected_city}"
+    
+    date_text = translate_pdf_content(f"Report Date: {current_time.strftime('%Y-%m-%d')}", pdf_lang)
+    
+    elements.append(Paragraph(location_text, subtitle_style))
+    elements.append(Paragraph(date_text, subtitle_style))
+    
+    # Decorative line
+    elements.append(Paragraph(f"<hr width='80%' color='#{palette['primary'].hexval()[2:]}'/>", normal_style))
+    elements.append(Spacer(1, 15))
+    
+    # Helper function for creating paragraphs
+    def create_paragraph(text, style=normal_style, bold=False):
+        """Create paragraph with appropriate font"""
+        if bold:
+            font_name = bold_font
+        else:
+            font_name = normal_font
+        
+        return Paragraph(text, font_variant(style, font_name))
+    
+    def create_text(text, style=risk_desc_style, continued_style=risk_continued_style):
+        """Free text typed by users: escaped, one paragraph per chunk so it can split across pages"""
+        chunks = text_chunks(text)
+        if not chunks:
+            return [create_paragraph("-", style)]
+        return [create_paragraph(chunk, continued_style if continued else style) for chunk, continued in chunks]
+    
+    # Section headings are numbered in the template's section order
+    section_number = [0]
+    
+    def section_heading(title):
+        section_number[0] += 1
+        return Paragraph(f"{section_number[0]}. {translate_pdf_content(title, pdf_lang)}", heading_style)
+    
+    def basic_section():
+        """Basic information table"""
+        section = [section_heading("BASIC INFORMATION"), Spacer(1, 5)]
+        
+        # Get values from the record or use defaults
+        po_number_val = record.get('po_number') or ''
+        style_val = record.get('style') or ''
+        brand_val = record.get('brand') or ''
+        sales_person_val = record.get('sales') or ''
+        factory_val = record.get('factory') or ''
+        assessment_date_val = record_date(record, 'assessment_date')
+        
+        basic_data = [
+            [
+                create_paragraph(translate_pdf_content("PO / Order Number:", pdf_lang), bold=True), 
+                create_paragraph(escape(po_number_val)), 
+                create_paragraph(translate_pdf_content("Style / Model:", pdf_lang), bold=True), 
+                create_paragraph(escape(style_val))
+            ],
+            [
+                create_paragraph(translate_pdf_content("Brand / Trademark:", pdf_lang), bold=True), 
+                create_paragraph(escape(brand_val)), 
+                create_paragraph(translate_pdf_content("Sales / Business:", pdf_lang), bold=True), 
+                create_paragraph(escape(sales_person_val))
+            ],
+            [
+                create_paragraph(translate_pdf_content("Factory Name:", pdf_lang), bold=True), 
+                create_paragraph(escape(factory_val)), 
+                create_paragraph(translate_pdf_content("Assessment Date:", pdf_lang), bold=True), 
+                create_paragraph(assessment_date_val.strftime('%Y-%m-%d') if hasattr(assessment_date_val, 'strftime') else str(assessment_date_val))
+            ]
+        ]
+        
+        basic_table = Table(basic_data, colWidths=column_widths["basic"])
+        basic_table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (0, -1), palette["label_background"]),
+            ('BACKGROUND', (2, 0), (2, -1), palette["label_background"]),
+            ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
+            ('ALIGN', (0, 0), (0, -1), 'LEFT'),
+            ('ALIGN', (2, 0), (2, -1), 'LEFT'),
+            ('FONTNAME', (0, 0), (0, -1), bold_font),
+            ('FONTNAME', (2, 0), (2, -1), bold_font),
+            ('FONTSIZE', (0, 0), (-1, -1), 9),
+            ('GRID', (0, 0), (-1, -1), 0.5, palette["basic_grid"]),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('LEFTPADDING', (0, 0), (-1, -1), 8),
+            ('RIGHTPADDING', (0, 0), (-1, -1), 8),
+            ('ROWBACKGROUNDS', (0, 0), (-1, -1), [colors.white, palette["alternate_row"]])
+        ]))
+        section.append(basic_table)
+        section.append(Spacer(1, 15))
+        return section
+    
+    def photos_section():
+        """Shoe photos, two per row, from the blob store's cached print renditions"""
+        photo_cells = []
+        for photo in record.get("photos") or []:
+            try:
+                path, width, height = default_blob_store().rendition(photo["sha256"], "print")
+            except (OSError, KeyError):
+                continue
+            scale = min(3.2*inch / width, 2.4*inch / height)
+            photo_cells.append([
+                Image(path, width=width * scale, height=height * scale),
+                create_paragraph(escape(photo.get("name") or ""))
+            ])
+        if not photo_cells:
+            return []
+        section = [Paragraph(translate_pdf_content("Shoe Photos:", pdf_lang), subheading_style)]
+        if len(photo_cells) % 2:
+            photo_cells.append("")
+        photo_table = Table(
+            [photo_cells[i:i + 2] for i in range(0, len(photo_cells), 2)],
+            colWidths=column_widths["photos"]
+        )
+        photo_table.setStyle(TableStyle([
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+            ('GRID', (0, 0), (-1, -1), 0.5, palette["grid"])
+        ]))
+        section.append(photo_table)
+        section.append(Spacer(1, 15))
+        return section
+    
+    def risk_section():
+        """Risk assessment matrix and overall result"""
+        section = [section_heading("RISK ASSESSMENT MATRIX"), Spacer(1, 5)]
+        
+        # Risk stage descriptions
+        risk_descriptions = [
+            {
+                "key": stage["key"],
+                "title": stage["title"],
+                "content": record.get(risk_field(stage["key"])) or '',
+                "cap": record.get(cap_field(stage["key"])) or ''
+            }
+            for stage in record_schema(record).stages
+        ]
+        
+        # Create risk assessment table
+        risk_headers = [
+            create_paragraph(translate_pdf_content("Risk Stage", pdf_lang), bold=True),
+            create_paragraph(translate_pdf_content("Description", pdf_lang), bold=True),
+            create_paragraph(translate_pdf_content("CAP Description", pdf_lang), bold=True),
+            create_paragraph(translate_pdf_content("Risk Level", pdf_lang), bold=True)
+        ]
+        
+        risk_data = [risk_headers]
+        
+        # Stage scores from the severity/likelihood ratings
+        scores = stage_scores(record)
+        stage_styles = []
+        
+        # Each stage spans one row per chunk of its description/CAP text, so the
+        # table breaks between small rows instead of re-wrapping a huge cell on
+        # every page. Lines are only drawn between stages.
+        for i, risk in enumerate(risk_descriptions):
+            score = scores[risk["key"]]
+            level = risk_level(score)
+            level_text = translate_pdf_content(level, pdf_lang)
+            content_chunks = create_text(risk["content"])
+            cap_chunks = create_text(risk["cap"])
+            first_row = len(risk_data)
+            for j in range(max(len(content_chunks), len(cap_chunks))):
+                risk_data.append([
+                    create_paragraph(translate_pdf_content(risk["title"], pdf_lang), bold=True) if j == 0 else "",
+                    content_chunks[j] if j < len(content_chunks) else "",
+                    cap_chunks[j] if j < len(cap_chunks) else "",
+                    create_paragraph(f"{level_text} ({score})" if score else level_text, bold=True) if j == 0 else ""
+                ])
+            last_row = len(risk_data) - 1
+            if i % 2:
+                stage_styles.append(('BACKGROUND', (0, first_row), (2, last_row), palette["alternate_row"]))
+            stage_styles.append(('BACKGROUND', (3, first_row), (3, last_row), colors.HexColor(RISK_LEVEL_COLORS[level])))
+            stage_styles.append(('LINEBELOW', (0, last_row), (-1, last_row), 0.5, palette["grid"]))
+        
+        # Header row repeats on every page
+        risk_table = LongTable(risk_data, colWidths=column_widths["risk"], repeatRows=1)
+        risk_table.setStyle(TableStyle(stage_styles + report_styles["risk_table_style"]))
+        section.append(risk_table)
+        section.append(Spacer(1, 10))
+        
+        # Overall result
+        report_score = overall_score(record)
+        report_level = risk_level(report_score)
+        overall_text = translate_pdf_content("Overall Result:", pdf_lang)
+        overall_level = translate_pdf_content(report_level, pdf_lang)
+        overall_table = Table(
+            [[
+                create_paragraph(overall_text, bold=True),
+                create_paragraph(f"{overall_level} - {report_score} / {MAX_SCORE}" if report_score else overall_level, bold=True)
+            ]],
+            colWidths=column_widths["overall"]
+        )
+        overall_table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (0, 0), palette["label_background"]),
+            ('BACKGROUND', (1, 0), (1, 0), colors.HexColor(RISK_LEVEL_COLORS[report_level])),
+            ('GRID', (0, 0), (-1, -1), 0.5, palette["grid"]),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('LEFTPADDING', (0, 0), (-1, -1), 6),
+            ('RIGHTPADDING', (0, 0), (-1, -1), 6)
+        ]))
+        section.append(overall_table)
+        section.append(Spacer(1, 20))
+        return section
+    
+    def comments_section():
+        """Department comments"""
+        section = [section_heading("DEPARTMENT COMMENTS"), Spacer(1, 10)]
+        
+        # Sales Comments
+        section.append(Paragraph(translate_pdf_content("Sales Comments:", pdf_lang), subheading_style))
+        section.extend(create_text(record.get('sales_comments') or ''))
+        section.append(Spacer(1, 8))
+        
+        # Technical Comments
+        section.append(Paragraph(translate_pdf_content("Technical Comments:", pdf_lang), subheading_style))
+        section.extend(create_text(record.get('tech_comments') or ''))
+        section.append(Spacer(1, 8))
+        
+        # QC Manager Comments
+        section.append(Paragraph(translate_pdf_content("QC Manager Comments:", pdf_lang), subheading_style))
+        section.extend(create_text(record.get('qc_comments') or ''))
+        section.append(Spacer(1, 15))
+        return section
+    
+    def conclusion_section():
+        """Conclusion and signatures"""
+        section = [section_heading("CONCLUSION & APPROVALS"), Spacer(1, 10)]
+        
+        # Conclusion
+        section.append(Paragraph(translate_pdf_content("Conclusion:", pdf_lang), subheading_style))
+        section.extend(create_text(record.get('conclusion') or ''))
+        section.append(Spacer(1, 15))
+        
+        # Get signature data from the record
+        sales_signature_val = record.get('sales_signature') or ''
+        sales_date_val = record_date(record, 'sales_date')
+        tech_signature_val = record.get('tech_signature') or ''
+        tech_date_val = record_date(record, 'tech_date')
+        qc_signature_val = record.get('qc_signature') or ''
+        qc_date_val = record_date(record, 'qc_date')
+        
+        # Signature table
+        sig_data = [
+            [
+                create_paragraph(translate_pdf_content("Sales:", pdf_lang), bold=True),
+                create_paragraph(escape(sales_signature_val) if sales_signature_val else "_________________"),
+                create_paragraph(translate_pdf_content("Date:", pdf_lang), bold=True),
+                create_paragraph(sales_date_val.strftime('%Y-%m-%d') if hasattr(sales_date_val, 'strftime') else "__________")
+            ],
+            [
+                create_paragraph(translate_pdf_content("Technical:", pdf_lang), bold=True),
+                create_paragraph(escape(tech_signature_val) if tech_signature_val else "_________________"),
+                create_paragraph(translate_pdf_content("Date:", pdf_lang), bold=True),
+                create_paragraph(tech_date_val.strftime('%Y-%m-%d') if hasattr(tech_date_val, 'strftime') else "__________")
+            ],
+            [
+                create_paragraph(translate_pdf_content("QC Manager:", pdf_lang), bold=True),
+                create_paragraph(escape(qc_signature_val) if qc_signature_val else "_________________"),
+                create_paragraph(translate_pdf_content("Date:", pdf_lang), bold=True),
+                create_paragraph(qc_date_val.strftime('%Y-%m-%d') if hasattr(qc_date_val, 'strftime') else "__________")
+            ]
+        ]
+        
+        sig_table = Table(sig_data, colWidths=column_widths["signatures"])
+        sig_table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (0, -1), palette["label_background"]),
+            ('BACKGROUND', (2, 0), (2, -1), palette["label_background"]),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('FONTNAME', (0, 0), (0, -1), bold_font),
+            ('FONTNAME', (2, 0), (2, -1), bold_font),
+            ('FONTSIZE', (0, 0), (-1, -1), 9),
+            ('GRID', (0, 0), (-1, -1), 0.5, palette["grid"]),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ]))
+        section.append(sig_table)
+        return section
+    
+    def notes_section():
+        """Distribution note and confidentiality notice"""
+        process_note = translate_pdf_content(
+            "Note: QC will send this report to office together with final inspection report. "
+            "Office assistant will upload to ERP system and send email to factory/agent accordingly.",
+            pdf_lang
+        )
+        footer_note = translate_pdf_content(
+            "This report is confidential and property of the company. Unauthorized distribution is prohibited.",
+            pdf_lang
+        )
+        return [
+            Spacer(1, 20),
+            static_block(
+                styles_key + ("notes", process_note, footer_note),
+                lambda: [Paragraph(process_note, normal_style), Spacer(1, 10), Paragraph(footer_note, normal_style)]
+            )
+        ]
+    
+    section_builders = {
+        "basic": basic_section,
+        "photos": photos_section,
+        "risk": risk_section,
+        "comments": comments_section,
+        "conclusion": conclusion_section,
+        "notes": notes_section
+    }
+    for name in report_styles["sections"]:
+        if name in report_styles["page_breaks"]:
+            elements.append(PageBreak())
+        elements.extend(section_builders[name]())
+    
+    return elements
+
+
+def build_pdf(record, pdf_lang="en", translate=None, on_warning=None, progress=None, generated_at=None,
+              linearize=PDF_LINEARIZE, pdfa=PDF_ARCHIVE_PDFA, size_budget_kb=PDF_SIZE_BUDGET_KB, page_hashes=None):
+    """Build the PDF report for a report record; returns a BytesIO.
+
+    translate(text, pdf_lang) translates fixed labels, on_warning(message)
+    reports non-fatal problems and progress(stage) is told when the build
+    moves on to "translating", "layout" and "done". Output larger than
+    `size_budget_kb` is reported through on_warning. A `page_hashes` list
+    receives one content hash per page.
+    """
+    buffer = io.BytesIO()
+    translate_pdf_content = translate or (lambda text, lang: text)
+    warn = on_warning or (lambda message: None)
+    notify = progress or (lambda stage: None)
+    notify("translating")
+    
+    # Get location info
+    selected_city = record.get("city") or "Shanghai"
+    chinese_city = CHINESE_CITIES.get(selected_city, "")
+    current_time = generated_at or datetime.now(CHINA_TZ)
+    
+    # Register Chinese font if needed (once per process)
+    chinese_font, font_warnings = register_pdf_font(pdf_lang)
+    for warning in font_warnings:
+        warn(warning)
+    
+    # Create PDF with custom header/footer from the brand's template
+    report_styles = build_styles(pdf_lang, chinese_font, report_template_name(record))
+    doc = PDFWithHeaderFooter(
+        buffer, 
+        pagesize=A4,
+        pageCompression=1,
+        topMargin=0.8*inch,
+        bottomMargin=0.8*inch,
+        header_text=report_styles["header_text"],
+        location=f"{selected_city}",
+        pdf_language=pdf_lang,
+        selected_city=selected_city,
+        chinese_city=chinese_city,
+        chinese_font=chinese_font,
+        generated_at=current_time,
+        report_styles=report_styles,
+        page_hashes=page_hashes
+    )
+    
+    elements = report_story(record, pdf_lang, chinese_font, translate_pdf_content, current_time)
+    
+    # Build PDF
+    notify("layout")
+    doc.build(elements)
+    if linearize or pdfa:
+        buffer = io.BytesIO(optimize_pdf(buffer.getvalue(), linearize, pdfa, warn))
+    size_kb = buffer.getbuffer().nbytes / 1024
+    if size_budget_kb and size_kb > size_budget_kb:
+        warn(f"PDF is {size_kb:.0f} KB, over the {size_budget_kb} KB size budget.")
+    buffer.seek(0)
+    notify("done")
+    return buffer
@@ -0,0 +1,208 @@
+"""Live PDF preview rendered in the background while a report is edited.
+
+Every rerun hands the current record to PreviewManager.request. Renders are
+debounced: one starts only after the record has stopped changing for
+PREVIEW_DEBOUNCE_SECONDS, so typing through a comment triggers a single
+render. A newer request makes older ones stale - a render that has not
+started is cancelled, one in progress is abandoned at its next stage and
+its result is never shown.
+
+Pages are identified by a hash of what was drawn on them (build_pdf's
+page_hashes), with a fixed generation time so unchanged pages hash the
+same between renders. Page images are cached by that hash, so after an
+edit only the pages whose content changed are rasterized again. Page
+images need pypdfium2 (optional); without it the preview still tracks
+pages and offers the latest PDF.
+"""
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from pdf_jobs import job_key
+from pdf_report import CHINA_TZ, build_pdf
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+PREVIEW_DEBOUNCE_SECONDS = float(os.getenv("PREVIEW_DEBOUNCE_SECONDS", "1.5"))
+# Rasterization scale (1.0 = 72 dpi)
+PREVIEW_SCALE = float(os.getenv("PREVIEW_SCALE", "1.2"))
+# Page images kept in memory, shared by all sessions
+PREVIEW_CACHE_PAGES = int(os.getenv("PREVIEW_CACHE_PAGES", "500"))
+# Sessions whose preview was not requested for this long are dropped
+PREVIEW_IDLE_SECONDS = 3600
+
+
+class PreviewCancelled(Exception):
+    """A newer edit made this render stale"""
+
+
+class PreviewResult:
+    """Latest finished preview of one session"""
+
+    def __init__(self, generation, pdf_bytes, page_hashes, changed_pages, warnings, error=None):
+        self.generation = generation
+        self.pdf_bytes = pdf_bytes
+        self.page_hashes = page_hashes
+        # 0-based indexes of pages that differ from the previous preview
+        self.changed_pages = changed_pages
+        self.warnings = warnings
+        self.error = error
+        self.rendered_at = time.time()
+
+
+class _SessionPreview:
+    def __init__(self):
+        self.key = None
+        self.generation = 0
+        self.timer = None
+        self.future = None
+        self.result = None
+        self.requested_at = 0.0
+
+
+class PreviewManager:
+    """Debounced background preview renders for all sessions of the app"""
+
+    def __init__(self, translate=None, debounce=PREVIEW_DEBOUNCE_SECONDS, max_workers=2):
+        # translate(text, pdf_lang) for non-English previews
+        self.translate = translate
+        self.debounce = debounce
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pdf-preview")
+        self._sessions = {}
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def request(self, session_id, record, pdf_lang):
+        """Note the current record of a session; a render follows once it stops changing"""
+        key = job_key(record, pdf_lang)
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            session = self._sessions.setdefault(session_id, _SessionPreview())
+            session.requested_at = now
+            if key == session.key:
+                return
+            session.key = key
+            session.generation += 1
+            if session.timer is not None:
+                session.timer.cancel()
+            if session.future is not None:
+                session.future.cancel()
+            session.timer = threading.Timer(
+                self.debounce, self._submit, args=(session_id, session.generation, record, pdf_lang)
+            )
+            session.timer.daemon = True
+            session.timer.start()
+
+    def status(self, session_id):
+        """(latest PreviewResult or None, True while a newer render is pending or running)"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None, False
+            pending = session.result is None or session.result.generation != session.generation
+            return session.result, pending
+
+    def page_image(self, page_hash):
+        """PNG bytes of a rendered page, or None"""
+        with self._lock:
+            return self._images.get(page_hash)
+
+    def discard(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session and session.timer is not None:
+                session.timer.cancel()
+
+    def _current(self, session_id, generation):
+        session = self._sessions.get(session_id)
+        return session is not None and session.generation == generation
+
+    def _submit(self, session_id, generation, record, pdf_lang):
+        with self._lock:
+            if not self._current(session_id, generation):
+                return
+            self._sessions[session_id].future = self._executor.submit(
+                self._render, session_id, generation, record, pdf_lang
+            )
+
+    def _render(self, session_id, generation, record, pdf_lang):
+        def check_current(stage=None):
+            with self._lock:
+                if not self._current(session_id, generation):
+                    raise PreviewCancelled()
+
+        warnings = []
+        page_hashes = []
+        try:
+            check_current()
+            # Fixed generation time, so the footer does not make every page differ
+            today = datetime.now(CHINA_TZ).replace(hour=0, minute=0, second=0, microsecond=0)
+            pdf_bytes = build_pdf(
+                record,
+                pdf_lang,
+                translate=self.translate if pdf_lang != "en" else None,
+                on_warning=warnings.append,
+                progress=check_current,
+                generated_at=today,
+                linearize=False,
+                pdfa=False,
+                size_budget_kb=0,
+                page_hashes=page_hashes
+            ).getvalue()
+            check_current()
+            self._rasterize(pdf_bytes, page_hashes)
+            result_error = None
+        except PreviewCancelled:
+            return
+        except Exception as e:
+            pdf_bytes, page_hashes, result_error = None, [], str(e)
+
+        with self._lock:
+            if not self._current(session_id, generation):
+                return
+            session = self._sessions[session_id]
+            previous = session.result.page_hashes if session.result else []
+            changed = [
+                i for i, page_hash in enumerate(page_hashes)
+                if i >= len(previous) or previous[i] != page_hash
+            ]
+            session.result = PreviewResult(generation, pdf_bytes, page_hashes, changed, warnings, result_error)
+
+    def _rasterize(self, pdf_bytes, page_hashes):
+        """Render the pages not already cached by content hash"""
+        if pdfium is None:
+            return
+        with self._lock:
+            missing = [i for i, page_hash in enumerate(page_hashes) if page_hash not in self._images]
+            for page_hash in page_hashes:
+                if page_hash in self._images:
+                    self._images.move_to_end(page_hash)
+        if not missing:
+            return
+        document = pdfium.PdfDocument(pdf_bytes)
+        try:
+            for i in missing:
+                image = document[i].render(scale=PREVIEW_SCALE).to_pil()
+                buffer = io.BytesIO()
+                image.save(buffer, format="PNG", optimize=True)
+                with self._lock:
+                    self._images[page_hashes[i]] = buffer.getvalue()
+                    while len(self._images) > PREVIEW_CACHE_PAGES:
+                        self._images.popitem(last=False)
+        finally:
+            document.close()
+
+    def _prune(self, now):
+        idle = [sid for sid, session in self._sessions.items() if now - session.requested_at > PREVIEW_IDLE_SECONDS]
+        for session_id in idle:
+            session = self._sessions.pop(session_id)
+            if session.timer is not None:
+                session.timer.cancel()
@@ -0,0 +1,195 @@
+"""Shared OpenAI rate limiting across sessions, threads and server processes.
+
+Two token buckets - requests per minute and tokens per minute - live in a
+small SQLite file, so every Streamlit process and render worker on the host
+draws from the same quota. Callers queue instead of failing: a waiter only
+takes from the buckets when it is at the head of the queue, ordered by
+priority class (interactive UI text before bulk PDF jobs) and then arrival.
+Waiters left behind by crashed processes expire after a few seconds.
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+DEFAULT_LIMITER_PATH = os.getenv("RATE_LIMIT_DB_PATH", "rate_limits.db")
+
+REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_RPM", "500"))
+TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TPM", "200000"))
+
+# Priority classes, lower goes first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+MAX_WAIT = {
+    PRIORITY_INTERACTIVE: float(os.getenv("RATE_LIMIT_INTERACTIVE_WAIT", "30")),
+    PRIORITY_BULK: float(os.getenv("RATE_LIMIT_BULK_WAIT", "300"))
+}
+
+POLL_INTERVAL = 0.05
+MAX_SLEEP = 0.5
+# Waiters not seen for this long belong to dead processes
+STALE_AFTER = 10.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY,
+    level REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS waiters (
+    id TEXT PRIMARY KEY,
+    priority INTEGER NOT NULL,
+    enqueued REAL NOT NULL,
+    seen REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_waiters_order ON waiters(priority, enqueued);
+"""
+
+
+class RateLimitTimeout(Exception):
+    """Waited longer than allowed for rate limit capacity"""
+
+
+def estimate_tokens(messages, max_tokens):
+    """Rough token cost of a chat request: ~3 characters per token in, similar out"""
+    prompt = sum(len(message["content"]) for message in messages) // 3 + 4 * len(messages)
+    return prompt + min(max_tokens, prompt + 20)
+
+
+class RateLimiter:
+    """Request and token buckets shared through a SQLite file"""
+
+    def __init__(self, path=DEFAULT_LIMITER_PATH, requests_per_minute=REQUESTS_PER_MINUTE,
+                 tokens_per_minute=TOKENS_PER_MINUTE):
+        self.path = path
+        self.capacity = {"requests": float(requests_per_minute), "tokens": float(tokens_per_minute)}
+        self.rate = {name: capacity / 60.0 for name, capacity in self.capacity.items()}
+        self._local = threading.local()
+
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        now = time.time()
+        for name, capacity in self.capacity.items():
+            conn.execute("INSERT OR IGNORE INTO buckets (name, level, updated) VALUES (?, ?, ?)", (name, capacity, now))
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _levels(self, conn, now):
+        """Current bucket levels after refilling since their last update"""
+        levels = {}
+        for name, level, updated in conn.execute("SELECT name, level, updated FROM buckets"):
+            if name in self.capacity:
+                levels[name] = min(self.capacity[name], level + max(0.0, now - updated) * self.rate[name])
+        return levels
+
+    def _store(self, conn, levels, now):
+        conn.executemany(
+            "UPDATE buckets SET level = ?, updated = ? WHERE name = ?",
+            [(level, now, name) for name, level in levels.items()]
+        )
+
+    def _try_acquire(self, waiter_id, tokens):
+        """Take capacity if this waiter is first in line; returns 0 or seconds to wait"""
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("UPDATE waiters SET seen = ? WHERE id = ?", (now, waiter_id))
+            conn.execute("DELETE FROM waiters WHERE seen < ?", (now - STALE_AFTER,))
+            head = conn.execute("SELECT id FROM waiters ORDER BY priority, enqueued LIMIT 1").fetchone()
+            if head is None or head[0] != waiter_id:
+                conn.execute("COMMIT")
+                return POLL_INTERVAL
+
+            levels = self._levels(conn, now)
+            # A single request larger than the whole bucket waits for a full bucket
+            need = {"requests": 1.0, "tokens": min(float(tokens), self.capacity["tokens"])}
+            wait = max(
+                (need[name] - levels[name]) / self.rate[name] if levels[name] < need[name] else 0.0
+                for name in need
+            )
+            if wait <= 0:
+                for name in need:
+                    levels[name] -= need[name]
+                conn.execute("DELETE FROM waiters WHERE id = ?", (waiter_id,))
+            self._store(conn, levels, now)
+            conn.execute("COMMIT")
+            return wait
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def acquire(self, tokens=0, priority=PRIORITY_BULK, timeout=None):
+        """Block until one request of about `tokens` tokens fits the quota.
+
+        Raises RateLimitTimeout after `timeout` seconds (default per priority).
+        """
+        timeout = MAX_WAIT.get(priority, MAX_WAIT[PRIORITY_BULK]) if timeout is None else timeout
+        deadline = time.time() + timeout
+        waiter_id = uuid.uuid4().hex
+        now = time.time()
+        self._connection().execute(
+            "INSERT INTO waiters (id, priority, enqueued, seen) VALUES (?, ?, ?, ?)",
+            (waiter_id, priority, now, now)
+        )
+        try:
+            while True:
+                wait = self._try_acquire(waiter_id, tokens)
+                if wait <= 0:
+                    return
+                if time.time() + min(wait, MAX_SLEEP) > deadline:
+                    raise RateLimitTimeout(f"No translation quota available within {timeout:.0f}s")
+                time.sleep(min(wait, MAX_SLEEP))
+        finally:
+            self._connection().execute("DELETE FROM waiters WHERE id = ?", (waiter_id,))
+
+    def adjust(self, tokens):
+        """Charge (or refund, if negative) the difference between estimated and actual tokens"""
+        if not tokens:
+            return
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            levels = self._levels(conn, now)
+            levels["tokens"] = min(self.capacity["tokens"], levels["tokens"] - tokens)
+            self._store(conn, levels, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def backoff(self, seconds):
+        """Pause everyone for about `seconds` (after the API reported a rate limit anyway)"""
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            levels = self._levels(conn, now)
+            for name in levels:
+                levels[name] = min(levels[name], -self.rate[name] * seconds)
+            self._store(conn, levels, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def retry_after_seconds(error, default=5.0):
+    """Retry delay suggested by an OpenAI rate limit error, or None if it isn't one"""
+    if getattr(error, "status_code", None) != 429:
+        return None
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return max(0.5, float(headers.get("retry-after", default)))
+    except (TypeError, ValueError):
+        return default
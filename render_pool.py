@@ -0,0 +1,211 @@
+"""Pool of pre-started PDF render worker processes.
+
+ReportLab layout is pure Python and holds the GIL, so PDFs built on the
+Streamlit server threads are effectively serialized on one core. The pool
+keeps warm worker processes (fonts registered, styles built) and hands each
+render job to an idle worker over a pipe:
+
+- jobs beyond ``workers + max_queue`` in flight are rejected (RenderQueueFull)
+- a job running past its timeout gets its worker killed and replaced (RenderTimeout)
+- a worker that dies mid-job is replaced without affecting others (RenderCrashed)
+
+Workers are started as plain ``python -c`` subprocesses talking over an
+inherited pipe, not through multiprocessing's spawn/forkserver: those
+re-import the ``__main__`` module, which inside Streamlit is the app script.
+POSIX only.
+"""
+import multiprocessing
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from multiprocessing.connection import Connection
+
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_TIMEOUT = float(os.getenv("PDF_RENDER_TIMEOUT", "120"))
+
+
+class RenderError(Exception):
+    """A render job failed"""
+
+
+class RenderQueueFull(RenderError):
+    """Too many render jobs are already waiting"""
+
+
+class RenderTimeout(RenderError):
+    """A render job took longer than its timeout"""
+
+
+class RenderCrashed(RenderError):
+    """The worker process died while rendering"""
+
+
+def _worker_main(conn):
+    """Render worker process: warm up, then serve jobs until the pipe closes"""
+    from pdf_report import build_pdf, build_styles, register_pdf_font
+    from translation import Translator, create_openai_client
+    from translation_memory import TranslationMemory
+    from rate_limiter import RateLimiter, PRIORITY_BULK
+
+    translator = Translator(
+        create_openai_client(),
+        memory=TranslationMemory(),
+        limiter=RateLimiter(),
+        priority=PRIORITY_BULK
+    )
+
+    # Warm up: register fonts, build styles and lay out one empty report
+    for lang in ("en", "zh"):
+        build_styles(lang, register_pdf_font(lang)[0])
+    build_pdf({"city": "Shanghai"}, "en")
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+
+        record, pdf_lang, options = message
+        warnings = []
+        translator.on_error = lambda e: warnings.append(f"Translation failed: {str(e)}. Using original text.")
+        try:
+            if options.pop("document", "report") == "digest":
+                # `record` is a factory digest (see digest.py)
+                from digest import build_digest_pdf
+                buffer = build_digest_pdf(
+                    record, pdf_lang, translate=translator.translate_pdf_content, on_warning=warnings.append
+                )
+            else:
+                buffer = build_pdf(
+                    record,
+                    pdf_lang,
+                    translate=translator.translate_pdf_content,
+                    on_warning=warnings.append,
+                    progress=lambda stage: conn.send(("progress", stage)),
+                    **options
+                )
+            conn.send(("ok", buffer.getvalue(), warnings))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}", traceback.format_exc()))
+
+
+def worker_entry(fd):
+    """Entry point of a worker subprocess; `fd` is its end of the job pipe"""
+    _worker_main(Connection(fd))
+
+
+class _Worker:
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+
+    def kill(self):
+        try:
+            self.conn.close()
+        finally:
+            if self.process.poll() is None:
+                self.process.kill()
+            self.process.wait(timeout=5)
+
+
+class RenderPool:
+    """Warm render worker processes shared by all sessions of the app"""
+
+    def __init__(self, workers=None, max_queue=None, timeout=DEFAULT_TIMEOUT):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = self.workers * 4 if max_queue is None else max_queue
+        self.timeout = timeout
+        self._idle = queue.Queue()
+        self._slots = threading.BoundedSemaphore(self.workers + self.max_queue)
+        self._closed = False
+        for _ in range(self.workers):
+            self._idle.put(self._spawn())
+
+    def _spawn(self):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [MODULE_DIR, env.get("PYTHONPATH")]))
+        process = subprocess.Popen(
+            [sys.executable, "-c", f"from render_pool import worker_entry; worker_entry({child_conn.fileno()})"],
+            pass_fds=[child_conn.fileno()],
+            env=env
+        )
+        child_conn.close()
+        return _Worker(process, parent_conn)
+
+    def _replace(self, worker):
+        worker.kill()
+        if not self._closed:
+            self._idle.put(self._spawn())
+
+    def render(self, record, pdf_lang="en", timeout=None, progress=None, **options):
+        """Render a record in a worker; returns (pdf bytes, warnings).
+
+        Pass document="digest" to render a factory digest from digest.py instead.
+
+        Blocks the calling thread only; other sessions render in parallel on
+        other workers. `timeout` covers queueing and rendering.
+        """
+        if self._closed:
+            raise RenderError("Render pool is closed")
+        if not self._slots.acquire(blocking=False):
+            raise RenderQueueFull(f"{self.workers + self.max_queue} render jobs already in progress")
+
+        deadline = time.monotonic() + (timeout or self.timeout)
+        try:
+            try:
+                worker = self._idle.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                raise RenderTimeout("Timed out waiting for a free render worker")
+            if progress:
+                progress("queued")
+            return self._run(worker, (record, pdf_lang, options), deadline, progress)
+        finally:
+            self._slots.release()
+
+    def _run(self, worker, job, deadline, progress):
+        try:
+            worker.conn.send(job)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not worker.conn.poll(remaining):
+                    self._replace(worker)
+                    raise RenderTimeout("PDF rendering timed out")
+                message = worker.conn.recv()
+                if message[0] == "progress":
+                    if progress:
+                        progress(message[1])
+                    continue
+                break
+        except (EOFError, OSError, BrokenPipeError):
+            self._replace(worker)
+            raise RenderCrashed("PDF render worker crashed")
+
+        if self._closed:
+            worker.kill()
+        else:
+            self._idle.put(worker)
+        if message[0] == "error":
+            raise RenderError(message[1])
+        return message[1], message[2]
+
+    def close(self):
+        """Stop all idle workers (busy ones are stopped when their job returns)"""
+        self._closed = True
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+            worker.kill()
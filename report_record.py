@@ -0,0 +1,340 @@
+"""Report record shared by the app, the report store and offline tools.
+
+A report record is a plain JSON-serializable dict holding the same keys the
+app uses in ``st.session_state`` (dates as ISO strings), plus ``report_id``
+and ``city``.
+
+Its risk stages come from the risk schema named in ``risk_schema`` (one per
+product line). Schemas are compiled once per process into the field lists
+and form widget specs everything else works from.
+"""
+import hashlib
+import json
+import os
+import re
+from datetime import date, datetime
+from functools import lru_cache
+
+# Chinese cities dictionary
+CHINESE_CITIES = {
+    "Guangzhou": "广东",
+    "Shenzhen": "深圳",
+    "Dongguan": "东莞",
+    "Foshan": "佛山",
+    "Zhongshan": "中山",
+    "Huizhou": "惠州",
+    "Zhuhai": "珠海",
+    "Jiangmen": "江门",
+    "Zhaoqing": "肇庆",
+    "Shanghai": "上海",
+    "Beijing": "北京",
+    "Suzhou": "苏州",
+    "Hangzhou": "杭州",
+    "Ningbo": "宁波",
+    "Wenzhou": "温州",
+    "Wuhan": "武汉",
+    "Chengdu": "成都",
+    "Chongqing": "重庆",
+    "Tianjin": "天津",
+    "Nanjing": "南京",
+    "Xi'an": "西安",
+    "Qingdao": "青岛",
+    "Dalian": "大连",
+    "Shenyang": "沈阳",
+    "Changsha": "长沙",
+    "Zhengzhou": "郑州",
+    "Jinan": "济南",
+    "Harbin": "哈尔滨",
+    "Changchun": "长春",
+    "Taiyuan": "太原",
+    "Shijiazhuang": "石家庄",
+    "Lanzhou": "兰州",
+    "Xiamen": "厦门",
+    "Fuzhou": "福州",
+    "Nanning": "南宁",
+    "Kunming": "昆明",
+    "Guiyang": "贵阳",
+    "Haikou": "海口",
+    "Ürümqi": "乌鲁木齐",
+    "Lhasa": "拉萨"
+}
+
+# Risk stage schemas per product line, stages in report order. A stage key
+# names the *_risk_desc / *_cap_desc / *_severity / *_likelihood fields, so
+# schemas sharing a stage share its fields. More schemas can be added as
+# RISK_SCHEMA_DIR/<name>.json files in the same shape.
+RISK_SCHEMAS = {
+    "footwear": {
+        "title": "Footwear",
+        "stages": [
+            {
+                "key": "style",
+                "title": "1. Style & Construction Risk",
+                "subtitle": "Potential production risk generated by styling features on this product",
+                "icon": "style_risk",
+                "risk_placeholder": "Describe potential risks related to style and construction...",
+                "cap_placeholder": "Describe corrective action plan for style risks..."
+            },
+            {
+                "key": "material",
+                "title": "2. Raw Material Risk",
+                "subtitle": "Potential risk presented to manufacture by properties of the material",
+                "icon": "material_risk",
+                "risk_placeholder": "Describe potential risks related to raw materials...",
+                "cap_placeholder": "Describe corrective action plan for material risks..."
+            },
+            {
+                "key": "factory",
+                "title": "3. Factory Performance Risk",
+                "subtitle": "Factory production potential risks (including finishing etc.)",
+                "icon": "factory_risk",
+                "risk_placeholder": "Describe potential risks related to factory performance...",
+                "cap_placeholder": "Describe corrective action plan for factory risks..."
+            },
+            {
+                "key": "package",
+                "title": "4. Package Risk",
+                "subtitle": "Packaging related risks",
+                "icon": "package_risk",
+                "risk_placeholder": "Describe potential risks related to packaging...",
+                "cap_placeholder": "Describe corrective action plan for packaging risks..."
+            },
+            {
+                "key": "other",
+                "title": "5. Other Risks",
+                "subtitle": "Any other potential risks",
+                "icon": "other_risks",
+                "risk_placeholder": "Describe any other potential risks...",
+                "cap_placeholder": "Describe corrective action plan for other risks..."
+            }
+        ]
+    },
+    "apparel": {
+        "title": "Apparel",
+        "stages": [
+            {"key": "style", "title": "1. Style & Construction Risk", "subtitle": "Pattern, seams and construction details", "icon": "style_risk"},
+            {"key": "material", "title": "2. Fabric & Trims Risk", "subtitle": "Shrinkage, color fastness, pilling and trims", "icon": "material_risk"},
+            {"key": "fit", "title": "3. Fit & Sizing Risk", "subtitle": "Grading, tolerances and fit sample comments"},
+            {"key": "print", "title": "4. Print & Embellishment Risk", "subtitle": "Prints, embroidery, washes and their durability"},
+            {"key": "factory", "title": "5. Factory Performance Risk", "subtitle": "Capacity, line balancing and finishing", "icon": "factory_risk"},
+            {"key": "package", "title": "6. Package Risk", "subtitle": "Folding, tagging and packing", "icon": "package_risk"},
+            {"key": "other", "title": "7. Other Risks", "subtitle": "Any other potential risks", "icon": "other_risks"}
+        ]
+    },
+    "bags": {
+        "title": "Bags",
+        "stages": [
+            {"key": "style", "title": "1. Style & Construction Risk", "subtitle": "Panels, edges, stitching and reinforcement", "icon": "style_risk"},
+            {"key": "material", "title": "2. Raw Material Risk", "subtitle": "Leather, coated fabrics and linings", "icon": "material_risk"},
+            {"key": "hardware", "title": "3. Hardware Risk", "subtitle": "Zippers, buckles, rings and their plating"},
+            {"key": "strength", "title": "4. Strength & Load Risk", "subtitle": "Handle and strap pull strength, seam strength under load"},
+            {"key": "factory", "title": "5. Factory Performance Risk", "subtitle": "Factory production potential risks", "icon": "factory_risk"},
+            {"key": "package", "title": "6. Package Risk", "subtitle": "Stuffing, dust bags and packing", "icon": "package_risk"},
+            {"key": "other", "title": "7. Other Risks", "subtitle": "Any other potential risks", "icon": "other_risks"}
+        ]
+    }
+}
+
+DEFAULT_RISK_SCHEMA = "footwear"
+RISK_SCHEMA_DIR = os.getenv("RISK_SCHEMA_DIR", "risk_schemas")
+
+
+def _load_schema_files():
+    if not os.path.isdir(RISK_SCHEMA_DIR):
+        return
+    for filename in sorted(os.listdir(RISK_SCHEMA_DIR)):
+        if filename.endswith(".json"):
+            with open(os.path.join(RISK_SCHEMA_DIR, filename), encoding="utf-8") as fh:
+                RISK_SCHEMAS[filename[:-len(".json")]] = json.load(fh)
+
+
+_load_schema_files()
+
+
+BASIC_FIELDS = ["po_number", "style", "brand", "sales", "factory"]
+COMMENT_FIELDS = ["sales_comments", "tech_comments", "qc_comments", "conclusion"]
+SIGNATURE_FIELDS = ["sales_signature", "tech_signature", "qc_signature"]
+DATE_FIELDS = ["assessment_date", "sales_date", "tech_date", "qc_date"]
+
+
+def risk_field(stage_key):
+    """Session/record key of a stage's risk description"""
+    return f"{stage_key}_risk_desc"
+
+
+def cap_field(stage_key):
+    """Session/record key of a stage's CAP description"""
+    return f"{stage_key}_cap_desc"
+
+
+def severity_field(stage_key):
+    """Session/record key of a stage's severity rating (0 = not rated, 1-5)"""
+    return f"{stage_key}_severity"
+
+
+def likelihood_field(stage_key):
+    """Session/record key of a stage's likelihood rating (0 = not rated, 1-5)"""
+    return f"{stage_key}_likelihood"
+
+
+class RiskSchema:
+    """A risk schema compiled for use: stages, record fields and form widget specs"""
+
+    def __init__(self, name, definition):
+        self.name = name
+        self.title = definition.get("title") or name
+        self.stages = tuple(dict(stage) for stage in definition["stages"])
+        self.keys = tuple(stage["key"] for stage in self.stages)
+        self.risk_fields = tuple(field for key in self.keys for field in (risk_field(key), cap_field(key)))
+        self.rating_fields = tuple(
+            field for key in self.keys for field in (severity_field(key), likelihood_field(key))
+        )
+        # What the form needs per stage, so rendering is a plain loop
+        self.widgets = tuple(
+            {
+                "key": stage["key"],
+                "title": stage["title"],
+                "subtitle": stage.get("subtitle", ""),
+                "icon": stage.get("icon", "risk_assessment"),
+                "risk_key": risk_field(stage["key"]),
+                "cap_key": cap_field(stage["key"]),
+                "risk_placeholder": stage.get("risk_placeholder") or f"Describe potential {stage['title'].split('. ', 1)[-1].lower()}s...",
+                "cap_placeholder": stage.get("cap_placeholder") or "Describe the corrective action plan..."
+            }
+            for stage in self.stages
+        )
+
+
+@lru_cache(maxsize=None)
+def compile_risk_schema(name):
+    """Compiled schema by name (the default schema for unknown names), once per process"""
+    if name not in RISK_SCHEMAS:
+        name = DEFAULT_RISK_SCHEMA
+    return RiskSchema(name, RISK_SCHEMAS[name])
+
+
+def record_schema(record):
+    """Compiled risk schema of a record (or session state); old records use the default"""
+    return compile_risk_schema(record.get("risk_schema") or DEFAULT_RISK_SCHEMA)
+
+
+def _all_stages():
+    stages = {}
+    for name in RISK_SCHEMAS:
+        for stage in compile_risk_schema(name).stages:
+            stages.setdefault(stage["key"], stage)
+    return list(stages.values())
+
+
+# Every stage any schema uses (for exports, filters and loading records)
+ALL_RISK_STAGES = _all_stages()
+
+RISK_FIELDS = [field for stage in ALL_RISK_STAGES for field in (risk_field(stage["key"]), cap_field(stage["key"]))]
+TEXT_FIELDS = BASIC_FIELDS + RISK_FIELDS + COMMENT_FIELDS + SIGNATURE_FIELDS
+RATING_FIELDS = [
+    field for stage in ALL_RISK_STAGES for field in (severity_field(stage["key"]), likelihood_field(stage["key"]))
+]
+
+
+def _date_to_text(value):
+    if isinstance(value, (date, datetime)):
+        return value.strftime('%Y-%m-%d')
+    return value or None
+
+
+def _text_to_date(value):
+    if isinstance(value, str) and value:
+        try:
+            return datetime.strptime(value[:10], '%Y-%m-%d').date()
+        except ValueError:
+            return None
+    return value
+
+
+def record_from_state(state):
+    """Build a report record from Streamlit session state (or any mapping)"""
+    schema = record_schema(state)
+    record = {
+        "report_id": state.get("report_id"),
+        "city": state.get("selected_city", ""),
+        "risk_schema": schema.name
+    }
+    # Only the stages of the report's schema
+    for field in BASIC_FIELDS + list(schema.risk_fields) + COMMENT_FIELDS + SIGNATURE_FIELDS:
+        record[field] = state.get(field) or ""
+    for field in schema.rating_fields:
+        record[field] = int(state.get(field) or 0)
+    for field in DATE_FIELDS:
+        record[field] = _date_to_text(state.get(field))
+    # Attached photos as {"sha256", "name"} references into the blob store
+    record["photos"] = [dict(photo) for photo in state.get("photos") or []]
+    return record
+
+
+def apply_record_to_state(record, state):
+    """Load a report record back into session state so the form shows it"""
+    state["report_id"] = record.get("report_id")
+    if record.get("city"):
+        state["selected_city"] = record["city"]
+    state["risk_schema"] = record_schema(record).name
+    # Every known stage, so stages the report does not have are cleared
+    for field in TEXT_FIELDS:
+        state[field] = record.get(field) or ""
+    for field in RATING_FIELDS:
+        state[field] = int(record.get(field) or 0)
+    for field in DATE_FIELDS:
+        value = _text_to_date(record.get(field))
+        if value:
+            state[field] = value
+    state["photos"] = [dict(photo) for photo in record.get("photos") or []]
+
+
+def normalize_name(value):
+    """Collapse whitespace so grouping by factory/brand is not split by typing noise"""
+    return " ".join((value or "").split())
+
+
+def _identity_part(value):
+    # "PO-2024-001", "po 2024 001" and "PO2024001" are the same order
+    return re.sub(r"[\W_]+", "", normalize_name(value)).casefold()
+
+
+def report_fingerprint(record):
+    """Hash of normalized PO, style and factory identifying the order a report assesses.
+
+    None until PO and factory are filled in, so half-typed forms match nothing.
+    """
+    po_number = _identity_part(record.get("po_number"))
+    factory = _identity_part(record.get("factory"))
+    if not po_number or not factory:
+        return None
+    identity = "\x1f".join([po_number, _identity_part(record.get("style")), factory])
+    return hashlib.sha1(identity.encode("utf-8")).hexdigest()
+
+
+def risk_content_hash(record):
+    """Hash of the risk descriptions, CAPs and ratings, equal for identical assessments"""
+    schema = record_schema(record)
+    content = [schema.name]
+    content += [" ".join((record.get(field) or "").split()) for field in schema.risk_fields]
+    content += [str(int(record.get(field) or 0)) for field in schema.rating_fields]
+    return hashlib.sha1("\x1f".join(content).encode("utf-8")).hexdigest()
+
+
+def report_month(record):
+    """Assessment month of a record as YYYY-MM"""
+    assessment_date = record.get("assessment_date") or ""
+    return assessment_date[:7] if len(assessment_date) >= 7 else "unknown"
+
+
+def stage_status(record):
+    """Yield (stage, has_risk, has_cap) for each risk stage of a record"""
+    for stage in record_schema(record).stages:
+        has_risk = bool((record.get(risk_field(stage["key"])) or "").strip())
+        has_cap = bool((record.get(cap_field(stage["key"])) or "").strip())
+        yield stage, has_risk, has_cap
+
+
+def is_open(record):
+    """A report stays open until the QC manager has signed it off"""
+    return not (record.get("qc_signature") or "").strip()
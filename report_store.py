@@ -0,0 +1,683 @@
+"""SQLite store for saved reports and their precomputed risk analytics.
+
+Reports are stored as JSON documents. Every save also updates the aggregate
+tables in the same transaction: the previous version's contribution is
+subtracted and the new one added, so dashboard queries only ever read the
+small aggregate tables, never the report history.
+
+Each save is also recorded as a version with author and time. Versions hold
+only the fields that changed, with a full snapshot every SNAPSHOT_EVERY
+versions, so reading any version replays at most that many small deltas.
+
+Reports not saved for a season can be moved to the archive (archive.py):
+the summary columns and aggregates stay, the record and its history move to
+a pack file and are read back from there transparently.
+"""
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+
+from archive import ARCHIVE_DIR, PackArchive
+from report_record import (
+    is_open, normalize_name, report_fingerprint, report_month, risk_content_hash, stage_status
+)
+from report_templates import template_name_for_brand, template_pin, template_version
+from risk_scoring import rank_portfolio, rating_matrix, score_portfolio
+
+DEFAULT_DB_PATH = os.getenv("REPORT_DB_PATH", "reports.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    report_id TEXT PRIMARY KEY,
+    po_number TEXT,
+    factory TEXT,
+    brand TEXT,
+    city TEXT,
+    month TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    is_open INTEGER NOT NULL DEFAULT 1,
+    ratings BLOB,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_reports_updated ON reports(updated_at);
+CREATE INDEX IF NOT EXISTS idx_reports_factory ON reports(factory, month);
+
+-- One row per factory/brand/city/risk stage/month
+CREATE TABLE IF NOT EXISTS risk_stage_counts (
+    factory TEXT,
+    brand TEXT,
+    city TEXT,
+    stage TEXT,
+    month TEXT,
+    risk_count INTEGER NOT NULL DEFAULT 0,
+    missing_cap_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (factory, brand, city, stage, month)
+);
+CREATE INDEX IF NOT EXISTS idx_risk_stage_counts_stage ON risk_stage_counts(stage, month);
+
+-- One row per factory/brand/city/month
+CREATE TABLE IF NOT EXISTS cap_completion (
+    factory TEXT,
+    brand TEXT,
+    city TEXT,
+    month TEXT,
+    report_count INTEGER NOT NULL DEFAULT 0,
+    risk_count INTEGER NOT NULL DEFAULT 0,
+    cap_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (factory, brand, city, month)
+);
+CREATE INDEX IF NOT EXISTS idx_cap_completion_month ON cap_completion(month);
+
+-- Save history: full snapshot or changed fields only
+CREATE TABLE IF NOT EXISTS report_versions (
+    report_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    author TEXT,
+    saved_at TEXT NOT NULL,
+    is_snapshot INTEGER NOT NULL,
+    changed TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (report_id, version)
+);
+"""
+
+SNAPSHOT_EVERY = 10
+
+# Columns added after the first release, applied to existing databases on open
+MIGRATIONS = [
+    ("reports", "is_open", "INTEGER NOT NULL DEFAULT 1"),
+    ("reports", "ratings", "BLOB"),
+    ("reports", "fingerprint", "TEXT"),
+    ("reports", "risk_hash", "TEXT"),
+    ("reports", "archived_at", "TEXT"),
+]
+
+
+def pack_ratings(record):
+    """Severity then likelihood per stage of the record's schema, one byte each"""
+    severity, likelihood = rating_matrix([record])
+    return severity.tobytes() + likelihood.tobytes()
+
+
+def record_contributions(record):
+    """Aggregate rows a single record contributes, as (stage_rows, completion_row)"""
+    factory = normalize_name(record.get("factory"))
+    brand = normalize_name(record.get("brand"))
+    city = record.get("city") or ""
+    month = report_month(record)
+
+    stage_rows = []
+    risk_count = 0
+    cap_count = 0
+    for stage, has_risk, has_cap in stage_status(record):
+        if not has_risk:
+            continue
+        risk_count += 1
+        cap_count += 1 if has_cap else 0
+        stage_rows.append(((factory, brand, city, stage["key"], month), 1, 0 if has_cap else 1))
+
+    completion_row = ((factory, brand, city, month), 1, risk_count, cap_count)
+    return stage_rows, completion_row
+
+
+def record_delta(old, new):
+    """Fields of `new` that differ from `old`; fields dropped from `new` map to None"""
+    delta = {key: value for key, value in new.items() if old.get(key) != value}
+    for key in old.keys() - new.keys():
+        delta[key] = None
+    return delta
+
+
+class ReportStore:
+    """Saved reports plus incrementally maintained analytics aggregates"""
+
+    def __init__(self, path=DEFAULT_DB_PATH, archive=None):
+        self.path = path
+        self.archive = archive or PackArchive(ARCHIVE_DIR, path)
+        self._local = threading.local()
+        # Template versions known to be in the archive
+        self._pinned_versions = set()
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        for table, column, definition in MIGRATIONS:
+            columns = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_reports_fingerprint ON reports(fingerprint)")
+        self._backfill_fingerprints()
+
+    def _backfill_fingerprints(self):
+        """Fingerprint reports saved before fingerprints existed"""
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT report_id, data FROM reports WHERE fingerprint IS NULL AND risk_hash IS NULL"
+            ).fetchall()
+            conn.executemany(
+                "UPDATE reports SET fingerprint = ?, risk_hash = ? WHERE report_id = ?",
+                [
+                    (report_fingerprint(record), risk_content_hash(record), row["report_id"])
+                    for row in rows
+                    for record in [json.loads(row["data"])]
+                ]
+            )
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def _apply_contributions(self, conn, record, sign):
+        stage_rows, completion_row = record_contributions(record)
+        conn.executemany(
+            """
+            INSERT INTO risk_stage_counts (factory, brand, city, stage, month, risk_count, missing_cap_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (factory, brand, city, stage, month) DO UPDATE SET
+                risk_count = risk_count + excluded.risk_count,
+                missing_cap_count = missing_cap_count + excluded.missing_cap_count
+            """,
+            [key + (sign * risks, sign * missing) for key, risks, missing in stage_rows]
+        )
+        key, reports, risks, caps = completion_row
+        conn.execute(
+            """
+            INSERT INTO cap_completion (factory, brand, city, month, report_count, risk_count, cap_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (factory, brand, city, month) DO UPDATE SET
+                report_count = report_count + excluded.report_count,
+                risk_count = risk_count + excluded.risk_count,
+                cap_count = cap_count + excluded.cap_count
+            """,
+            key + (sign * reports, sign * risks, sign * caps)
+        )
+
+    def save_report(self, record, author=None):
+        """Insert or update a report, its aggregate contributions and its history; returns the report id"""
+        record = dict(record)
+        record["report_id"] = record.get("report_id") or uuid.uuid4().hex
+        now = datetime.utcnow().isoformat(timespec="seconds")
+        # Before the transaction: the archive writes through its own connection
+        self._pin_template(record)
+
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT report_id, data, created_at, archived_at FROM reports WHERE report_id = ?",
+                (record["report_id"],)
+            ).fetchone()
+            previous = self._stored_record(row) if row else {}
+            if row and row["archived_at"]:
+                # Saving an archived report brings it and its history back to the live tables
+                self._restore_versions(conn, record["report_id"])
+            if row:
+                self._apply_contributions(conn, previous, -1)
+            self._apply_contributions(conn, record, 1)
+            self._add_version(conn, record, previous, author, now)
+
+            # An update keeps the row (and its rowid), so iter_reports never yields it twice
+            conn.execute(
+                """
+                INSERT INTO reports
+                    (report_id, po_number, factory, brand, city, month, created_at, updated_at,
+                     is_open, ratings, fingerprint, risk_hash, data)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (report_id) DO UPDATE SET
+                    po_number = excluded.po_number,
+                    factory = excluded.factory,
+                    brand = excluded.brand,
+                    city = excluded.city,
+                    month = excluded.month,
+                    updated_at = excluded.updated_at,
+                    is_open = excluded.is_open,
+                    ratings = excluded.ratings,
+                    fingerprint = excluded.fingerprint,
+                    risk_hash = excluded.risk_hash,
+                    data = excluded.data,
+                    archived_at = NULL
+                """,
+                (
+                    record["report_id"],
+                    record.get("po_number", ""),
+                    normalize_name(record.get("factory")),
+                    normalize_name(record.get("brand")),
+                    record.get("city", ""),
+                    report_month(record),
+                    row["created_at"] if row else now,
+                    now,
+                    1 if is_open(record) else 0,
+                    pack_ratings(record),
+                    report_fingerprint(record),
+                    risk_content_hash(record),
+                    json.dumps(record, ensure_ascii=False)
+                )
+            )
+        return record["report_id"]
+
+    def _add_version(self, conn, record, previous, author, saved_at):
+        delta = record_delta(previous, record)
+        last = conn.execute(
+            "SELECT MAX(version) AS version FROM report_versions WHERE report_id = ?", (record["report_id"],)
+        ).fetchone()["version"] or 0
+        if last and not delta:
+            return
+        version = last + 1
+        # Snapshot the first version (or the first one recorded for an older report) and every Nth
+        is_snapshot = last == 0 or version % SNAPSHOT_EVERY == 0
+        conn.execute(
+            """
+            INSERT INTO report_versions (report_id, version, author, saved_at, is_snapshot, changed, data)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                record["report_id"], version, author or "", saved_at, 1 if is_snapshot else 0,
+                json.dumps(sorted(delta), ensure_ascii=False),
+                json.dumps(record if is_snapshot else delta, ensure_ascii=False)
+            )
+        )
+
+    def list_versions(self, report_id):
+        """Save history of a report, newest first: version, author, saved_at and changed fields"""
+        rows = self._connection().execute(
+            """
+            SELECT version, author, saved_at, changed FROM report_versions
+            WHERE report_id = ? ORDER BY version DESC
+            """,
+            (report_id,)
+        ).fetchall() or self._archived_versions(report_id)[::-1]
+        return [
+            {"version": row["version"], "author": row["author"], "saved_at": row["saved_at"],
+             "changed": json.loads(row["changed"])}
+            for row in rows
+        ]
+
+    def first_authors(self, report_ids):
+        """{report id: author of its first saved version} for those still holding their versions"""
+        report_ids = list(report_ids)
+        if not report_ids:
+            return {}
+        rows = self._connection().execute(
+            f"SELECT report_id, author FROM report_versions WHERE version = 1 AND report_id IN ({', '.join('?' * len(report_ids))})",
+            report_ids
+        )
+        return {row["report_id"]: row["author"] for row in rows}
+
+    def get_version(self, report_id, version):
+        """A report as it was saved in `version`, or None"""
+        rows = self._connection().execute(
+            """
+            SELECT is_snapshot, data FROM report_versions
+            WHERE report_id = ? AND version <= ?
+              AND version >= (SELECT MAX(version) FROM report_versions
+                              WHERE report_id = ? AND version <= ? AND is_snapshot = 1)
+            ORDER BY version
+            """,
+            (report_id, version, report_id, version)
+        ).fetchall()
+        if not rows:
+            archived = [row for row in self._archived_versions(report_id) if row["version"] <= version]
+            snapshots = [row["version"] for row in archived if row["is_snapshot"]]
+            rows = [row for row in archived if snapshots and row["version"] >= snapshots[-1]]
+        if not rows:
+            return None
+        record = json.loads(rows[0]["data"])
+        for row in rows[1:]:
+            for key, value in json.loads(row["data"]).items():
+                if value is None:
+                    record.pop(key, None)
+                else:
+                    record[key] = value
+        return record
+
+    def diff_versions(self, report_id, old_version, new_version):
+        """{field: (old value, new value)} for fields that differ between two versions"""
+        old = self.get_version(report_id, old_version) or {}
+        new = self.get_version(report_id, new_version) or {}
+        return {key: (old.get(key), new.get(key)) for key in sorted(record_delta(old, new))}
+
+    def find_duplicates(self, record):
+        """Other saved reports for the same PO/style/factory, newest first.
+
+        A single index lookup on the fingerprint, cheap enough to run on every
+        rerun. Each row says whether its risk content is identical to `record`.
+        """
+        fingerprint = report_fingerprint(record)
+        if fingerprint is None:
+            return []
+        rows = self._connection().execute(
+            """
+            SELECT report_id, po_number, factory, updated_at, risk_hash FROM reports
+            WHERE fingerprint = ? AND report_id != ? ORDER BY updated_at DESC
+            """,
+            (fingerprint, record.get("report_id") or "")
+        ).fetchall()
+        risk_hash = risk_content_hash(record)
+        return [
+            {"report_id": row["report_id"], "po_number": row["po_number"], "factory": row["factory"],
+             "updated_at": row["updated_at"], "same_content": row["risk_hash"] == risk_hash}
+            for row in rows
+        ]
+
+    def get_report(self, report_id):
+        """Return a saved report record, or None"""
+        row = self._connection().execute(
+            "SELECT report_id, data, archived_at FROM reports WHERE report_id = ?", (report_id,)
+        ).fetchone()
+        return self._record(row) if row else None
+
+    def _pin_template(self, record):
+        """Pin the template the record's PDFs are rendered with now.
+
+        The record gets the template name and version; the template itself is
+        stored once per version in the archive.
+        """
+        pin = template_pin(template_name_for_brand(record.get("brand")))
+        if pin["version"] not in self._pinned_versions:
+            body = json.dumps(pin["template"], ensure_ascii=False, sort_keys=True).encode("utf-8")
+            self.archive.put_many([("template", pin["version"], body)], replace=False)
+            self._pinned_versions.add(pin["version"])
+        record["template_pin"] = {"name": pin["name"], "version": pin["version"]}
+
+    def _stored_record(self, row):
+        """The record of a reports row as saved, read from the archive if it was archived"""
+        if row["archived_at"]:
+            return self._archived(row["report_id"])["record"]
+        return json.loads(row["data"])
+
+    def _record(self, row):
+        """The record of a reports row, with its pinned template if that has changed since"""
+        record = self._stored_record(row)
+        pin = record.get("template_pin")
+        if pin and "template" not in pin and template_version(pin["name"]) != pin["version"]:
+            data = self.archive.get("template", pin["version"])
+            if data is not None:
+                record["template_pin"] = dict(pin, template=json.loads(data))
+        return record
+
+    def _archived(self, report_id):
+        data = self.archive.get("report", report_id)
+        if data is None:
+            raise LookupError(f"Report {report_id} is marked archived but missing from the archive")
+        return json.loads(data)
+
+    def _archived_versions(self, report_id):
+        return self._archived(report_id)["versions"] if self.is_archived(report_id) else []
+
+    def _restore_versions(self, conn, report_id):
+        conn.executemany(
+            """
+            INSERT OR IGNORE INTO report_versions (report_id, version, author, saved_at, is_snapshot, changed, data)
+            VALUES (:report_id, :version, :author, :saved_at, :is_snapshot, :changed, :data)
+            """,
+            [dict(row, report_id=report_id) for row in self._archived(report_id)["versions"]]
+        )
+
+    def archive_reports(self, before, limit=None):
+        """Move reports last saved before `before` (ISO time) and their history to the archive.
+
+        Records saved before templates were pinned get their current template
+        pinned here. Summary columns and aggregates stay, so lists and
+        dashboards are unaffected. Returns the archived ids.
+        """
+        conn = self._connection()
+        rows = conn.execute(
+            "SELECT report_id, updated_at, data FROM reports WHERE archived_at IS NULL AND updated_at < ? "
+            "ORDER BY updated_at LIMIT ?",
+            (before, -1 if limit is None else limit)
+        ).fetchall()
+        archived = []
+        for row in rows:
+            record = json.loads(row["data"])
+            if not record.get("template_pin"):
+                self._pin_template(record)
+            versions = [
+                dict(version) for version in conn.execute(
+                    "SELECT version, author, saved_at, is_snapshot, changed, data FROM report_versions "
+                    "WHERE report_id = ? ORDER BY version",
+                    (row["report_id"],)
+                )
+            ]
+            entry = json.dumps({"record": record, "versions": versions}, ensure_ascii=False).encode("utf-8")
+            self.archive.put("report", row["report_id"], entry)
+            with self._transaction() as write:
+                # Skip a report saved again meanwhile; its pack entry is simply never read
+                updated = write.execute(
+                    "UPDATE reports SET data = '', archived_at = ? WHERE report_id = ? AND updated_at = ?",
+                    (datetime.utcnow().isoformat(timespec="seconds"), row["report_id"], row["updated_at"])
+                ).rowcount
+                if updated:
+                    write.execute("DELETE FROM report_versions WHERE report_id = ?", (row["report_id"],))
+                    archived.append(row["report_id"])
+        return archived
+
+    def is_archived(self, report_id):
+        row = self._connection().execute(
+            "SELECT archived_at FROM reports WHERE report_id = ?", (report_id,)
+        ).fetchone()
+        return bool(row and row["archived_at"])
+
+    def iter_reports(self, batch_size=1000, factory=None, cities=None, month_from=None, month_to=None):
+        """Yield every saved record (optionally filtered), reading `batch_size` rows at a time"""
+        where, params = self._filters(cities, month_from, month_to)
+        if factory:
+            where += (" AND " if where else " WHERE ") + "factory = ?"
+            params.append(normalize_name(factory))
+        where += (" AND " if where else " WHERE ") + "rowid > ?"
+        last_rowid = 0
+        while True:
+            rows = self._connection().execute(
+                f"SELECT rowid, report_id, data, archived_at FROM reports{where} ORDER BY rowid LIMIT ?",
+                params + [last_rowid, batch_size]
+            ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield self._record(row)
+            last_rowid = rows[-1]["rowid"]
+
+    def iter_changes(self, since=None, batch_size=1000):
+        """Yield (record, created_at, updated_at) of reports saved at or after `since`, oldest change first"""
+        last = (since or "", "")
+        while True:
+            rows = self._connection().execute(
+                """
+                SELECT report_id, created_at, updated_at, data, archived_at FROM reports
+                WHERE (updated_at, report_id) > (?, ?)
+                ORDER BY updated_at, report_id LIMIT ?
+                """,
+                (last[0], last[1], batch_size)
+            ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield self._record(row), row["created_at"], row["updated_at"]
+            last = (rows[-1]["updated_at"], rows[-1]["report_id"])
+
+    def list_reports(self, limit=50, factory=None, updated_since=None):
+        """Most recently updated reports (summary columns only)"""
+        sql = "SELECT report_id, po_number, factory, brand, city, month, updated_at FROM reports"
+        conditions = []
+        params = []
+        if factory:
+            conditions.append("factory = ?")
+            params.append(normalize_name(factory))
+        if updated_since:
+            conditions.append("updated_at >= ?")
+            params.append(updated_since)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY updated_at DESC LIMIT ?"
+        params.append(limit)
+        return [dict(row) for row in self._connection().execute(sql, params)]
+
+    def portfolio_arrays(self, open_only=False):
+        """Report ids plus (severity, likelihood) arrays of shape (reports, stages)"""
+        sql = "SELECT report_id, ratings FROM reports WHERE ratings IS NOT NULL"
+        if open_only:
+            sql += " AND is_open = 1"
+        rows = self._connection().execute(sql).fetchall()
+
+        # Schemas differ in stage count; reports of each length are reshaped
+        # together and padded with unrated stages to the widest one
+        report_ids = [row["report_id"] for row in rows]
+        by_length = {}
+        for i, row in enumerate(rows):
+            by_length.setdefault(len(row["ratings"]), []).append(i)
+        stage_count = max(by_length, default=0) // 2
+        packed = np.zeros((len(rows), 2, stage_count), dtype=np.uint8)
+        for length, indices in by_length.items():
+            group = np.frombuffer(b"".join(rows[i]["ratings"] for i in indices), dtype=np.uint8)
+            packed[indices, :, :length // 2] = group.reshape(len(indices), 2, length // 2)
+        return report_ids, packed[:, 0, :], packed[:, 1, :]
+
+    def riskiest_reports(self, limit=50, open_only=True):
+        """The `limit` highest scoring reports with their summary columns"""
+        report_ids, severity, likelihood = self.portfolio_arrays(open_only)
+        if not report_ids:
+            return []
+        _, overall, total = score_portfolio(severity, likelihood)
+        ranked = rank_portfolio(overall, total, limit=limit)
+
+        top_ids = [report_ids[i] for i in ranked]
+        rows = self._connection().execute(
+            f"""
+            SELECT report_id, po_number, factory, brand, city, month
+            FROM reports WHERE report_id IN ({','.join('?' * len(top_ids))})
+            """,
+            top_ids
+        ).fetchall()
+        summaries = {row["report_id"]: dict(row) for row in rows}
+        result = []
+        for i in ranked:
+            summary = summaries[report_ids[i]]
+            summary["overall_score"] = int(overall[i])
+            summary["total_score"] = int(total[i])
+            result.append(summary)
+        return result
+
+    # Analytics queries - these only read the aggregate tables
+
+    def _filters(self, cities=None, month_from=None, month_to=None, stage=None):
+        clauses, params = [], []
+        if cities:
+            clauses.append(f"city IN ({','.join('?' * len(cities))})")
+            params.extend(cities)
+        if month_from:
+            clauses.append("month >= ?")
+            params.append(month_from)
+        if month_to:
+            clauses.append("month <= ?")
+            params.append(month_to)
+        if stage:
+            clauses.append("stage = ?")
+            params.append(stage)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def top_risk_entries(self, group_by="factory", stage=None, cities=None, month_from=None, month_to=None, limit=20):
+        """Factories or brands with the most risk entries (and missing CAPs) for a stage"""
+        if group_by not in ("factory", "brand"):
+            raise ValueError(f"Cannot group by {group_by}")
+        where, params = self._filters(cities, month_from, month_to, stage)
+        sql = f"""
+            SELECT {group_by} AS name,
+                   SUM(risk_count) AS risk_entries,
+                   SUM(missing_cap_count) AS missing_caps
+            FROM risk_stage_counts{where}
+            GROUP BY {group_by}
+            HAVING SUM(risk_count) > 0
+            ORDER BY risk_entries DESC, missing_caps DESC
+            LIMIT ?
+        """
+        return [dict(row) for row in self._connection().execute(sql, params + [limit])]
+
+    def cap_completion_rates(self, group_by="factory", cities=None, month_from=None, month_to=None, limit=50):
+        """CAP completion rate (CAPs written / risks raised) per factory or brand"""
+        if group_by not in ("factory", "brand"):
+            raise ValueError(f"Cannot group by {group_by}")
+        where, params = self._filters(cities, month_from, month_to)
+        sql = f"""
+            SELECT {group_by} AS name,
+                   SUM(report_count) AS reports,
+                   SUM(risk_count) AS risks,
+                   SUM(cap_count) AS caps,
+                   CASE WHEN SUM(risk_count) > 0
+                        THEN ROUND(100.0 * SUM(cap_count) / SUM(risk_count), 1)
+                        ELSE 100.0 END AS cap_completion_pct
+            FROM cap_completion{where}
+            GROUP BY {group_by}
+            HAVING SUM(report_count) > 0
+            ORDER BY cap_completion_pct ASC, risks DESC
+            LIMIT ?
+        """
+        return [dict(row) for row in self._connection().execute(sql, params + [limit])]
+
+    def monthly_stage_trend(self, cities=None, month_from=None, month_to=None):
+        """Risk entries per month and stage"""
+        where, params = self._filters(cities, month_from, month_to)
+        sql = f"""
+            SELECT month, stage, SUM(risk_count) AS risk_entries, SUM(missing_cap_count) AS missing_caps
+            FROM risk_stage_counts{where}
+            GROUP BY month, stage
+            ORDER BY month
+        """
+        return [dict(row) for row in self._connection().execute(sql, params)]
+
+    def factories(self):
+        """Factories that have saved reports, alphabetically"""
+        return [row["factory"] for row in self._connection().execute(
+            "SELECT DISTINCT factory FROM cap_completion WHERE report_count > 0 ORDER BY factory"
+        )]
+
+    def months(self):
+        """Months that have aggregate data, oldest first"""
+        return [row["month"] for row in self._connection().execute(
+            "SELECT DISTINCT month FROM cap_completion WHERE report_count > 0 ORDER BY month"
+        )]
+
+    def export_aggregates(self, fmt="parquet"):
+        """Export both aggregate tables as columnar files; returns {table: bytes}"""
+        import io
+        import pandas as pd
+
+        exported = {}
+        for table in ("risk_stage_counts", "cap_completion"):
+            frame = pd.read_sql_query(f"SELECT * FROM {table}", self._connection())
+            buffer = io.BytesIO()
+            if fmt == "parquet":
+                frame.to_parquet(buffer, index=False)
+            elif fmt == "csv":
+                frame.to_csv(buffer, index=False)
+            else:
+                raise ValueError(f"Unsupported export format: {fmt}")
+            exported[table] = buffer.getvalue()
+        return exported
+
+    def rebuild_aggregates(self):
+        """Recompute all aggregates from the saved reports (repair/migration only)"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM risk_stage_counts")
+            conn.execute("DELETE FROM cap_completion")
+            for row in conn.execute("SELECT report_id, data, archived_at FROM reports").fetchall():
+                self._apply_contributions(conn, self._stored_record(row), 1)
@@ -0,0 +1,152 @@
+"""Per-brand PDF report templates.
+
+A template sets the branding of a report - company line, header text, logo,
+colours and Latin fonts - plus the order of its sections and the table
+column widths. The built-in default is today's look; brand templates are
+JSON files in REPORT_TEMPLATE_DIR holding only what they change, e.g.
+
+    {"brands": ["Acme Shoes"], "logo": "acme.png",
+     "colors": {"primary": "#c8102e", "secondary": "#222222"},
+     "fonts": {"regular": "AcmeSans", "bold": "AcmeSans-Bold"},
+     "font_files": {"AcmeSans": "AcmeSans.ttf", "AcmeSans-Bold": "AcmeSans-Bold.ttf"},
+     "sections": ["basic", "risk", "photos", "comments", "conclusion", "notes"]}
+
+Paths are relative to the template directory. A report uses the template
+listing its brand, else the default. Files are parsed once per process;
+pdf_report compiles each (template, language) into styles once as well.
+
+Saved reports carry a pin - the name and version of the template they were
+saved with; the template itself is kept once per version in the archive -
+so their PDFs are rebuilt unchanged after the template changes.
+"""
+import hashlib
+import json
+import os
+from functools import lru_cache
+
+from report_record import normalize_name
+
+REPORT_TEMPLATE_DIR = os.getenv("REPORT_TEMPLATE_DIR", "report_templates")
+DEFAULT_TEMPLATE_NAME = "default"
+
+SECTIONS = ["basic", "photos", "risk", "comments", "conclusion", "notes"]
+
+DEFAULT_TEMPLATE = {
+    "brands": [],
+    "company_name": "PRODUCTION RISK ASSESSMENT REPORT",
+    "header_text": "PRODUCTION RISK ASSESSMENT REPORT",
+    "logo": None,
+    # Logo box in inches; the image is scaled to fit
+    "logo_size": [1.6, 0.6],
+    "colors": {
+        "primary": "#667eea",
+        "secondary": "#764ba2",
+        "company": "#333333",
+        "subheading": "#2c3e50",
+        "text": "#555555",
+        "label_background": "#f0f4ff",
+        "alternate_row": "#f9f9ff",
+        "grid": "#e0e0e0",
+        "basic_grid": "#d4d4d4",
+        "footer_background": "#f8f9fa",
+        "footer_text": "#666666"
+    },
+    # Used for Latin-script languages; other scripts keep their language font
+    "fonts": {"regular": "Helvetica", "bold": "Helvetica-Bold"},
+    "font_files": {},
+    "sections": SECTIONS,
+    # Sections starting on a new page
+    "page_breaks": ["comments"],
+    # Inches per column
+    "column_widths": {
+        "basic": [1.5, 2.0, 1.5, 2.0],
+        "photos": [3.45, 3.45],
+        "risk": [1.6, 2.2, 2.2, 0.9],
+        "overall": [1.6, 5.3],
+        "signatures": [1.2, 2.3, 0.8, 1.5]
+    }
+}
+
+
+def _merge(base, overrides):
+    merged = dict(base)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            merged[key] = _merge(base[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def _resolve_paths(template, directory):
+    if template.get("logo"):
+        template["logo"] = os.path.join(directory, template["logo"])
+    template["font_files"] = {
+        name: os.path.join(directory, path) for name, path in template.get("font_files", {}).items()
+    }
+    unknown = [section for section in template["sections"] if section not in SECTIONS]
+    if unknown:
+        raise ValueError(f"Unknown report sections: {', '.join(unknown)}")
+    return template
+
+
+@lru_cache(maxsize=None)
+def load_templates():
+    """{template name: full template dict}, the default plus REPORT_TEMPLATE_DIR/*.json, read once"""
+    templates = {DEFAULT_TEMPLATE_NAME: DEFAULT_TEMPLATE}
+    if os.path.isdir(REPORT_TEMPLATE_DIR):
+        for filename in sorted(os.listdir(REPORT_TEMPLATE_DIR)):
+            if not filename.endswith(".json"):
+                continue
+            with open(os.path.join(REPORT_TEMPLATE_DIR, filename), encoding="utf-8") as fh:
+                overrides = json.load(fh)
+            templates[filename[:-len(".json")]] = _resolve_paths(_merge(DEFAULT_TEMPLATE, overrides), REPORT_TEMPLATE_DIR)
+    return templates
+
+
+@lru_cache(maxsize=None)
+def _brand_index():
+    index = {}
+    for name, template in load_templates().items():
+        for brand in template.get("brands", []):
+            index[normalize_name(brand).casefold()] = name
+    return index
+
+
+def template_name_for_brand(brand):
+    """Name of the template for a brand, the default if none lists it"""
+    return _brand_index().get(normalize_name(brand).casefold(), DEFAULT_TEMPLATE_NAME)
+
+
+@lru_cache(maxsize=None)
+def template_version(name):
+    """Short hash of a template's content, identifying it in pins"""
+    return hashlib.sha1(json.dumps(get_template(name), sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+def template_pin(name):
+    """The template as it is now: {"name", "version", "template"}"""
+    return {"name": name, "version": template_version(name), "template": get_template(name)}
+
+
+_pinned_templates = {}
+
+
+def pinned_template_name(pin):
+    """Name to render a pinned template under; the current name if the template is unchanged.
+
+    A pin without the template body (not found in the archive) also falls back
+    to the current template.
+    """
+    if template_version(pin["name"]) == pin["version"] or not pin.get("template"):
+        return pin["name"]
+    name = f"{pin['name']}@{pin['version']}"
+    _pinned_templates.setdefault(name, pin["template"])
+    return name
+
+
+def get_template(name):
+    if name in _pinned_templates:
+        return _pinned_templates[name]
+    templates = load_templates()
+    return templates.get(name) or templates[DEFAULT_TEMPLATE_NAME]
@@ -0,0 +1,132 @@
+"""Risk scoring for single reports and whole report portfolios.
+
+Each risk stage is rated for severity and likelihood on a 1-5 scale (0 means
+not rated). A stage score is severity x likelihood (1-25); a report's overall
+score is its worst stage score, with the sum of stage scores as tie-breaker.
+The portfolio functions do the same for thousands of reports at once on numpy
+arrays of shape (reports, stages). Reports with fewer stages than others
+are padded with unrated (0) stages, which never change a score.
+"""
+import numpy as np
+
+from report_record import record_schema, severity_field, likelihood_field
+
+MAX_SCORE = 25
+
+SEVERITY_LEVELS = {
+    0: "Not rated",
+    1: "1 - Negligible",
+    2: "2 - Minor",
+    3: "3 - Moderate",
+    4: "4 - Major",
+    5: "5 - Critical"
+}
+
+LIKELIHOOD_LEVELS = {
+    0: "Not rated",
+    1: "1 - Rare",
+    2: "2 - Unlikely",
+    3: "3 - Possible",
+    4: "4 - Likely",
+    5: "5 - Almost certain"
+}
+
+# Upper bound (inclusive) of each level on the 5x5 matrix
+RISK_LEVELS = [
+    (0, "Not rated"),
+    (4, "Low"),
+    (12, "Medium"),
+    (MAX_SCORE, "High")
+]
+
+RISK_LEVEL_COLORS = {
+    "Not rated": "#e0e0e0",
+    "Low": "#d4edda",
+    "Medium": "#fff3cd",
+    "High": "#f8d7da"
+}
+
+
+def stage_score(severity, likelihood):
+    """Score of one stage; 0 if either rating is missing"""
+    severity = int(severity or 0)
+    likelihood = int(likelihood or 0)
+    if not severity or not likelihood:
+        return 0
+    return severity * likelihood
+
+
+def risk_level(score):
+    """Level label (Not rated/Low/Medium/High) for a stage or overall score"""
+    for upper, label in RISK_LEVELS:
+        if score <= upper:
+            return label
+    return RISK_LEVELS[-1][1]
+
+
+def stage_scores(record):
+    """{stage key: score} for the stages of one record's schema"""
+    return {
+        key: stage_score(record.get(severity_field(key)), record.get(likelihood_field(key)))
+        for key in record_schema(record).keys
+    }
+
+
+def overall_score(record):
+    """Overall score of one record - its worst stage score"""
+    return max(stage_scores(record).values(), default=0)
+
+
+def rating_matrix(records, keys=None):
+    """Stack records into (severity, likelihood) uint8 arrays of shape (reports, stages).
+
+    `keys` are the stage keys (columns), by default those of the first record's schema.
+    """
+    if keys is None:
+        keys = record_schema(records[0]).keys if records else ()
+    severity = np.array(
+        [[int(r.get(severity_field(k)) or 0) for k in keys] for r in records], dtype=np.uint8
+    ).reshape(len(records), len(keys))
+    likelihood = np.array(
+        [[int(r.get(likelihood_field(k)) or 0) for k in keys] for r in records], dtype=np.uint8
+    ).reshape(len(records), len(keys))
+    return severity, likelihood
+
+
+def score_portfolio(severity, likelihood):
+    """Vectorized scores for many reports.
+
+    Returns (stage_scores, overall, total) where stage_scores has shape
+    (reports, stages) and overall/total have shape (reports,).
+    """
+    scores = severity.astype(np.int16) * likelihood.astype(np.int16)
+    overall = scores.max(axis=1) if scores.shape[1] else np.zeros(scores.shape[0], dtype=np.int16)
+    total = scores.sum(axis=1)
+    return scores, overall, total
+
+
+def rank_portfolio(overall, total, limit=None, mask=None):
+    """Indices of the riskiest reports, worst first.
+
+    Only the top `limit` entries are fully sorted; `mask` restricts the
+    ranking to a subset (e.g. open reports).
+    """
+    candidates = np.arange(overall.shape[0]) if mask is None else np.flatnonzero(mask)
+    if candidates.size == 0:
+        return candidates
+
+    # Single sort key: overall score dominates, total breaks ties
+    key = overall[candidates].astype(np.int32) * (int(total.max()) + 1) + total[candidates]
+    if limit is not None and limit < candidates.size:
+        top = np.argpartition(-key, limit - 1)[:limit]
+        order = top[np.argsort(-key[top], kind="stable")]
+    else:
+        order = np.argsort(-key, kind="stable")
+    return candidates[order]
+
+
+def level_names(scores):
+    """Vectorized risk_level() over an array of scores"""
+    bounds = np.array([upper for upper, _ in RISK_LEVELS])
+    labels = np.array([label for _, label in RISK_LEVELS])
+    return labels[np.searchsorted(bounds, scores, side="left")]
@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+# The app's modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def store(tmp_path):
+    from archive import PackArchive
+    from report_store import ReportStore
+
+    path = str(tmp_path / "reports.db")
+    return ReportStore(path, archive=PackArchive(str(tmp_path / "archive"), path))
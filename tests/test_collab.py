@@ -0,0 +1,39 @@
+from collab import CollabHub, unsaved_conflicts
+
+
+def test_joining_keeps_fields_edited_since_loading():
+    base = {"po_number": "PO-1", "factory": "ABC", "conclusion": ""}
+    local = {"po_number": "PO-1", "factory": "ABC Shoes", "conclusion": "ok"}
+    shared = {"po_number": "PO-2", "factory": "ABC Ltd", "conclusion": "ok"}
+
+    # po_number was not touched here, conclusion was edited to what the room already has
+    assert unsaved_conflicts(local, base, shared) == ["factory"]
+
+
+def test_joining_without_a_base_treats_every_difference_as_an_edit():
+    local = {"po_number": "PO-1", "factory": "ABC"}
+    shared = {"po_number": "PO-2", "factory": "ABC"}
+    assert unsaved_conflicts(local, {}, shared) == ["po_number"]
+
+
+def test_stale_edit_is_rejected_and_others_are_notified():
+    hub = CollabHub(lock_seconds=0)
+    notified = []
+    hub.join("r1", "a", "Ann", lambda: notified.append("a"), {"factory": "ABC"})
+    values, versions = hub.join("r1", "b", "Bo", lambda: notified.append("b"), {"factory": "other"})
+    assert values["factory"] == "ABC"
+
+    first = hub.update("r1", "a", {"factory": ("ABC Shoes", versions["factory"])})
+    assert first["factory"][0] is True
+    assert notified == ["b"]
+
+    second = hub.update("r1", "b", {"factory": ("ABC Ltd", versions["factory"])})
+    assert second["factory"] == (False, "ABC Shoes", first["factory"][2])
+
+
+def test_gone_member_is_dropped():
+    hub = CollabHub(lock_seconds=0)
+    hub.join("r1", "a", "Ann", lambda: True, {})
+    hub.join("r1", "b", "Bo", lambda: False, {})
+    hub.update("r1", "a", {"factory": ("ABC", 0)})
+    assert hub.presence("r1", "a")[0] == []
@@ -0,0 +1,132 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from delivery import DeliveryError, DeliveryQueue, HTTPTransport
+
+
+class FakeTransport:
+    """Records sent batches and answers from a list of results (a DeliveryError or response text)"""
+
+    channel = "erp"
+    configured = True
+
+    def __init__(self, results=()):
+        self.results = list(results)
+        self.sent = []
+
+    def destination(self, recipient):
+        return recipient
+
+    def send_batch(self, items):
+        answers = {}
+        for row, pdf_bytes in items:
+            self.sent.append((row["delivery_id"], pdf_bytes))
+            answers[row["delivery_id"]] = self.results.pop(0) if self.results else "200 ok"
+        return answers
+
+    def close_idle(self, now):
+        pass
+
+    def close(self):
+        pass
+
+
+def queue_with(tmp_path, transport, **kwargs):
+    return DeliveryQueue(path=str(tmp_path / "reports.db"), transports={"erp": transport}, **kwargs)
+
+
+def test_waiting_target_is_queued_once_with_the_newest_pdf(tmp_path):
+    transport = FakeTransport()
+    queue = queue_with(tmp_path, transport)
+    target = [("erp", "http://erp.local/upload")]
+
+    first = queue.enqueue("r1", target, "r1.pdf", pdf_bytes=b"old")
+    assert queue.enqueue("r1", target, "r1.pdf", pdf_bytes=b"new") == []
+    assert queue.process_due()
+    assert transport.sent == [(first[0], b"new")]
+
+    # Once sent, the same target can be queued again
+    assert len(queue.enqueue("r1", target, "r1.pdf", pdf_bytes=b"new")) == 1
+
+
+def test_temporary_failure_is_retried_and_permanent_one_waits_for_a_manual_retry(tmp_path):
+    transport = FakeTransport([
+        DeliveryError("503 busy", retry_after=0),
+        "200 ok",
+        DeliveryError("400 bad", permanent=True),
+        "200 ok"
+    ])
+    queue = queue_with(tmp_path, transport)
+
+    queue.enqueue("r1", [("erp", "http://erp.local/upload")], "r1.pdf", pdf_bytes=b"pdf")
+    queue.process_due()
+    row = queue.deliveries("r1")[0]
+    assert (row["status"], row["attempts"], row["last_error"]) == ("pending", 1, "503 busy")
+    queue.process_due()
+    row = queue.deliveries("r1")[0]
+    assert (row["status"], row["attempts"], row["last_error"], row["response"]) == ("sent", 2, None, "200 ok")
+
+    queue.enqueue("r2", [("erp", "http://erp.local/upload")], "r2.pdf", pdf_bytes=b"pdf")
+    queue.process_due()
+    failed = queue.deliveries("r2")[0]
+    assert failed["status"] == "failed"
+    assert not queue.process_due()
+    queue.retry(failed["delivery_id"])
+    queue.process_due()
+    assert queue.deliveries("r2")[0]["status"] == "sent"
+    assert queue.status_counts() == {"sent": 2}
+
+
+def test_delivery_fails_after_its_last_attempt(tmp_path):
+    transport = FakeTransport([DeliveryError("timeout", retry_after=0)] * 2)
+    queue = queue_with(tmp_path, transport, max_attempts=2)
+
+    queue.enqueue("r1", [("erp", "http://erp.local/upload")], "r1.pdf", pdf_bytes=b"pdf")
+    queue.process_due()
+    queue.process_due()
+    row = queue.deliveries("r1")[0]
+    assert (row["status"], row["attempts"]) == ("failed", 2)
+
+
+@pytest.fixture
+def erp_server():
+    """Local ERP stand-in that is busy once, then accepts; records the delivery ids it saw"""
+    seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            seen.append(self.headers["X-Delivery-Id"])
+            busy = len(seen) == 1
+            self.send_response(503 if busy else 201)
+            if busy:
+                self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/upload", seen
+    server.shutdown()
+    server.server_close()
+
+
+def test_erp_retry_resends_the_same_delivery_id(tmp_path, erp_server):
+    url, seen = erp_server
+    queue = queue_with(tmp_path, HTTPTransport(url))
+
+    delivery_id = queue.enqueue("r1", [("erp", url)], "r1.pdf", pdf_bytes=b"%PDF-")[0]
+    queue.process_due()
+    assert queue.deliveries("r1")[0]["status"] == "pending"
+    queue.process_due()
+
+    row = queue.deliveries("r1")[0]
+    assert (row["status"], row["attempts"]) == ("sent", 2)
+    # The ERP can drop the repeat by this id if the first upload did arrive
+    assert seen == [delivery_id, delivery_id]
@@ -0,0 +1,44 @@
+import os
+from datetime import datetime, timedelta
+
+from digest import DigestBuilder, DigestScheduler, digest_filename
+from pdf_import import IMPORT_AUTHOR
+from pdf_report import CHINA_TZ
+
+
+def this_week():
+    today = datetime.now(CHINA_TZ).date()
+    return today - timedelta(days=today.weekday())
+
+
+def report(report_id, factory, assessment_date):
+    return {"report_id": report_id, "factory": factory, "po_number": report_id, "assessment_date": assessment_date}
+
+
+def test_factories_with_the_same_slug_get_their_own_file(store, tmp_path):
+    week = this_week()
+    store.save_report(report("r1", "ABC Co.", week.isoformat()))
+    store.save_report(report("r2", "ABC Co", week.isoformat()))
+    assert digest_filename("ABC Co.") != digest_filename("ABC Co")
+
+    builder = DigestBuilder(store, store.path)
+    paths = DigestScheduler(builder, out_dir=str(tmp_path / "digests"), workers=1).run(week)
+
+    assert sorted(paths) == ["ABC Co", "ABC Co."]
+    assert len(set(paths.values())) == 2
+    assert all(os.path.getsize(path) > 0 for path in paths.values())
+
+
+def test_imported_reports_are_new_in_their_assessment_week(store):
+    week = this_week()
+    store.save_report(report("app", "Factory", week.isoformat()))
+    store.save_report(report("old", "Factory", "2019-03-05"), author=IMPORT_AUTHOR)
+    store.save_report(report("recent", "Factory", week.isoformat()), author=IMPORT_AUTHOR)
+    store.save_report(report("undated", "Factory", None), author=IMPORT_AUTHOR)
+
+    builder = DigestBuilder(store, store.path)
+    builder.update_state()
+
+    assert [row["po_number"] for row in builder.digest("Factory", week)["new_reports"]] == ["app", "recent"]
+    old_week = datetime(2019, 3, 4).date()
+    assert [row["po_number"] for row in builder.digest("Factory", old_week)["new_reports"]] == ["old"]
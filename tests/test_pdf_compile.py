@@ -0,0 +1,45 @@
+import pdf_compile
+from pdf_compile import compile_reports
+
+
+def record(report_id, po_number):
+    return {"report_id": report_id, "po_number": po_number, "factory": "Factory", "city": "Shanghai"}
+
+
+def laid_out_sections(monkeypatch, read_records):
+    sections = []
+    unused = []
+
+    class RecordingSectionStart(pdf_compile.SectionStart):
+        def draw(self):
+            sections.append((self.index, self.title, self.record["report_id"]))
+            super().draw()
+
+    class RecordingUnusedTOCPages(pdf_compile.UnusedTOCPages):
+        def draw(self):
+            unused.extend(self.indexes)
+            super().draw()
+
+    monkeypatch.setattr(pdf_compile, "SectionStart", RecordingSectionStart)
+    monkeypatch.setattr(pdf_compile, "UnusedTOCPages", RecordingUnusedTOCPages)
+    pdf = compile_reports(read_records).getvalue()
+    assert pdf.startswith(b"%PDF")
+    return sections, unused
+
+
+def test_sections_follow_the_first_read(monkeypatch):
+    records = [record("a", "PO-1"), record("b", "PO-2"), record("c", "PO-3")]
+    sections, unused = laid_out_sections(monkeypatch, records)
+    assert sections == [(0, "PO-1 - Factory", "a"), (1, "PO-2 - Factory", "b"), (2, "PO-3 - Factory", "c")]
+    assert unused == []
+
+
+def test_report_gone_before_layout_keeps_the_others_in_place(monkeypatch):
+    reads = [
+        [record("a", "PO-1"), record("b", "PO-2"), record("c", "PO-3")],
+        # "b" left the filter and "d" was saved between the two reads
+        [record("a", "PO-1"), record("c", "PO-3"), record("d", "PO-4")],
+    ]
+    sections, unused = laid_out_sections(monkeypatch, lambda: iter(reads.pop(0)))
+    assert sections == [(0, "PO-1 - Factory", "a"), (2, "PO-3 - Factory", "c")]
+    assert unused == [1]
@@ -0,0 +1,116 @@
+import hashlib
+import os
+import random
+
+import pytest
+
+import pdf_import
+from pdf_import import ImportLog, import_pdfs, parse_report_pdf
+from pdf_report import MAX_CHUNK_CHARS, build_pdf
+from report_record import (
+    BASIC_FIELDS, COMMENT_FIELDS, DEFAULT_RISK_SCHEMA, compile_risk_schema, record_from_state
+)
+
+ENGLISH_WORDS = "glue residue on upper near toe cap stitching lining heel mould bonding primer".split()
+CHINESE_WORDS = ["鞋面", "残胶", "鞋头", "车线", "内里", "鞋跟", "模具", "粘合", "处理剂", "开胶", "色差", "需要", "检查"]
+
+
+def generated_text(rng, language, length, breaks=0):
+    """Sentences of random words, `breaks` of the gaps between them real line breaks"""
+    sentences = []
+    while len("".join(sentences)) < length:
+        words = [rng.choice(CHINESE_WORDS if language == "zh" else ENGLISH_WORDS) for _ in range(rng.randint(5, 18))]
+        if language == "zh":
+            sentences.append("".join(words) + "。")
+        else:
+            sentences.append(" ".join(words).capitalize() + ".")
+    line_ends = set(rng.sample(range(len(sentences) - 1), breaks))
+    gap = "" if language == "zh" else " "
+    return "".join(sentence + ("\n" if i in line_ends else gap) for i, sentence in enumerate(sentences)).strip()
+
+
+def roundtrip(language, seed):
+    """{field: (written, read)} for the text of a generated report that does not read back unchanged"""
+    rng = random.Random(seed)
+    risk_fields = list(compile_risk_schema(DEFAULT_RISK_SCHEMA).risk_fields)
+    # Longer than MAX_CHUNK_CHARS, so text_chunks cuts them into several paragraphs
+    lengths = [MAX_CHUNK_CHARS + 439, MAX_CHUNK_CHARS * 7 + 199, MAX_CHUNK_CHARS + 300]
+    state = {
+        "po_number": "PO-CHECK", "style": "Style", "brand": "Brand", "sales": "Sales", "factory": "Factory",
+        "risk_schema": DEFAULT_RISK_SCHEMA, "selected_city": "Shanghai",
+        risk_fields[0]: generated_text(rng, language, lengths[0]),
+        risk_fields[1]: generated_text(rng, language, lengths[1]),
+        risk_fields[2]: generated_text(rng, language, lengths[2], breaks=2),
+        "sales_comments": generated_text(rng, language, 1500, breaks=1),
+        "conclusion": generated_text(rng, language, 2500, breaks=3)
+    }
+    record = record_from_state(state)
+    parsed = parse_report_pdf(build_pdf(record, language).getvalue())
+    return {
+        field: (record[field], parsed.get(field) or "")
+        for field in BASIC_FIELDS + risk_fields + COMMENT_FIELDS
+        if (record[field] or "") != (parsed.get(field) or "")
+    }
+
+
+needs_pdfium = pytest.mark.skipif(pdf_import.pdfium is None, reason="needs pypdfium2")
+
+
+@needs_pdfium
+@pytest.mark.parametrize("language", ["en", "zh"])
+@pytest.mark.parametrize("seed", range(12))
+def test_long_text_keeps_every_character(language, seed):
+    # A real break right after a line that fills the column looks like a wrapped
+    # line and may read back as one; everything else must come back as written
+    gap = "" if language == "zh" else " "
+    for written, read in roundtrip(language, seed).values():
+        assert read.replace("\n", gap) == written.replace("\n", gap)
+
+
+@needs_pdfium
+@pytest.mark.parametrize("language, seed", [("en", 0), ("en", 1), ("en", 2), ("zh", 0), ("zh", 1), ("zh", 4)])
+def test_long_text_reads_back_unchanged(language, seed):
+    # Seeds whose real breaks all follow a short line
+    assert roundtrip(language, seed) == {}
+
+
+def parse_or_crash(path, fallback_schema=DEFAULT_RISK_SCHEMA):
+    """Stands in for parse_pdf_file in the worker processes; kills its worker on crash*.pdf"""
+    name = os.path.basename(path)
+    if name.startswith("crash") and not os.path.exists(path + ".fixed"):
+        os._exit(1)
+    sha256 = hashlib.sha256(name.encode("utf-8")).hexdigest()
+    return sha256, {"po_number": name, "style": name, "factory": "Factory"}, None
+
+
+def test_worker_crash_fails_only_the_files_in_flight_and_a_rerun_resumes(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_import, "parse_pdf_file", parse_or_crash)
+    monkeypatch.setattr(pdf_import, "IN_FLIGHT_PER_WORKER", 2)
+    source = tmp_path / "pdfs"
+    source.mkdir()
+    names = [f"a{i}.pdf" for i in range(6)] + ["crash.pdf"] + [f"z{i}.pdf" for i in range(6)]
+    for name in names:
+        (source / name).write_bytes(b"%PDF-")
+    log = ImportLog(store.path)
+
+    counts = import_pdfs([str(source)], store, log, workers=1)
+
+    outcomes = {os.path.basename(path): outcome[2] for path, outcome in log.outcomes().items()}
+    failed = sorted(name for name, status in outcomes.items() if status == "failed")
+    assert sorted(outcomes) == sorted(names)
+    assert "crash.pdf" in failed
+    # Only the files handed to the crashed pool with it, at most the in-flight limit
+    assert len(failed) <= 2
+    assert set(failed) <= {"a5.pdf", "crash.pdf", "z0.pdf"}
+    assert {error for _, error, _ in log.failures()} == {"Worker process crashed"}
+    assert counts == {"imported": len(names) - len(failed), "duplicate": 0, "failed": len(failed), "skipped": 0}
+    for name, status in outcomes.items():
+        if status == "imported":
+            assert store.get_report(hashlib.sha256(name.encode("utf-8")).hexdigest()[:32])["po_number"] == name
+
+    # A rerun only looks at what failed, and only when asked to
+    assert import_pdfs([str(source)], store, log, workers=1)["skipped"] == len(names)
+    (source / "crash.pdf.fixed").write_bytes(b"")
+    counts = import_pdfs([str(source)], store, log, workers=1, retry_failed=True)
+    assert counts == {"imported": len(failed), "duplicate": 0, "failed": 0, "skipped": len(names) - len(failed)}
+    assert {outcome[2] for outcome in log.outcomes().values()} == {"imported"}
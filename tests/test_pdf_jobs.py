@@ -0,0 +1,87 @@
+import threading
+import time
+
+from pdf_jobs import JobManager
+
+
+def wait_finished(manager, job_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = manager.get(job_id)
+        if job.finished:
+            return job
+        time.sleep(0.01)
+    raise AssertionError("job did not finish")
+
+
+def test_job_is_not_finished_before_its_pdf_is_set():
+    reported_done = threading.Event()
+    release = threading.Event()
+    seen = []
+
+    def render(record, pdf_lang, progress):
+        progress("translating")
+        progress("layout")
+        # build_pdf reports "done" before the render pool hands back the bytes
+        progress("done")
+        reported_done.set()
+        release.wait(5)
+        return b"%PDF-", ["warning"]
+
+    manager = JobManager(render, max_workers=1)
+    job_id = manager.submit({"po_number": "1"}, "en")
+    assert reported_done.wait(5)
+    job = manager.get(job_id)
+    seen.append((job.stage, job.finished, job.pdf_bytes, job.finished_at))
+    release.set()
+    job = wait_finished(manager, job_id)
+
+    assert seen == [("layout", False, None, None)]
+    assert job.stage == "done"
+    assert job.pdf_bytes == b"%PDF-"
+    assert job.warnings == ["warning"]
+    assert job.finished_at is not None
+    assert job.progress == 1.0
+
+
+def test_failed_job_keeps_its_error():
+    def render(record, pdf_lang, progress):
+        progress("done")
+        raise RuntimeError("boom")
+
+    manager = JobManager(render, max_workers=1)
+    job = wait_finished(manager, manager.submit({}, "en"))
+
+    assert job.stage == "failed"
+    assert job.error == "boom"
+    assert job.pdf_bytes is None
+    assert job.finished_at is not None
+
+
+def test_identical_submissions_share_a_job_until_it_fails():
+    calls = []
+
+    def render(record, pdf_lang, progress):
+        calls.append(pdf_lang)
+        if len(calls) == 1:
+            raise RuntimeError("first attempt fails")
+        return b"pdf", []
+
+    manager = JobManager(render, max_workers=1)
+    failed = wait_finished(manager, manager.submit({"a": 1}, "en"))
+    assert failed.stage == "failed"
+
+    retry_id = manager.submit({"a": 1}, "en")
+    assert retry_id != failed.id
+    wait_finished(manager, retry_id)
+    assert manager.submit({"a": 1}, "en") == retry_id
+    assert manager.submit({"a": 1}, "zh") != retry_id
+
+
+def test_finished_jobs_expire():
+    manager = JobManager(lambda record, pdf_lang, progress: (b"pdf", []), max_workers=1, keep_seconds=0)
+    job_id = manager.submit({}, "en")
+    wait_finished(manager, job_id)
+    time.sleep(0.01)
+    manager.submit({"other": True}, "en")
+    assert manager.get(job_id) is None
@@ -0,0 +1,46 @@
+import time
+
+import pytest
+
+from rate_limiter import PRIORITY_INTERACTIVE, RateLimiter, RateLimitTimeout
+
+
+@pytest.fixture
+def limiter(tmp_path):
+    # 10 tokens a second, so refills are quick to observe
+    return RateLimiter(str(tmp_path / "limits.db"), requests_per_minute=6000, tokens_per_minute=600)
+
+
+def test_empty_bucket_waits_for_the_refill(limiter):
+    limiter.acquire(tokens=600)
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire(tokens=5, timeout=0.1)
+
+    started = time.monotonic()
+    limiter.acquire(tokens=5, timeout=5)
+    assert 0.2 < time.monotonic() - started < 2
+
+
+def test_requests_share_the_bucket_across_limiters(limiter, tmp_path):
+    other = RateLimiter(str(tmp_path / "limits.db"), requests_per_minute=6000, tokens_per_minute=600)
+    limiter.acquire(tokens=300)
+    other.acquire(tokens=300, priority=PRIORITY_INTERACTIVE)
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire(tokens=100, timeout=0.1)
+
+
+def test_oversized_request_only_needs_a_full_bucket(limiter):
+    started = time.monotonic()
+    limiter.acquire(tokens=10000, timeout=1)
+    assert time.monotonic() - started < 0.5
+
+
+def test_refund_and_backoff(limiter):
+    limiter.acquire(tokens=600)
+    limiter.adjust(-600)
+    limiter.acquire(tokens=600, timeout=0.1)
+
+    limiter.backoff(0.5)
+    started = time.monotonic()
+    limiter.acquire(tokens=1, timeout=5)
+    assert time.monotonic() - started > 0.3
@@ -0,0 +1,42 @@
+from report_store import SNAPSHOT_EVERY
+
+
+def record(conclusion, **fields):
+    return dict({"po_number": "PO-1", "factory": "ABC Shoes", "conclusion": conclusion}, **fields)
+
+
+def test_saving_again_updates_the_report_in_place(store):
+    report_id = store.save_report(record("first"))
+    assert store.save_report(record("second", report_id=report_id, factory="ABC  Shoes ")) == report_id
+
+    assert [r["report_id"] for r in store.iter_reports()] == [report_id]
+    assert [r["factory"] for r in store.list_reports()] == ["ABC Shoes"]
+    assert store.get_report(report_id)["conclusion"] == "second"
+
+
+def test_every_version_is_rebuilt_from_snapshots_and_deltas(store):
+    report_id = store.save_report(record("v1"), author="Ann")
+    for version in range(2, SNAPSHOT_EVERY + 3):
+        store.save_report(record(f"v{version}", report_id=report_id), author="Bo")
+    # Saving without changes adds no version
+    store.save_report(record(f"v{SNAPSHOT_EVERY + 2}", report_id=report_id), author="Bo")
+
+    versions = store.list_versions(report_id)
+    assert [v["version"] for v in versions] == list(range(SNAPSHOT_EVERY + 2, 0, -1))
+    assert versions[-1]["author"] == "Ann"
+    assert versions[0]["changed"] == ["conclusion"]
+    for version in range(1, SNAPSHOT_EVERY + 3):
+        saved = store.get_version(report_id, version)
+        # Saving pins the PDF template the report was made with
+        assert saved.pop("template_pin")["name"] == "default"
+        assert saved == record(f"v{version}", report_id=report_id)
+    assert store.get_version(report_id, 99)["conclusion"] == f"v{SNAPSHOT_EVERY + 2}"
+    assert store.get_version("missing", 1) is None
+
+
+def test_diff_lists_changed_and_dropped_fields(store):
+    report_id = store.save_report(record("v1", brand="Acme"))
+    store.save_report(record("v2", report_id=report_id))
+
+    assert store.diff_versions(report_id, 1, 2) == {"brand": ("Acme", None), "conclusion": ("v1", "v2")}
+    assert store.diff_versions(report_id, 2, 2) == {}
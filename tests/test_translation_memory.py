@@ -0,0 +1,54 @@
+from translation_memory import TranslationMemory, jaccard, minhash, shingles, normalize_text
+
+
+def test_exact_lookup_ignores_case_width_and_spacing(tmp_path):
+    memory = TranslationMemory(str(tmp_path / "tm.db"))
+    memory.add("Glue residue on upper", "zh", "鞋面有残胶")
+    assert memory.lookup("  glue  RESIDUE on upper ", "zh") == [(1.0, "Glue residue on upper", "鞋面有残胶")]
+
+
+def test_replaced_translation_is_used_by_this_and_other_processes(tmp_path):
+    path = str(tmp_path / "tm.db")
+    memory = TranslationMemory(path)
+    other = TranslationMemory(path)
+    memory.add("Loose stitching on heel", "zh", "old")
+    other.refresh(force=True)
+    assert other.lookup("Loose stitching on heel", "zh")[0][2] == "old"
+
+    memory.add("Loose stitching on heel", "zh", "new")
+    assert memory.lookup("Loose stitching on heel", "zh")[0][2] == "new"
+    assert len(memory) == 1
+    other.refresh(force=True)
+    assert other.lookup("Loose stitching on heel", "zh")[0][2] == "new"
+    # A near match is an example for the model; it carries the new translation too
+    assert other.lookup("Loose stitching on heels", "zh")[0][2] == "new"
+    assert TranslationMemory(path).lookup("Loose stitching on heel", "zh")[0][2] == "new"
+
+
+def test_near_duplicates_are_found_and_scored(tmp_path):
+    memory = TranslationMemory(str(tmp_path / "tm.db"))
+    memory.add("Glue residue found on the upper of the left shoe", "zh", "t1")
+    memory.add("Color shade variation between batches", "zh", "t2")
+    matches = memory.lookup("No glue residue found on the upper of the left shoe", "zh")
+    assert [target for _, _, target in matches] == ["t1"]
+    assert 0.8 < matches[0][0] < 1.0
+    assert memory.lookup("Completely unrelated sentence", "zh") == []
+    assert memory.lookup("Glue residue found on the upper of the left shoe", "vi") == []
+
+
+def test_minhash_agreement_tracks_jaccard():
+    a = shingles(normalize_text("Glue residue found on the upper of the left shoe, size 42"))
+    b = shingles(normalize_text("Glue residue found on the upper of the right shoe, size 42"))
+    agreement = (minhash(a) == minhash(b)).mean()
+    assert abs(agreement - jaccard(a, b)) < 0.2
+
+
+def test_translator_reuses_only_the_same_text(tmp_path):
+    from translation import Translator
+
+    memory = TranslationMemory(str(tmp_path / "tm.db"))
+    memory.add("Glue residue on upper", "zh", "鞋面有残胶")
+    translator = Translator(client=None, memory=memory)
+    assert translator.translate("glue residue on upper", "zh") == "鞋面有残胶"
+    # Without a model the near match is not substituted
+    assert translator.translate("No glue residue on upper", "zh") == "No glue residue on upper"
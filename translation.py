@@ -0,0 +1,135 @@
+"""Text translation via GPT-4o mini, usable with or without Streamlit.
+
+The app wraps a Translator around each session's ``translations_cache``;
+PDF render workers keep one Translator (and cache) per process. An optional
+TranslationMemory shared across sessions and processes supplies past
+translations: reused as-is for the same text, and near-duplicates sent to
+the model as examples so terminology stays consistent. An optional RateLimiter queues
+API calls against the quota shared by all processes, by priority class.
+"""
+import os
+
+from dotenv import load_dotenv
+
+from languages import load_catalog, translation_target
+from translation_memory import FEWSHOT_THRESHOLD, normalize_text
+from rate_limiter import PRIORITY_BULK, estimate_tokens, retry_after_seconds
+
+TRANSLATION_MODEL = "gpt-4o-mini"
+MAX_TOKENS = 500
+# Attempts per text when the API still answers 429 (rate limited)
+RATE_LIMIT_ATTEMPTS = 3
+
+
+def create_openai_client():
+    """OpenAI client from OPENAI_API_KEY (.env supported), or None if not configured"""
+    load_dotenv()
+    openai_api_key = os.getenv("OPENAI_API_KEY")
+    if not openai_api_key:
+        return None
+    from openai import OpenAI
+    return OpenAI(api_key=openai_api_key)
+
+
+class Translator:
+    """Cached text translation; falls back to the original text on any failure"""
+
+    def __init__(self, client=None, cache=None, on_error=None, model=TRANSLATION_MODEL,
+                 memory=None, fewshot_threshold=None,
+                 limiter=None, priority=PRIORITY_BULK):
+        self.client = client
+        self.cache = cache if cache is not None else {}
+        self.on_error = on_error
+        self.model = model
+        self.memory = memory
+        self.fewshot_threshold = FEWSHOT_THRESHOLD if fewshot_threshold is None else fewshot_threshold
+        self.limiter = limiter
+        self.priority = priority
+
+    def translate(self, text, target_language="zh"):
+        """Translate text, using and filling the cache"""
+        if not text or not text.strip():
+            return text
+
+        # Check cache first
+        cache_key = f"{text}_{target_language}"
+        if cache_key in self.cache:
+            return self.cache[cache_key]
+
+        # Don't translate numbers or alphanumeric codes
+        if text.strip().replace('.', '').replace(',', '').replace('-', '').isdigit():
+            self.cache[cache_key] = text
+            return text
+
+        # Fixed labels shipped with the language
+        catalog = load_catalog(target_language)
+        if text in catalog:
+            self.cache[cache_key] = catalog[text]
+            return catalog[text]
+
+        # Earlier translations from any session. Only the same text reuses one: a near
+        # match may differ by a "no" or a number, so it is just an example for the model
+        matches = []
+        if self.memory is not None:
+            matches = self.memory.lookup(text, target_language, min_similarity=self.fewshot_threshold)
+            if matches and normalize_text(matches[0][1]) == normalize_text(text):
+                self.cache[cache_key] = matches[0][2]
+                return matches[0][2]
+
+        if not self.client:
+            # Fallback to original text if no API key
+            self.cache[cache_key] = text
+            return text
+
+        messages = [
+            {"role": "system", "content": f"You are a professional translator. Translate the following text to {translation_target(target_language)}. Only return the translation, no explanations. Preserve any numbers, dates, and special formatting. Keep terminology consistent with the earlier translations."}
+        ]
+        # Similar past pairs as few-shot examples, least similar first
+        for _, source, target in reversed(matches):
+            messages.append({"role": "user", "content": source})
+            messages.append({"role": "assistant", "content": target})
+        messages.append({"role": "user", "content": text})
+
+        try:
+            response = self._complete(messages)
+            translated_text = response.choices[0].message.content.strip()
+            self.cache[cache_key] = translated_text
+            if self.memory is not None:
+                self.memory.add(text, target_language, translated_text)
+            return translated_text
+        except Exception as e:
+            if self.on_error:
+                self.on_error(e)
+            self.cache[cache_key] = text
+            return text
+
+    def _complete(self, messages):
+        """Chat completion, queued behind the shared rate limiter and retried on 429"""
+        for attempt in range(RATE_LIMIT_ATTEMPTS):
+            estimate = estimate_tokens(messages, MAX_TOKENS)
+            if self.limiter:
+                self.limiter.acquire(estimate, self.priority)
+            try:
+                response = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=0.1,
+                    max_tokens=MAX_TOKENS
+                )
+            except Exception as e:
+                retry_after = retry_after_seconds(e)
+                if not self.limiter or retry_after is None or attempt == RATE_LIMIT_ATTEMPTS - 1:
+                    raise
+                # Our estimate was off or another client shares the key; hold everyone back
+                self.limiter.backoff(retry_after)
+                continue
+            usage = getattr(response, "usage", None)
+            if self.limiter and usage is not None:
+                self.limiter.adjust(usage.total_tokens - estimate)
+            return response
+
+    def translate_pdf_content(self, text, pdf_lang):
+        """Translate text for PDF based on selected language"""
+        if pdf_lang == "en":
+            return text
+        return self.translate(text, pdf_lang)
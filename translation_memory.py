@@ -0,0 +1,190 @@
+"""Fuzzy translation memory of past source/target pairs.
+
+Every successful translation is stored in SQLite. Lookups use a MinHash
+index with LSH banding over character 3-grams (works for English and
+Chinese alike), so finding near-duplicates of a new text only compares it
+against a handful of candidates instead of the whole memory. Candidates are
+then scored with exact Jaccard similarity of their 3-gram sets.
+
+Similarity says nothing about meaning: "No glue residue on upper" and
+"Glue residue on upper" are near-duplicates. A stored translation is only
+reused for the same text after normalization; near matches are examples.
+
+Each process loads the memory once and picks up rows added by other
+processes on later lookups.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import numpy as np
+
+DEFAULT_MEMORY_PATH = os.getenv("TRANSLATION_MEMORY_PATH", "translation_memory.db")
+
+# Similarity at/above which stored pairs are sent to the model as examples
+FEWSHOT_THRESHOLD = float(os.getenv("TM_FEWSHOT_THRESHOLD", "0.4"))
+
+SHINGLE_SIZE = 3
+NUM_PERMUTATIONS = 60
+NUM_BANDS = 20
+ROWS_PER_BAND = NUM_PERMUTATIONS // NUM_BANDS
+REFRESH_INTERVAL = 5.0
+
+_rng = np.random.RandomState(20240501)
+# Random odd multipliers and offsets over the full 64 bits
+_PERM_A = _rng.randint(0, 1 << 32, size=(2, NUM_PERMUTATIONS)).astype(np.uint64)
+_PERM_A = (_PERM_A[0] << np.uint64(32)) | _PERM_A[1] | np.uint64(1)
+_PERM_B = _rng.randint(0, 1 << 32, size=(2, NUM_PERMUTATIONS)).astype(np.uint64)
+_PERM_B = (_PERM_B[0] << np.uint64(32)) | _PERM_B[1]
+
+
+def normalize_text(text):
+    """Case-, width- and whitespace-insensitive form used for matching"""
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def shingles(normalized):
+    """Set of character n-grams of a normalized text"""
+    if len(normalized) <= SHINGLE_SIZE:
+        return {normalized} if normalized else set()
+    return {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+
+
+def minhash(shingle_set):
+    """MinHash signature (NUM_PERMUTATIONS uint64 values) of a shingle set"""
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in shingle_set],
+        dtype=np.uint64
+    )
+    # Multiply-shift hash (a * h + b) mod 2^64, high 32 bits, for every permutation/shingle
+    # pair; uint64 arithmetic wraps around. Minimum per permutation.
+    permuted = (np.outer(_PERM_A, hashes) + _PERM_B[:, None]) >> np.uint64(32)
+    return permuted.min(axis=1)
+
+
+def band_keys(signature):
+    """LSH bucket keys - texts sharing any band are near-duplicate candidates"""
+    return [
+        (band, signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND].tobytes())
+        for band in range(NUM_BANDS)
+    ]
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class TranslationMemory:
+    """Persistent source/target pairs with near-duplicate lookup"""
+
+    def __init__(self, path=DEFAULT_MEMORY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # Per target language: entries list, exact index and LSH buckets
+        self._entries = {}
+        self._exact = {}
+        self._buckets = {}
+        self._last_rowid = 0
+        self._last_refresh = 0.0
+
+        self._connection().execute("""
+            CREATE TABLE IF NOT EXISTS translation_memory (
+                source TEXT NOT NULL,
+                target_language TEXT NOT NULL,
+                target TEXT NOT NULL,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (source, target_language)
+            )
+        """)
+        self.refresh(force=True)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _index(self, source, target_language, target):
+        normalized = normalize_text(source)
+        exact = self._exact.setdefault(target_language, {})
+        entries = self._entries.setdefault(target_language, [])
+        if normalized in exact:
+            # A replaced row (or the same text spelled differently): the newest translation wins
+            entry_id = exact[normalized]
+            entries[entry_id] = (source, target, entries[entry_id][2])
+            return
+        shingle_set = shingles(normalized)
+        entry_id = len(entries)
+        entries.append((source, target, shingle_set))
+        exact[normalized] = entry_id
+        buckets = self._buckets.setdefault(target_language, {})
+        for key in band_keys(minhash(shingle_set)):
+            buckets.setdefault(key, []).append(entry_id)
+
+    def refresh(self, force=False):
+        """Index rows added since the last refresh (including by other processes)"""
+        now = time.monotonic()
+        if not force and now - self._last_refresh < REFRESH_INTERVAL:
+            return
+        rows = self._connection().execute(
+            "SELECT rowid, source, target_language, target FROM translation_memory WHERE rowid > ? ORDER BY rowid",
+            (self._last_rowid,)
+        ).fetchall()
+        with self._lock:
+            for rowid, source, target_language, target in rows:
+                self._index(source, target_language, target)
+                self._last_rowid = max(self._last_rowid, rowid)
+            self._last_refresh = now
+
+    def add(self, source, target_language, target):
+        """Remember a translation"""
+        if not source or not source.strip() or not target:
+            return
+        self._connection().execute(
+            "INSERT OR REPLACE INTO translation_memory (source, target_language, target) VALUES (?, ?, ?)",
+            (source, target_language, target)
+        )
+        with self._lock:
+            self._index(source, target_language, target)
+
+    def lookup(self, text, target_language, min_similarity=FEWSHOT_THRESHOLD, limit=3):
+        """Best stored pairs similar to `text`, as [(similarity, source, target)] best first"""
+        self.refresh()
+        normalized = normalize_text(text)
+        with self._lock:
+            entries = self._entries.get(target_language, [])
+            exact_id = self._exact.get(target_language, {}).get(normalized)
+            if exact_id is not None:
+                source, target, _ = entries[exact_id]
+                return [(1.0, source, target)]
+
+            shingle_set = shingles(normalized)
+            if not shingle_set:
+                return []
+            buckets = self._buckets.get(target_language, {})
+            candidates = set()
+            for key in band_keys(minhash(shingle_set)):
+                candidates.update(buckets.get(key, ()))
+
+            matches = []
+            for entry_id in candidates:
+                source, target, entry_shingles = entries[entry_id]
+                similarity = jaccard(shingle_set, entry_shingles)
+                if similarity >= min_similarity:
+                    matches.append((similarity, source, target))
+        matches.sort(key=lambda match: match[0], reverse=True)
+        return matches[:limit]
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(entries) for entries in self._entries.values())
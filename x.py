@@ -1,32 +1,37 @@
 import streamlit as st
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch, cm
-from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT, TA_JUSTIFY
-from reportlab.pdfgen import canvas
-from reportlab.pdfbase import pdfmetricsa
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from datetime import datetime
 import io
 import pytz
-from openai import OpenAI
 import os
-from dotenv import load_dotenv
-import base64
-from io import BytesIO
-
-# Load environment variables
-load_dotenv()
+import sys
+import threading
+from report_record import (
+    CHINESE_CITIES, ALL_RISK_STAGES, RISK_SCHEMAS, DEFAULT_RISK_SCHEMA, DATE_FIELDS, compile_risk_schema,
+    record_from_state, apply_record_to_state, severity_field, likelihood_field
+)
+from risk_scoring import SEVERITY_LEVELS, LIKELIHOOD_LEVELS, stage_score, overall_score, risk_level
+from report_store import ReportStore, DEFAULT_DB_PATH
+from exporters import EXPORT_FORMATS, MIME_TYPES, export_report, bulk_export
+from translation import Translator, create_openai_client
+from translation_memory import TranslationMemory, DEFAULT_MEMORY_PATH
+from rate_limiter import RateLimiter, PRIORITY_INTERACTIVE, PRIORITY_BULK
+from master_data import MasterData, MASTER_FIELDS
+from pdf_report import CHINA_TZ, build_pdf
+from render_pool import RenderPool
+from pdf_jobs import JobManager, STAGE_LABELS
+from pdf_compile import compile_reports
+from blob_store import BlobStore
+from collab import CollabHub, COLLAB_FIELDS, unsaved_conflicts
+from languages import LANGUAGES, language_name
+from delivery import DeliveryQueue, DELIVERY_STATUSES, parse_recipients
+from digest import DigestBuilder, DigestScheduler, day_start_utc, last_week
+from archive import ARCHIVE_AFTER_DAYS, PDF_RETENTION_DAYS, run_archive
+from preview import PreviewManager, pdfium
 
-# Initialize OpenAI client
-openai_api_key = os.getenv("OPENAI_API_KEY")
-if openai_api_key:
-    openai_client = OpenAI(api_key=openai_api_key)
-else:
-    openai_client = None
+# Initialize OpenAI client (loads .env)
+openai_client = create_openai_client()
+if not openai_client:
     st.warning("OpenAI API key not found. Translation features will be limited.")
 
 # Page config
@@ -37,50 +42,6 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Chinese cities dictionary
-CHINESE_CITIES = {
-    "Guangzhou": "广东",
-    "Shenzhen": "深圳",
-    "Dongguan": "东莞",
-    "Foshan": "佛山",
-    "Zhongshan": "中山",
-    "Huizhou": "惠州",
-    "Zhuhai": "珠海",
-    "Jiangmen": "江门",
-    "Zhaoqing": "肇庆",
-    "Shanghai": "上海",
-    "Beijing": "北京",
-    "Suzhou": "苏州",
-    "Hangzhou": "杭州",
-    "Ningbo": "宁波",
-    "Wenzhou": "温州",
-    "Wuhan": "武汉",
-    "Chengdu": "成都",
-    "Chongqing": "重庆",
-    "Tianjin": "天津",
-    "Nanjing": "南京",
-    "Xi'an": "西安",
-    "Qingdao": "青岛",
-    "Dalian": "大连",
-    "Shenyang": "沈阳",
-    "Changsha": "长沙",
-    "Zhengzhou": "郑州",
-    "Jinan": "济南",
-    "Harbin": "哈尔滨",
-    "Changchun": "长春",
-    "Taiyuan": "太原",
-    "Shijiazhuang": "石家庄",
-    "Lanzhou": "兰州",
-    "Xiamen": "厦门",
-    "Fuzhou": "福州",
-    "Nanning": "南宁",
-    "Kunming": "昆明",
-    "Guiyang": "贵阳",
-    "Haikou": "海口",
-    "Ürümqi": "乌鲁木齐",
-    "Lhasa": "拉萨"
-}
-
 # Custom icons for better UI
 ICONS = {
     "title": "📋",
@@ -116,6 +77,14 @@ ICONS = {
     "photo": "📷",
     "process": "🔄",
     "cap": "🔄",
+    "save": "💾",
+    "analytics": "📈",
+    "compile": "📚",
+    "collab": "👥",
+    "lock": "🔒",
+    "send": "📤",
+    "preview": "👁️",
+    "archive": "🗄️",
     
 }
 
@@ -297,46 +266,39 @@ if 'selected_city' not in st.session_state:
     st.session_state.selected_city = "Shanghai"
 if 'translations_cache' not in st.session_state:
     st.session_state.translations_cache = {}
+if 'risk_schema' not in st.session_state:
+    st.session_state.risk_schema = DEFAULT_RISK_SCHEMA
+if 'photos' not in st.session_state:
+    st.session_state.photos = []
+if 'processed_uploads' not in st.session_state:
+    st.session_state.processed_uploads = set()
+# Date fields default to today; set here so loading a report can overwrite them
+for date_field in DATE_FIELDS:
+    if date_field not in st.session_state:
+        st.session_state[date_field] = datetime.now().date()
+
+@st.cache_resource
+def get_rate_limiter():
+    """OpenAI quota shared with every other app process and render worker on this host"""
+    return RateLimiter()
+
+@st.cache_resource
+def get_translation_memory():
+    """Translation memory shared by all sessions (and render workers, via the same file)"""
+    return TranslationMemory(DEFAULT_MEMORY_PATH)
 
 # Translation function using GPT-4o mini - FIXED VERSION
 def translate_text(text, target_language="zh"):
     """Translate text using GPT-4o mini with caching"""
-    if not text or not text.strip():
-        return text
-    
-    # Check cache first
-    cache_key = f"{text}_{target_language}"
-    if cache_key in st.session_state.translations_cache:
-        return st.session_state.translations_cache[cache_key]
-    
-    # Don't translate numbers or alphanumeric codes
-    if text.strip().replace('.', '').replace(',', '').replace('-', '').isdigit():
-        st.session_state.translations_cache[cache_key] = text
-        return text
-    
-    if not openai_client:
-        # Fallback to simple translations if no API key
-        st.session_state.translations_cache[cache_key] = text
-        return text
-    
-    try:
-        response = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": f"You are a professional translator. Translate the following text to {target_language}. Only return the translation, no explanations. Preserve any numbers, dates, and special formatting."},
-                {"role": "user", "content": text}
-            ],
-            temperature=0.1,
-            max_tokens=500
-        )
-        
-        translated_text = response.choices[0].message.content.strip()
-        st.session_state.translations_cache[cache_key] = translated_text
-        return translated_text
-    except Exception as e:
-        st.warning(f"Translation failed: {str(e)}. Using original text.")
-        st.session_state.translations_cache[cache_key] = text
-        return text
+    translator = Translator(
+        openai_client,
+        cache=st.session_state.translations_cache,
+        on_error=lambda e: st.warning(f"Translation failed: {str(e)}. Using original text."),
+        memory=get_translation_memory(),
+        limiter=get_rate_limiter(),
+        priority=PRIORITY_INTERACTIVE
+    )
+    return translator.translate(text, target_language)
 
 def translate_list(text_list, target_language="zh"):
     """Translate a list of texts"""
@@ -352,11 +314,6 @@ def get_text(key, fallback=None):
         "title": "Production Risk Assessment Report",
         "basic_info": "Basic Information",
         "risk_assessment": "Risk Assessment",
-        "style_risk": "1. Style & Construction Risk",
-        "material_risk": "2. Raw Material Risk",
-        "factory_risk": "3. Factory Performance Risk",
-        "package_risk": "4. Package Risk",
-        "other_risks": "5. Other Risks",
         "cap_description": "Corrective Action Plan (CAP) Description",
         "conclusion": "Conclusion",
         "signatures": "Signatures & Approvals",
@@ -377,6 +334,8 @@ def get_text(key, fallback=None):
         "footer_text": "Production Risk Assessment System",
         "generate_success": "PDF Generated Successfully!",
         "fill_required": "Please fill in at least PO Number and Factory Name!",
+        "did_you_mean": "Did you mean:",
+        "pdf_size": "File Size",
         "creating_pdf": "Creating your professional PDF report...",
         "pdf_details": "PDF Details",
         "report_language": "Report Language",
@@ -396,576 +355,629 @@ def get_text(key, fallback=None):
         "tech_comments": "Technical Comments",
         "qc_comments": "QC Manager Comments",
         "process_flow": "Process Flow",
-        "risk_level": "Risk Level"
+        "risk_level": "Risk Level",
+        "severity": "Severity",
+        "likelihood": "Likelihood",
+        "riskiest_open_pos": "Top 50 riskiest open POs",
+        "save_report": "Save Report",
+        "report_saved": "Report saved",
+        "analytics": "Risk Analytics",
+        "no_saved_reports": "No saved reports yet. Save a report to start collecting analytics.",
+        "top_factories": "Factories with most risk entries",
+        "top_brands": "Brands with most risk entries",
+        "cap_completion": "CAP completion by factory",
+        "monthly_trend": "Risk entries per month",
+        "export_aggregates": "Export aggregates",
+        "export_reports": "Export all reports",
+        "compile_review": "Compile review PDF",
+        "your_name": "Your name",
+        "open_report": "Open saved report",
+        "open": "Open",
+        "history": "Version history",
+        "compare_versions": "Compare versions",
+        "load_version": "Load this version",
+        "no_changes": "No differences between these versions",
+        "product_line": "Product line",
+        "live_collaboration": "Live collaboration",
+        "editing_now": "Also editing",
+        "only_you": "Nobody else is editing this report",
+        "edit_conflict": "Changed by someone else meanwhile, showing their version",
+        "join_conflict": "You changed this before joining and others have a different value",
+        "keep_mine": "Keep mine",
+        "use_shared": "Use shared",
+        "collab_no_push": "Live updates are unavailable with this Streamlit version; others' changes show up when you next interact with the page.",
+        "collab_scope": "Shared with people on this server process only.",
+        "send_report": "Send to factory / ERP",
+        "recipient_emails": "Factory / agent emails (comma separated)",
+        "upload_to_erp": "Upload to ERP",
+        "queue_delivery": "Queue delivery",
+        "delivery_queued": "Queued for delivery",
+        "delivery_not_configured": "Set SMTP_HOST and/or ERP_UPLOAD_URL to enable delivery.",
+        "save_before_sending": "Save the report before sending it.",
+        "end_of_day_delivery": "End-of-day distribution",
+        "duplicate_report": "Another assessment exists for this PO / style / factory",
+        "duplicate_same_content": "An identical assessment already exists for this PO / style / factory",
+        "open_existing": "Open existing",
+        "weekly_digests": "Weekly factory digests",
+        "build_digests": "Build last week's digests now",
+        "digests_started": "Building digests in the background, refresh in a moment",
+        "week": "Week",
+        "live_preview": "Live PDF preview",
+        "updating_preview": "Updating preview...",
+        "pages": "pages",
+        "archive": "Archive",
+        "archive_now": "Archive reports not saved for {days} days",
+        "archive_done": "Archived {reports} reports and {blobs} photos, dropped {pdfs} stored PDFs",
+        "archive_settings": "Stored PDFs are kept {days} days and rebuilt from the report when needed again.",
+        "archived_reports": "Archived reports",
+        "archived_photos": "Archived photos",
+        "archive_size": "Archive size",
+        "page": "Page",
+        "changed_pages": "changed",
+        "download_preview": "Download preview PDF",
+        "preview_needs_pdfium": "Install pypdfium2 to see page images here; the preview PDF is below.",
+        "delivery_status": "Delivery status"
     }
     
     text = texts.get(key, fallback or key)
     
     # Translate if needed
-    if lang == "zh" and openai_client:
-        return translate_text(text, "zh")
+    if lang != "en" and openai_client:
+        return translate_text(text, lang)
     return text
 
+@st.cache_resource
+def get_render_pool():
+    """Warm PDF render workers shared by all sessions (PDF_RENDER_WORKERS=0 renders in-process)"""
+    workers = int(os.getenv("PDF_RENDER_WORKERS", os.cpu_count() or 1))
+    if workers <= 0 or os.name != "posix":
+        return None
+    max_queue = os.getenv("PDF_RENDER_MAX_QUEUE")
+    return RenderPool(workers=workers, max_queue=int(max_queue) if max_queue else None)
+
+@st.cache_resource
+def get_report_store():
+    """Shared report store for all sessions in this process"""
+    return ReportStore(DEFAULT_DB_PATH)
+
+@st.cache_resource
+def get_collab_hub():
+    return CollabHub()
+
+def current_session_id():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else "local"
+
+@st.cache_resource
+def rerun_hook_problem():
+    """Why other sessions cannot be rerun from here, or None.
+
+    Rerunning another session goes through private Streamlit internals, so
+    they are checked once per process: if an upgrade moved them, members are
+    kept (they sync on their own next rerun) and the problem is reported
+    instead of every member being dropped as gone.
+    """
+    try:
+        from streamlit.runtime import get_instance
+        info = get_instance()._session_mgr.get_active_session_info(current_session_id())
+        info.session._event_loop.call_soon_threadsafe
+        info.session.request_rerun
+    except Exception as e:
+        problem = f"{type(e).__name__}: {e}"
+        print(f"Live collaboration cannot rerun other sessions: {problem}", file=sys.stderr)
+        return problem
+    return None
+
+def session_notifier(session_id):
+    """notify() for the collab hub: reruns another browser session instead of having it poll"""
+    def notify():
+        if rerun_hook_problem() is not None:
+            return None
+        from streamlit.runtime import get_instance
+        info = get_instance()._session_mgr.get_active_session_info(session_id)
+        if info is None:
+            return False
+        # Reruns must be requested on the server's event loop, not from this script thread
+        info.session._event_loop.call_soon_threadsafe(info.session.request_rerun, None)
+        return True
+    return notify
+
+def sync_collaboration():
+    """Push this session's field edits to the shared report and pull everyone else's.
+
+    Runs before any widget is created, so fields changed by others can still
+    be written into session state for this run.
+    """
+    state = st.session_state
+    hub = get_collab_hub()
+    session_id = current_session_id()
+    report_id = state.get("report_id") if state.get("collab_enabled") else None
+
+    if state.get("collab_room") and state.collab_room != report_id:
+        hub.leave(state.collab_room, session_id)
+        state.collab_room = None
+    if not report_id:
+        return
+
+    name = state.get("user_name", "").strip() or "Guest"
+    current = {field: state[field] for field in COLLAB_FIELDS if field in state}
+    values, versions = hub.join(report_id, session_id, name, session_notifier(session_id), current)
+
+    if state.get("collab_room") != report_id:
+        # Just joined: take the shared values, but not over this session's unsaved edits
+        state.collab_room = report_id
+        state.collab_versions = {}
+        state.collab_synced = {}
+        state.collab_conflicts = {
+            field: (values[field], versions[field])
+            for field in unsaved_conflicts(current, state.get("collab_base") or {}, values)
+        }
+        results = {}
+    else:
+        edits = {
+            field: (value, state.collab_versions.get(field, 0))
+            for field, value in current.items()
+            if value != state.collab_synced.get(field) and field not in state.collab_conflicts
+        }
+        results = hub.update(report_id, session_id, edits) if edits else {}
+
+    for field, (accepted, value, version) in results.items():
+        if not accepted:
+            st.toast(f"{ICONS['lock']} {field}: {get_text('edit_conflict')}")
+        values[field], versions[field] = value, version
+
+    for field in COLLAB_FIELDS:
+        if field in state.collab_conflicts:
+            # Left as edited here until the user picks a value; track the shared one meanwhile
+            state.collab_conflicts[field] = (values[field], versions[field])
+        elif field in results or versions[field] > state.collab_versions.get(field, -1):
+            if values[field] is not None:
+                state[field] = values[field]
+            state.collab_synced[field] = values[field]
+            state.collab_versions[field] = versions[field]
+
+def remember_collab_base():
+    """Values as loaded or saved, so joining a room can tell which fields were edited since"""
+    st.session_state.collab_base = {field: st.session_state[field] for field in COLLAB_FIELDS if field in st.session_state}
+
+def keep_local_value(field):
+    """Callback: resolve a join conflict by sharing this session's value"""
+    value, version = st.session_state.collab_conflicts.pop(field)
+    # Pushed on the next sync as an edit of the shared version, so a newer change is still not overwritten
+    st.session_state.collab_synced[field] = value
+    st.session_state.collab_versions[field] = version
+
+def use_shared_value(field):
+    """Callback: resolve a join conflict by taking the room's value"""
+    value, version = st.session_state.collab_conflicts.pop(field)
+    if value is not None:
+        st.session_state[field] = value
+    st.session_state.collab_synced[field] = value
+    st.session_state.collab_versions[field] = version
+
+@st.cache_resource
+def get_blob_store():
+    """Content-addressed photo store shared by all sessions (and PDF render workers, via the same files)"""
+    blob_store = BlobStore()
+    blob_store.collect_garbage()
+    return blob_store
+
+def remove_photo(sha256):
+    st.session_state.photos = [photo for photo in st.session_state.photos if photo["sha256"] != sha256]
+
+def render_photo_uploader():
+    """Photo upload into the blob store plus thumbnails of the report's photos"""
+    st.markdown(f"**{ICONS['photo']} {get_text('shoe_photo')}**")
+    uploads = st.file_uploader(
+        f"{ICONS['upload']} {get_text('upload_photo')}",
+        type=["jpg", "jpeg", "png", "webp"],
+        accept_multiple_files=True,
+        key="photo_uploads"
+    )
+    blob_store = get_blob_store()
+    for upload in uploads or []:
+        # The uploader resends its files on every rerun; store each upload once
+        if upload.file_id in st.session_state.processed_uploads:
+            continue
+        st.session_state.processed_uploads.add(upload.file_id)
+        sha256 = blob_store.put(upload.getvalue(), upload.type)
+        if all(photo["sha256"] != sha256 for photo in st.session_state.photos):
+            st.session_state.photos.append({"sha256": sha256, "name": upload.name})
+    
+    photos = [photo for photo in st.session_state.photos if blob_store.exists(photo["sha256"])]
+    if not photos:
+        return
+    photo_cols = st.columns(4)
+    for i, photo in enumerate(photos):
+        with photo_cols[i % 4]:
+            thumb_path, _, _ = blob_store.rendition(photo["sha256"], "thumb")
+            st.image(thumb_path, caption=photo["name"])
+            st.button("Remove", key=f"remove_photo_{photo['sha256'][:12]}", on_click=remove_photo, args=(photo["sha256"],))
+
+@st.cache_resource
+def get_master_data():
+    """Factory/brand/style/staff names for autocomplete, seeded from saved reports on first use"""
+    master_data = MasterData(DEFAULT_DB_PATH)
+    if not len(master_data):
+        for record in get_report_store().iter_reports():
+            master_data.add_record(record)
+    return master_data
+
+def use_suggestion(field, value):
+    st.session_state[field] = value
+
+def render_suggestions(field):
+    """Known names matching what was typed into a Basic Info input, as one-click replacements"""
+    typed = st.session_state.get(field, "")
+    if not typed or not typed.strip():
+        return
+    kind = MASTER_FIELDS[field]
+    suggestions = [name for name in get_master_data().search(kind, typed) if name != typed]
+    if not suggestions:
+        return
+    st.caption(get_text("did_you_mean"))
+    suggestion_cols = st.columns(len(suggestions))
+    for i, (suggestion_col, name) in enumerate(zip(suggestion_cols, suggestions)):
+        with suggestion_col:
+            st.button(name, key=f"suggest_{field}_{i}", on_click=use_suggestion, args=(field, name))
+
+def load_report_into_form(record):
+    """Callback: replace the form contents with a saved report (or one of its versions)"""
+    if record:
+        apply_record_to_state(record, st.session_state)
+        remember_collab_base()
+        # Let the city selector pick up the loaded city instead of its old value
+        st.session_state.pop("city_select", None)
+
+def open_saved_report():
+    report_id = st.session_state.get("open_report_select")
+    if report_id:
+        load_report_into_form(get_report_store().get_report(report_id))
+
+def open_report_by_id(report_id):
+    load_report_into_form(get_report_store().get_report(report_id))
+
+def render_duplicate_warning():
+    """Warn while Basic Info is typed if this PO/style/factory already has a saved report"""
+    duplicates = get_report_store().find_duplicates(record_from_state(st.session_state))
+    for duplicate in duplicates[:3]:
+        saved = f"{duplicate['po_number'] or '-'} | {duplicate['factory'] or '-'} ({duplicate['updated_at'][:10]})"
+        message = get_text("duplicate_same_content") if duplicate["same_content"] else get_text("duplicate_report")
+        warning_col, open_col = st.columns([4, 1])
+        with warning_col:
+            st.warning(f"{ICONS['warning']} {message}: {saved}")
+        with open_col:
+            st.button(
+                f"{ICONS['process']} {get_text('open_existing')}",
+                key=f"open_duplicate_{duplicate['report_id']}",
+                on_click=open_report_by_id,
+                args=(duplicate["report_id"],),
+                use_container_width=True
+            )
+
+def load_report_version(report_id, version):
+    load_report_into_form(get_report_store().get_version(report_id, version))
+
+def render_report_history(report_id):
+    """Version list of a saved report with a field diff between two versions"""
+    store = get_report_store()
+    versions = store.list_versions(report_id)
+    if not versions:
+        return
+    with st.expander(f"{ICONS['time']} {get_text('history')} ({len(versions)})"):
+        st.dataframe(
+            [
+                {"version": v["version"], "author": v["author"], "saved_at": v["saved_at"],
+                 "changed": ", ".join(v["changed"][:8]) + (" ..." if len(v["changed"]) > 8 else "")}
+                for v in versions
+            ],
+            hide_index=True,
+            use_container_width=True
+        )
+        numbers = [v["version"] for v in versions]
+        if len(numbers) > 1:
+            st.markdown(f"**{get_text('compare_versions')}**")
+            col_a, col_b = st.columns(2)
+            with col_a:
+                old_version = st.selectbox("From", numbers, index=1, key="diff_from")
+            with col_b:
+                new_version = st.selectbox("To", numbers, index=0, key="diff_to")
+            diff = store.diff_versions(report_id, old_version, new_version)
+            if diff:
+                st.dataframe(
+                    [
+                        {"field": field, f"v{old_version}": str(old if old is not None else ""),
+                         f"v{new_version}": str(new if new is not None else "")}
+                        for field, (old, new) in diff.items()
+                    ],
+                    hide_index=True,
+                    use_container_width=True
+                )
+            else:
+                st.caption(get_text("no_changes"))
+        version = st.selectbox(get_text("load_version"), numbers, key="load_version_select")
+        st.button(
+            f"{ICONS['process']} {get_text('load_version')}",
+            key="load_version_button",
+            on_click=load_report_version,
+            args=(report_id, version)
+        )
+
+def render_risk_rating(stage_key):
+    """Severity/likelihood inputs for one risk stage with its computed level"""
+    rating_col1, rating_col2, rating_col3 = st.columns([2, 2, 1])
+    with rating_col1:
+        severity = st.selectbox(
+            f"{ICONS['warning']} {get_text('severity')}",
+            list(SEVERITY_LEVELS.keys()),
+            format_func=SEVERITY_LEVELS.get,
+            key=severity_field(stage_key)
+        )
+    with rating_col2:
+        likelihood = st.selectbox(
+            f"{ICONS['risk_assessment']} {get_text('likelihood')}",
+            list(LIKELIHOOD_LEVELS.keys()),
+            format_func=LIKELIHOOD_LEVELS.get,
+            key=likelihood_field(stage_key)
+        )
+    with rating_col3:
+        render_risk_level(stage_score(severity, likelihood))
+
+def render_risk_level(score):
+    """Risk level badge using the risk-level-* CSS classes"""
+    level = risk_level(score)
+    css_class = f"risk-level-{level.lower()}" if score else ""
+    st.markdown(f"**{get_text('risk_level')}**")
+    st.markdown(f'<span class="{css_class}">{level} ({score})</span>', unsafe_allow_html=True)
+
 def translate_pdf_content(text, pdf_lang):
     """Translate text for PDF based on selected language"""
-    if pdf_lang == "en" or not openai_client:
+    if pdf_lang == "en":
         return text
-    return translate_text(text, "zh")
-
-# Enhanced PDF Generation with Headers and Footers
-class PDFWithHeaderFooter(SimpleDocTemplate):
-    def __init__(self, *args, **kwargs):
-        self.header_text = kwargs.pop('header_text', '')
-        self.location = kwargs.pop('location', '')
-        self.pdf_language = kwargs.pop('pdf_language', 'en')
-        self.selected_city = kwargs.pop('selected_city', '')
-        self.chinese_city = kwargs.pop('chinese_city', '')
-        self.chinese_font = kwargs.pop('chinese_font', 'Helvetica')
-        super().__init__(*args, **kwargs)
-        
-    def afterFlowable(self, flowable):
-        """Add header and footer"""
-        if isinstance(flowable, PageBreak):
-            return
-            
-        # Add header on all pages except first
-        if self.page > 1:
-            self.canv.saveState()
-            # Header with gradient effect
-            self.canv.setFillColor(colors.HexColor('#667eea'))
-            self.canv.rect(0, self.pagesize[1] - 0.6*inch, self.pagesize[0], 0.6*inch, fill=1, stroke=0)
-            
-            # Use Chinese font if needed
-            font_size = 12
-            if self.pdf_language == "zh":
-                self.canv.setFont(self.chinese_font, font_size)
-            else:
-                self.canv.setFont('Helvetica-Bold', font_size)
-                
-            self.canv.setFillColor(colors.white)
-            header_title = "PRODUCTION RISK ASSESSMENT REPORT"
-            self.canv.drawCentredString(
-                self.pagesize[0]/2.0, 
-                self.pagesize[1] - 0.4*inch, 
-                header_title
-            )
-            self.canv.restoreState()
-            
-        # Footer on all pages
-        self.canv.saveState()
-        
-        # Footer background with subtle gradient
-        self.canv.setFillColor(colors.HexColor('#f8f9fa'))
-        self.canv.rect(0, 0, self.pagesize[0], 0.7*inch, fill=1, stroke=0)
-        
-        # Top border
-        self.canv.setStrokeColor(colors.HexColor('#667eea'))
-        self.canv.setLineWidth(1)
-        self.canv.line(0, 0.7*inch, self.pagesize[0], 0.7*inch)
-        
-        # Footer text - use Chinese font if needed
-        font_size = 8
-        if self.pdf_language == "zh":
-            self.canv.setFont(self.chinese_font, font_size)
-        else:
-            self.canv.setFont('Helvetica', font_size)
-            
-        self.canv.setFillColor(colors.HexColor('#666666'))
-        
-        # Left: Location - Show Chinese city only for Mandarin PDFs
-        china_tz = pytz.timezone('Asia/Shanghai')
-        current_time = datetime.now(china_tz)
-        
-        if self.pdf_language == "zh" and self.chinese_city:
-            location_info = f"地点: {self.selected_city} ({self.chinese_city})"
-        else:
-            location_info = f"Location: {self.selected_city}"
-        
-        self.canv.drawString(0.5*inch, 0.25*inch, location_info)
-        
-        # Center: Timestamp
-        timestamp = f"Generated: {current_time.strftime('%Y-%m-%d %H:%M:%S')}"
-        self.canv.drawCentredString(self.pagesize[0]/2.0, 0.25*inch, timestamp)
-        
-        # Right: Page number
-        page_num = f"Page {self.page}"
-        self.canv.drawRightString(self.pagesize[0] - 0.5*inch, 0.25*inch, page_num)
-        
-        self.canv.restoreState()
+    return translate_text(text, pdf_lang)
 
-def generate_pdf():
-    """Generate PDF report"""
-    buffer = io.BytesIO()
-    
-    # Get location info
-    selected_city = st.session_state.selected_city
-    chinese_city = CHINESE_CITIES[selected_city]
-    pdf_lang = st.session_state.pdf_language
-    
-    # Register Chinese font if needed
-    chinese_font = 'Helvetica'  # Default font
-    
-    if pdf_lang == "zh":
-        try:
-            # Try to use built-in Chinese font from ReportLab
-            try:
-                pdfmetrics.registerFont(UnicodeCIDFont('STSong-Light'))
-                chinese_font = 'STSong-Light'
-            except Exception as e1:
-                st.warning(f"STSong-Light not available: {str(e1)}")
-                try:
-                    # Try other common Chinese fonts
-                    pdfmetrics.registerFont(TTFont('SimSun', 'simsun.ttc'))
-                    chinese_font = 'SimSun'
-                except Exception as e2:
-                    st.warning(f"SimSun not available: {str(e2)}")
-                    try:
-                        pdfmetrics.registerFont(TTFont('YaHei', 'msyh.ttc'))
-                        chinese_font = 'YaHei'
-                    except Exception as e3:
-                        # Fall back to Helvetica
-                        chinese_font = 'Helvetica'
-                        st.warning("Chinese fonts not found. Using Helvetica as fallback.")
-        except Exception as e:
-            st.warning(f"Could not register Chinese font: {str(e)}")
-            chinese_font = 'Helvetica'
-    
-    # Create PDF with custom header/footer
-    doc = PDFWithHeaderFooter(
-        buffer, 
-        pagesize=A4,
-        topMargin=0.8*inch,
-        bottomMargin=0.8*inch,
-        header_text="PRODUCTION RISK ASSESSMENT REPORT",
-        location=f"{selected_city}",
-        pdf_language=pdf_lang,
-        selected_city=selected_city,
-        chinese_city=chinese_city,
-        chinese_font=chinese_font
-    )
-    
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    # Create styles with appropriate fonts
-    title_font = 'Helvetica-Bold' if pdf_lang != "zh" else chinese_font
-    normal_font = 'Helvetica' if pdf_lang != "zh" else chinese_font
-    bold_font = 'Helvetica-Bold' if pdf_lang != "zh" else chinese_font
-    
-    # Improved title style
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=22,
-        textColor=colors.HexColor('#667eea'),
-        spaceAfter=10,
-        alignment=TA_CENTER,
-        fontName=bold_font,
-        underlineWidth=1,
-        underlineColor=colors.HexColor('#764ba2'),
-        underlineOffset=-3
-    )
-    
-    # Company header style
-    company_style = ParagraphStyle(
-        'CompanyStyle',
-        parent=styles['Heading1'],
-        fontSize=16,
-        textColor=colors.HexColor('#333333'),
-        spaceAfter=5,
-        alignment=TA_CENTER,
-        fontName=bold_font
-    )
-    
-    # Subtitle style
-    subtitle_style = ParagraphStyle(
-        'CustomSubtitle',
-        parent=styles['Normal'],
-        fontSize=11,
-        textColor=colors.HexColor('#764ba2'),
-        alignment=TA_CENTER,
-        spaceAfter=20,
-        fontName=bold_font
-    )
-    
-    # Heading style for sections
-    heading_style = ParagraphStyle(
-        'CustomHeading',
-        parent=styles['Heading2'],
-        fontSize=14,
-        textColor=colors.white,
-        spaceAfter=8,
-        spaceBefore=12,
-        fontName=bold_font,
-        borderPadding=6,
-        borderColor=colors.HexColor('#667eea'),
-        borderWidth=1,
-        borderRadius=4,
-        backColor=colors.HexColor('#667eea'),
-        alignment=TA_LEFT
-    )
-    
-    # Subheading style
-    subheading_style = ParagraphStyle(
-        'CustomSubheading',
-        parent=styles['Heading3'],
-        fontSize=12,
-        textColor=colors.HexColor('#2c3e50'),
-        spaceAfter=6,
-        fontName=bold_font,
-        alignment=TA_LEFT
-    )
-    
-    # Risk description style
-    risk_desc_style = ParagraphStyle(
-        'RiskDescription',
-        parent=styles['Normal'],
-        fontSize=9,
-        textColor=colors.HexColor('#555555'),
-        leading=12,
-        alignment=TA_JUSTIFY,
-        fontName=normal_font
+@st.cache_resource
+def get_shared_translator():
+    """Process-wide translator for background jobs, which have no session state"""
+    return Translator(openai_client, memory=get_translation_memory(), limiter=get_rate_limiter(), priority=PRIORITY_BULK)
+
+def render_pdf_job(record, pdf_lang, progress):
+    """Render a record for a background job; returns (pdf bytes, warnings)"""
+    render_pool = get_render_pool()
+    if render_pool:
+        return render_pool.render(record, pdf_lang, progress=progress)
+    
+    warnings = []
+    translator = get_shared_translator()
+    buffer = build_pdf(
+        record,
+        pdf_lang,
+        translate=translator.translate_pdf_content,
+        on_warning=warnings.append,
+        progress=progress
     )
-    
-    # Normal style
-    normal_style = ParagraphStyle(
-        'NormalStyle',
-        parent=styles['Normal'],
-        fontSize=9,
-        leading=12,
-        fontName=normal_font
+    return buffer.getvalue(), warnings
+
+@st.cache_resource
+def get_job_manager():
+    """Background PDF jobs shared by all sessions, so they survive reruns"""
+    return JobManager(render_pdf_job, max_workers=int(os.getenv("PDF_JOB_THREADS", "8")))
+
+def compile_pdf_job(filters, pdf_lang, progress):
+    """Compile every saved report matching `filters` into one PDF; returns (pdf bytes, warnings)"""
+    warnings = []
+    report_store = get_report_store()
+    if next(report_store.iter_reports(batch_size=1, **filters), None) is None:
+        raise ValueError("No saved reports match the selected filters")
+    progress("layout")
+    # Streamed from the store twice (TOC titles, then layout) instead of held in memory
+    buffer = compile_reports(
+        lambda: report_store.iter_reports(**filters),
+        pdf_lang=pdf_lang,
+        title=f"Risk Assessment Review - {filters.get('factory') or 'All factories'}",
+        translate=get_shared_translator().translate_pdf_content,
+        on_warning=warnings.append
     )
-    
-    # Company Header
-    elements.append(Spacer(1, 10))
-    elements.append(Paragraph("PRODUCTION RISK ASSESSMENT REPORT", company_style))
-    
-    # Title
-    report_title = translate_pdf_content("Production Risk Assessment Report", pdf_lang)
-    elements.append(Paragraph(report_title, title_style))
-    
-    # Location and date
-    china_tz = pytz.timezone('Asia/Shanghai')
-    current_time = datetime.now(china_tz)
-    
-    if pdf_lang == "zh":
-        location_text = translate_pdf_content(f"地点: {selected_city} ({chinese_city})", pdf_lang)
-    else:
-        location_text = f"Location: {selected_city}"
-    
-    date_text = translate_pdf_content(f"Report Date: {current_time.strftime('%Y-%m-%d')}", pdf_lang)
-    
-    elements.append(Paragraph(location_text, subtitle_style))
-    elements.append(Paragraph(date_text, subtitle_style))
-    
-    # Decorative line
-    elements.append(Paragraph("<hr width='80%' color='#667eea'/>", normal_style))
-    elements.append(Spacer(1, 15))
-    
-    # Helper function for creating paragraphs
-    def create_paragraph(text, style=normal_style, bold=False):
-        """Create paragraph with appropriate font"""
-        if bold:
-            font_name = bold_font
-        else:
-            font_name = normal_font
-        
-        custom_style = ParagraphStyle(
-            f"CustomStyle_{bold}",
-            parent=style,
-            fontName=font_name
+    return buffer.getvalue(), warnings
+
+@st.cache_resource
+def get_compile_manager():
+    """Background jobs for combined review PDFs"""
+    return JobManager(compile_pdf_job, max_workers=int(os.getenv("PDF_COMPILE_THREADS", "2")))
+
+def render_delivery_pdf(report_id, pdf_lang):
+    """PDF of a saved report for deliveries queued without one"""
+    record = get_report_store().get_report(report_id)
+    if record is None:
+        raise ValueError(f"Report {report_id} no longer exists")
+    pdf_bytes, _ = render_pdf_job(record, pdf_lang, lambda stage: None)
+    return pdf_bytes
+
+@st.cache_resource
+def get_delivery_queue():
+    """Outbound email/ERP queue with its background sender, shared by all sessions"""
+    return DeliveryQueue(render=render_delivery_pdf, path=DEFAULT_DB_PATH).start()
+
+def delivery_subject(record):
+    parts = [record.get("po_number"), record.get("factory"), record.get("style")]
+    return "Production Risk Assessment Report - " + " - ".join(part for part in parts if part)
+
+def factory_recipients(factory):
+    """Addresses earlier reports of a factory were emailed to"""
+    report_ids = [report["report_id"] for report in get_report_store().list_reports(limit=50, factory=factory)]
+    return get_delivery_queue().recent_recipients(report_ids)
+
+def delivery_targets(emails, upload_to_erp):
+    targets = [("email", email) for email in emails]
+    if upload_to_erp:
+        targets.append(("erp", get_delivery_queue().transports["erp"].url))
+    return targets
+
+def email_digest(factory, week_start, path, pdf_bytes):
+    """Queue a finished weekly digest for the DIGEST_RECIPIENTS management list"""
+    recipients = parse_recipients(os.getenv("DIGEST_RECIPIENTS", ""))
+    if recipients and "email" in get_delivery_queue().configured_channels():
+        get_delivery_queue().enqueue(
+            f"digest-{week_start.isoformat()}-{os.path.splitext(os.path.basename(path))[0]}",
+            [("email", recipient) for recipient in recipients],
+            os.path.basename(path),
+            subject=f"Weekly Factory Risk Digest - {factory} - {week_start.isoformat()}",
+            pdf_bytes=pdf_bytes
         )
-        
-        return Paragraph(text, custom_style)
-    
-    # 1. Basic Information Table
-    basic_title = translate_pdf_content("1. BASIC INFORMATION", pdf_lang)
-    elements.append(Paragraph(basic_title, heading_style))
-    elements.append(Spacer(1, 5))
-    
-    # Get values from session state or use defaults
-    po_number_val = st.session_state.get('po_number', '')
-    style_val = st.session_state.get('style', '')
-    brand_val = st.session_state.get('brand', '')
-    sales_person_val = st.session_state.get('sales', '')
-    factory_val = st.session_state.get('factory', '')
-    assessment_date_val = st.session_state.get('assessment_date', datetime.now())
-    
-    basic_data = [
-        [
-            create_paragraph(translate_pdf_content("PO / Order Number:", pdf_lang), bold=True), 
-            create_paragraph(po_number_val), 
-            create_paragraph(translate_pdf_content("Style / Model:", pdf_lang), bold=True), 
-            create_paragraph(style_val)
-        ],
-        [
-            create_paragraph(translate_pdf_content("Brand / Trademark:", pdf_lang), bold=True), 
-            create_paragraph(brand_val), 
-            create_paragraph(translate_pdf_content("Sales / Business:", pdf_lang), bold=True), 
-            create_paragraph(sales_person_val)
-        ],
-        [
-            create_paragraph(translate_pdf_content("Factory Name:", pdf_lang), bold=True), 
-            create_paragraph(factory_val), 
-            create_paragraph(translate_pdf_content("Assessment Date:", pdf_lang), bold=True), 
-            create_paragraph(assessment_date_val.strftime('%Y-%m-%d') if hasattr(assessment_date_val, 'strftime') else str(assessment_date_val))
-        ]
-    ]
-    
-    basic_table = Table(basic_data, colWidths=[1.5*inch, 2.0*inch, 1.5*inch, 2.0*inch])
-    basic_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#f0f4ff')),
-        ('BACKGROUND', (2, 0), (2, -1), colors.HexColor('#f0f4ff')),
-        ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-        ('ALIGN', (0, 0), (0, -1), 'LEFT'),
-        ('ALIGN', (2, 0), (2, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (0, -1), bold_font),
-        ('FONTNAME', (2, 0), (2, -1), bold_font),
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#d4d4d4')),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('LEFTPADDING', (0, 0), (-1, -1), 8),
-        ('RIGHTPADDING', (0, 0), (-1, -1), 8),
-        ('ROWBACKGROUNDS', (0, 0), (-1, -1), [colors.white, colors.HexColor('#f9f9ff')])
-    ]))
-    elements.append(basic_table)
-    elements.append(Spacer(1, 15))
-    
-    # 2. Risk Assessment Matrix
-    risk_title = translate_pdf_content("2. RISK ASSESSMENT MATRIX", pdf_lang)
-    elements.append(Paragraph(risk_title, heading_style))
-    elements.append(Spacer(1, 5))
-    
-    # Get risk descriptions from session state
-    style_risk_desc = st.session_state.get('style_risk_desc', '')
-    style_cap_desc_val = st.session_state.get('style_cap_desc', '')
-    material_risk_desc = st.session_state.get('material_risk_desc', '')
-    material_cap_desc_val = st.session_state.get('material_cap_desc', '')
-    factory_risk_desc = st.session_state.get('factory_risk_desc', '')
-    factory_cap_desc_val = st.session_state.get('factory_cap_desc', '')
-    package_risk_desc = st.session_state.get('package_risk_desc', '')
-    package_cap_desc_val = st.session_state.get('package_cap_desc', '')
-    other_risk_desc = st.session_state.get('other_risk_desc', '')
-    other_cap_desc_val = st.session_state.get('other_cap_desc', '')
-    
-    # Risk stage descriptions
-    risk_descriptions = [
-        {
-            "title": "1. Style & Construction Risk",
-            "subtitle": translate_pdf_content("Potential production risk generated by styling features on this product", pdf_lang),
-            "content": style_risk_desc,
-            "cap": style_cap_desc_val
-        },
-        {
-            "title": "2. Raw Material Risk",
-            "subtitle": translate_pdf_content("Potential risk presented to manufacture by properties of the material", pdf_lang),
-            "content": material_risk_desc,
-            "cap": material_cap_desc_val
-        },
-        {
-            "title": "3. Factory Performance Risk",
-            "subtitle": translate_pdf_content("Factory production potential risks (including finishing etc.)", pdf_lang),
-            "content": factory_risk_desc,
-            "cap": factory_cap_desc_val
-        },
-        {
-            "title": "4. Package Risk",
-            "subtitle": translate_pdf_content("Packaging related risks", pdf_lang),
-            "content": package_risk_desc,
-            "cap": package_cap_desc_val
-        },
-        {
-            "title": "5. Other Risks",
-            "subtitle": translate_pdf_content("Any other potential risks", pdf_lang),
-            "content": other_risk_desc,
-            "cap": other_cap_desc_val
-        }
-    ]
-    
-    # Create risk assessment table
-    risk_headers = [
-        create_paragraph(translate_pdf_content("Risk Stage", pdf_lang), bold=True),
-        create_paragraph(translate_pdf_content("Description", pdf_lang), bold=True),
-        create_paragraph(translate_pdf_content("CAP Description", pdf_lang), bold=True)
-    ]
-    
-    risk_data = [risk_headers]
-    
-    for i, risk in enumerate(risk_descriptions):
-        risk_data.append([
-            create_paragraph(translate_pdf_content(risk["title"], pdf_lang), bold=True),
-            create_paragraph(risk["content"] if risk["content"] else "-", risk_desc_style),
-            create_paragraph(risk["cap"] if risk["cap"] else "-", risk_desc_style)
-        ])
-    
-    risk_table = Table(risk_data, colWidths=[1.8*inch, 2.5*inch, 2.5*inch])
-    risk_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#764ba2')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-        ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), bold_font),
-        ('FONTSIZE', (0, 0), (-1, -1), 8),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#e0e0e0')),
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f9f9ff')]),
-        ('LEFTPADDING', (0, 0), (-1, -1), 6),
-        ('RIGHTPADDING', (0, 0), (-1, -1), 6)
-    ]))
-    elements.append(risk_table)
-    elements.append(Spacer(1, 20))
-    
-    # 3. Department Comments
-    elements.append(PageBreak())
-    
-    comments_title = translate_pdf_content("3. DEPARTMENT COMMENTS", pdf_lang)
-    elements.append(Paragraph(comments_title, heading_style))
-    elements.append(Spacer(1, 10))
-    
-    # Get comments from session state
-    sales_comments_val = st.session_state.get('sales_comments', '')
-    tech_comments_val = st.session_state.get('tech_comments', '')
-    qc_comments_val = st.session_state.get('qc_comments', '')
-    conclusion_val = st.session_state.get('conclusion', '')
-    
-    # Sales Comments
-    sales_title = translate_pdf_content("Sales Comments:", pdf_lang)
-    elements.append(Paragraph(sales_title, subheading_style))
-    
-    if sales_comments_val:
-        sales_para = create_paragraph(sales_comments_val, risk_desc_style)
-        elements.append(sales_para)
-    else:
-        elements.append(create_paragraph("-", risk_desc_style))
-    
-    elements.append(Spacer(1, 8))
-    
-    # Technical Comments
-    tech_title = translate_pdf_content("Technical Comments:", pdf_lang)
-    elements.append(Paragraph(tech_title, subheading_style))
-    
-    if tech_comments_val:
-        tech_para = create_paragraph(tech_comments_val, risk_desc_style)
-        elements.append(tech_para)
-    else:
-        elements.append(create_paragraph("-", risk_desc_style))
-    
-    elements.append(Spacer(1, 8))
-    
-    # QC Manager Comments
-    qc_title = translate_pdf_content("QC Manager Comments:", pdf_lang)
-    elements.append(Paragraph(qc_title, subheading_style))
-    
-    if qc_comments_val:
-        qc_para = create_paragraph(qc_comments_val, risk_desc_style)
-        elements.append(qc_para)
-    else:
-        elements.append(create_paragraph("-", risk_desc_style))
-    
-    elements.append(Spacer(1, 15))
-    
-    # 4. Conclusion and Signatures
-    conclusion_title = translate_pdf_content("4. CONCLUSION & APPROVALS", pdf_lang)
-    elements.append(Paragraph(conclusion_title, heading_style))
-    elements.append(Spacer(1, 10))
-    
-    # Conclusion
-    conclusion_text = translate_pdf_content("Conclusion:", pdf_lang)
-    elements.append(Paragraph(conclusion_text, subheading_style))
-    
-    if conclusion_val:
-        conclusion_para = create_paragraph(conclusion_val, risk_desc_style)
-        elements.append(conclusion_para)
+
+@st.cache_resource
+def get_digest_scheduler():
+    """Weekly per-factory digests, built in the background (DIGEST_SCHEDULER=0 to only build on request)"""
+    scheduler = DigestScheduler(
+        DigestBuilder(get_report_store(), DEFAULT_DB_PATH),
+        render_pool=get_render_pool(),
+        on_digest=email_digest
+    )
+    if os.getenv("DIGEST_SCHEDULER", "1") == "1":
+        scheduler.start()
+    return scheduler
+
+@st.cache_resource
+def get_preview_manager():
+    """Debounced background previews for all sessions"""
+    return PreviewManager(translate=get_shared_translator().translate_pdf_content)
+
+def render_live_preview(result):
+    """Page images (or the PDF) of a session's latest preview"""
+    if result.error:
+        st.error(f"{ICONS['error']} {get_text('error_generating')}: {result.error}")
+        return
+    changed = ", ".join(str(i + 1) for i in result.changed_pages) or "-"
+    st.caption(f"{len(result.page_hashes)} {get_text('pages')} | {get_text('changed_pages')}: {changed}")
+    if pdfium is None:
+        st.info(get_text("preview_needs_pdfium"))
     else:
-        elements.append(create_paragraph("-", risk_desc_style))
-    
-    elements.append(Spacer(1, 15))
-    
-    # Get signature data from session state
-    sales_signature_val = st.session_state.get('sales_signature', '')
-    sales_date_val = st.session_state.get('sales_date', datetime.now())
-    tech_signature_val = st.session_state.get('tech_signature', '')
-    tech_date_val = st.session_state.get('tech_date', datetime.now())
-    qc_signature_val = st.session_state.get('qc_signature', '')
-    qc_date_val = st.session_state.get('qc_date', datetime.now())
-    
-    # Signature table
-    sig_data = [
-        [
-            create_paragraph(translate_pdf_content("Sales:", pdf_lang), bold=True),
-            create_paragraph(sales_signature_val if sales_signature_val else "_________________"),
-            create_paragraph(translate_pdf_content("Date:", pdf_lang), bold=True),
-            create_paragraph(sales_date_val.strftime('%Y-%m-%d') if hasattr(sales_date_val, 'strftime') else "__________")
-        ],
-        [
-            create_paragraph(translate_pdf_content("Technical:", pdf_lang), bold=True),
-            create_paragraph(tech_signature_val if tech_signature_val else "_________________"),
-            create_paragraph(translate_pdf_content("Date:", pdf_lang), bold=True),
-            create_paragraph(tech_date_val.strftime('%Y-%m-%d') if hasattr(tech_date_val, 'strftime') else "__________")
-        ],
-        [
-            create_paragraph(translate_pdf_content("QC Manager:", pdf_lang), bold=True),
-            create_paragraph(qc_signature_val if qc_signature_val else "_________________"),
-            create_paragraph(translate_pdf_content("Date:", pdf_lang), bold=True),
-            create_paragraph(qc_date_val.strftime('%Y-%m-%d') if hasattr(qc_date_val, 'strftime') else "__________")
-        ]
-    ]
-    
-    sig_table = Table(sig_data, colWidths=[1.2*inch, 2.3*inch, 0.8*inch, 1.5*inch])
-    sig_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#f0f4ff')),
-        ('BACKGROUND', (2, 0), (2, -1), colors.HexColor('#f0f4ff')),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (0, -1), bold_font),
-        ('FONTNAME', (2, 0), (2, -1), bold_font),
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#e0e0e0')),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-    ]))
-    elements.append(sig_table)
-    
-    # Final note about report distribution
-    elements.append(Spacer(1, 20))
-    process_note = translate_pdf_content(
-        "Note: QC will send this report to office together with final inspection report. "
-        "Office assistant will upload to ERP system and send email to factory/agent accordingly.",
-        pdf_lang
+        page_cols = st.columns(2)
+        for i, page_hash in enumerate(result.page_hashes):
+            image = get_preview_manager().page_image(page_hash)
+            if image:
+                with page_cols[i % 2]:
+                    st.image(image, caption=f"{get_text('page')} {i + 1}", use_container_width=True)
+    st.download_button(
+        label=f"{ICONS['download']} {get_text('download_preview')}",
+        data=result.pdf_bytes,
+        file_name=f"Preview_{st.session_state.get('po_number') or 'report'}.pdf",
+        mime="application/pdf",
+        key="download_preview"
     )
-    elements.append(Paragraph(process_note, normal_style))
-    
-    # Confidential footer
-    elements.append(Spacer(1, 10))
-    footer_note = translate_pdf_content(
-        "This report is confidential and property of the company. Unauthorized distribution is prohibited.",
-        pdf_lang
+
+def render_delivery_panel(record, pdf_bytes, filename, pdf_lang):
+    """Queue a finished PDF for the factory/agent and the ERP, with per-recipient status"""
+    queue = get_delivery_queue()
+    channels = queue.configured_channels()
+    with st.expander(f"{ICONS['send']} {get_text('send_report')}"):
+        if not channels:
+            st.info(get_text("delivery_not_configured"))
+            return
+        if not record.get("report_id"):
+            st.info(get_text("save_before_sending"))
+            return
+        emails = []
+        if "email" in channels:
+            emails = parse_recipients(st.text_input(
+                get_text("recipient_emails"),
+                value=", ".join(factory_recipients(record.get("factory"))),
+                key="delivery_emails"
+            ))
+        upload_to_erp = "erp" in channels and st.checkbox(get_text("upload_to_erp"), value=True, key="delivery_erp")
+        if st.button(f"{ICONS['send']} {get_text('queue_delivery')}", key="queue_delivery"):
+            queue.enqueue(
+                record["report_id"],
+                delivery_targets(emails, upload_to_erp),
+                filename,
+                subject=delivery_subject(record),
+                pdf_bytes=pdf_bytes,
+                pdf_lang=pdf_lang
+            )
+            st.success(f"{ICONS['success']} {get_text('delivery_queued')}")
+        deliveries = queue.deliveries(record["report_id"])
+        if deliveries:
+            st.dataframe(deliveries, use_container_width=True, hide_index=True)
+
+def render_pdf_job_status(job):
+    """Progress or result (downloads) of a background PDF job"""
+    if not job.finished:
+        st.progress(job.progress, text=f"{ICONS['time']} {get_text('creating_pdf')} {STAGE_LABELS[job.stage]}...")
+        return
+    
+    if job.stage == "failed":
+        st.error(f"{ICONS['error']} {get_text('error_generating')}: {job.error}")
+        return
+    
+    for warning in job.warnings:
+        st.warning(warning)
+    st.success(f"{ICONS['success']} {get_text('generate_success')}")
+    
+    # Display PDF preview info
+    job_city = job.record.get("city") or "Shanghai"
+    with st.expander(f"{ICONS['info']} {get_text('pdf_details')}"):
+        col_info1, col_info2 = st.columns(2)
+        with col_info1:
+            st.metric(get_text("location"), f"{job_city} ({CHINESE_CITIES.get(job_city, '')})")
+            st.metric(get_text("report_language"), language_name(job.pdf_lang))
+        with col_info2:
+            generated_time = datetime.fromtimestamp(job.finished_at, pytz.timezone('Asia/Shanghai'))
+            st.metric(get_text("generated"), generated_time.strftime('%H:%M:%S'))
+            st.metric(get_text("pdf_size"), f"{len(job.pdf_bytes) / 1024:.0f} KB")
+    
+    # Download button
+    filename = job.meta["filename"]
+    st.download_button(
+        label=f"{ICONS['download']} {get_text('download_pdf')}",
+        data=job.pdf_bytes,
+        file_name=filename,
+        mime="application/pdf",
+        use_container_width=True
     )
-    elements.append(Paragraph(footer_note, normal_style))
     
-    # Build PDF
-    doc.build(elements)
-    buffer.seek(0)
-    return buffer
+    # Same record in machine-readable formats for ERP/BI import
+    export_cols = st.columns(len(EXPORT_FORMATS))
+    for export_col, export_format in zip(export_cols, EXPORT_FORMATS):
+        with export_col:
+            st.download_button(
+                label=f"{ICONS['download']} {export_format.upper()}",
+                data=export_report(job.record, export_format),
+                file_name=filename.replace(".pdf", f".{export_format}"),
+                mime=MIME_TYPES[export_format],
+                use_container_width=True,
+                key=f"download_record_{export_format}"
+            )
+    
+    render_delivery_panel(job.record, job.pdf_bytes, filename, job.pdf_lang)
+
+# Background senders and schedulers run for the whole process, not only while a page shows them
+get_delivery_queue()
+get_digest_scheduler()
 
 # Sidebar with enhanced filters
+sync_collaboration()
+
 with st.sidebar:
     st.markdown(f'### {ICONS["settings"]} Settings & Filters')
     
     # Language filters with icons
     st.markdown(f'#### {ICONS["language"]} Language Settings')
-    ui_language = st.selectbox(
+    language_codes = list(LANGUAGES)
+    st.session_state.ui_language = st.selectbox(
         "User Interface Language",
-        ["English", "Mandarin"],
-        index=0 if st.session_state.ui_language == "en" else 1,
+        language_codes,
+        index=language_codes.index(st.session_state.ui_language) if st.session_state.ui_language in LANGUAGES else 0,
+        format_func=language_name,
         key="ui_lang_select"
     )
-    st.session_state.ui_language = "en" if ui_language == "English" else "zh"
     
-    pdf_language = st.selectbox(
+    st.session_state.pdf_language = st.selectbox(
         "PDF Report Language",
-        ["English", "Mandarin"],
-        index=0 if st.session_state.pdf_language == "en" else 1,
+        language_codes,
+        index=language_codes.index(st.session_state.pdf_language) if st.session_state.pdf_language in LANGUAGES else 0,
+        format_func=language_name,
         key="pdf_lang_select"
     )
-    st.session_state.pdf_language = "en" if pdf_language == "English" else "zh"
     
     # Location filter with enhanced UI
     st.markdown(f'#### {ICONS["location"]} Location Settings')
@@ -978,6 +990,45 @@ with st.sidebar:
     )
     st.session_state.selected_city = selected_city
     
+    # Author recorded with each saved version
+    st.text_input(get_text("your_name"), key="user_name")
+    
+    if st.session_state.get("report_id"):
+        st.checkbox(
+            f"{ICONS['collab']} {get_text('live_collaboration')}", key="collab_enabled", help=get_text("collab_scope")
+        )
+        if st.session_state.get("collab_room"):
+            others, locked = get_collab_hub().presence(st.session_state.collab_room, current_session_id())
+            st.caption(f"{get_text('editing_now')}: {', '.join(others)}" if others else get_text("only_you"))
+            if rerun_hook_problem() is not None:
+                st.caption(f"{ICONS['warning']} {get_text('collab_no_push')}")
+            for field, editor in locked.items():
+                st.caption(f"{ICONS['lock']} {field} - {editor}")
+            for field in list(st.session_state.get("collab_conflicts", {})):
+                st.warning(f"{ICONS['warning']} {field}: {get_text('join_conflict')}")
+                mine_col, shared_col = st.columns(2)
+                with mine_col:
+                    st.button(get_text("keep_mine"), key=f"keep_mine_{field}", on_click=keep_local_value, args=(field,))
+                with shared_col:
+                    st.button(get_text("use_shared"), key=f"use_shared_{field}", on_click=use_shared_value, args=(field,))
+    
+    saved_reports = get_report_store().list_reports(limit=100)
+    if saved_reports:
+        report_labels = {
+            report["report_id"]: (
+                f"{report['po_number'] or '-'} | {report['factory'] or '-'} "
+                f"({report['updated_at'][:10]}, {report['report_id'][:6]})"
+            )
+            for report in saved_reports
+        }
+        st.selectbox(
+            get_text("open_report"),
+            list(report_labels),
+            format_func=report_labels.get,
+            key="open_report_select"
+        )
+        st.button(f"{ICONS['download']} {get_text('open')}", key="open_report_button", on_click=open_saved_report)
+    
     # Display selected location in a badge
     st.markdown(f"""
     <div class="location-badge">
@@ -1033,10 +1084,11 @@ st.markdown(f"""
 """, unsafe_allow_html=True)
 
 # Create tabs for better organization
-tab1, tab2, tab3 = st.tabs([
+tab1, tab2, tab3, tab4 = st.tabs([
     f"{ICONS['basic_info']} Basic Info",
     f"{ICONS['risk_assessment']} Risk Assessment",
-    f"{ICONS['signatures']} Signatures"
+    f"{ICONS['signatures']} Signatures",
+    f"{ICONS['analytics']} Analytics"
 ])
 
 with tab1:
@@ -1063,12 +1115,14 @@ with tab1:
             placeholder="Model XYZ-2024",
             key="style"
         )
+        render_suggestions("style")
         
         factory = st.text_input(
             f"{ICONS['factory']} {get_text('factory')}", 
             placeholder="ABC Manufacturing Co., Ltd.",
             key="factory"
         )
+        render_suggestions("factory")
     
     with col2:
         brand = st.text_input(
@@ -1076,19 +1130,23 @@ with tab1:
             placeholder="Brand Name",
             key="brand"
         )
+        render_suggestions("brand")
         
         sales_person = st.text_input(
             f"{ICONS['sales']} {get_text('sales')}", 
             placeholder="Sales Representative Name",
             key="sales"
         )
+        render_suggestions("sales")
         
         assessment_date = st.date_input(
             f"{ICONS['time']} Assessment Date", 
-            datetime.now(),
             key="assessment_date"
         )
     
+    render_duplicate_warning()
+    
+    render_photo_uploader()
     
 with tab2:
     # Risk Assessment Section
@@ -1099,115 +1157,41 @@ with tab2:
     </div>
     """, unsafe_allow_html=True)
     
-    # 1. Style & Construction Risk
-    st.markdown(f"""
-    <div class="section-header">
-        <span class="section-header-icon">{ICONS["style_risk"]}</span>
-        {get_text("style_risk")}
-    </div>
-    """, unsafe_allow_html=True)
-    
-    style_risk_description = st.text_area(
-        f"{ICONS['description']} {get_text('description')}",
-        placeholder="Describe potential risks related to style and construction...",
-        height=120,
-        key="style_risk_desc"
-    )
-    
-    style_cap_description = st.text_area(
-        f"{ICONS['cap']} {get_text('cap_desc')}",
-        placeholder="Describe corrective action plan for style risks...",
-        height=100,
-        key="style_cap_desc"
+    # The product line's risk schema decides which stages the form shows
+    st.selectbox(
+        f"{ICONS['style']} {get_text('product_line')}",
+        list(RISK_SCHEMAS),
+        format_func=lambda name: RISK_SCHEMAS[name].get("title", name),
+        key="risk_schema"
     )
     
-    # 2. Raw Material Risk
-    st.markdown(f"""
-    <div class="section-header">
-        <span class="section-header-icon">{ICONS["material_risk"]}</span>
-        {get_text("material_risk")}
-    </div>
-    """, unsafe_allow_html=True)
-    
-    material_risk_description = st.text_area(
-        f"{ICONS['description']} {get_text('description')}",
-        placeholder="Describe potential risks related to raw materials...",
-        height=120,
-        key="material_risk_desc"
-    )
-    
-    material_cap_description = st.text_area(
-        f"{ICONS['cap']} {get_text('cap_desc')}",
-        placeholder="Describe corrective action plan for material risks...",
-        height=100,
-        key="material_cap_desc"
-    )
-    
-    # 3. Factory Performance Risk
-    st.markdown(f"""
-    <div class="section-header">
-        <span class="section-header-icon">{ICONS["factory_risk"]}</span>
-        {get_text("factory_risk")}
-    </div>
-    """, unsafe_allow_html=True)
-    
-    factory_risk_description = st.text_area(
-        f"{ICONS['description']} {get_text('description')}",
-        placeholder="Describe potential risks related to factory performance...",
-        height=120,
-        key="factory_risk_desc"
-    )
-    
-    factory_cap_description = st.text_area(
-        f"{ICONS['cap']} {get_text('cap_desc')}",
-        placeholder="Describe corrective action plan for factory risks...",
-        height=100,
-        key="factory_cap_desc"
-    )
-    
-    # 4. Package Risk
-    st.markdown(f"""
-    <div class="section-header">
-        <span class="section-header-icon">{ICONS["package_risk"]}</span>
-        {get_text("package_risk")}
-    </div>
-    """, unsafe_allow_html=True)
-    
-    package_risk_description = st.text_area(
-        f"{ICONS['description']} {get_text('description')}",
-        placeholder="Describe potential risks related to packaging...",
-        height=120,
-        key="package_risk_desc"
-    )
-    
-    package_cap_description = st.text_area(
-        f"{ICONS['cap']} {get_text('cap_desc')}",
-        placeholder="Describe corrective action plan for packaging risks...",
-        height=100,
-        key="package_cap_desc"
-    )
-    
-    # 5. Other Risks
-    st.markdown(f"""
-    <div class="section-header">
-        <span class="section-header-icon">{ICONS["other_risks"]}</span>
-        {get_text("other_risks")}
-    </div>
-    """, unsafe_allow_html=True)
-    
-    other_risk_description = st.text_area(
-        f"{ICONS['description']} {get_text('description')}",
-        placeholder="Describe any other potential risks...",
-        height=120,
-        key="other_risk_desc"
-    )
+    for stage_widget in compile_risk_schema(st.session_state.risk_schema).widgets:
+        st.markdown(f"""
+        <div class="section-header">
+            <span class="section-header-icon">{ICONS.get(stage_widget["icon"], ICONS["risk_assessment"])}</span>
+            {get_text(stage_widget["title"])}
+        </div>
+        """, unsafe_allow_html=True)
+        
+        st.text_area(
+            f"{ICONS['description']} {get_text('description')}",
+            placeholder=stage_widget["risk_placeholder"],
+            height=120,
+            key=stage_widget["risk_key"]
+        )
+        
+        st.text_area(
+            f"{ICONS['cap']} {get_text('cap_desc')}",
+            placeholder=stage_widget["cap_placeholder"],
+            height=100,
+            key=stage_widget["cap_key"]
+        )
+        
+        render_risk_rating(stage_widget["key"])
     
-    other_cap_description = st.text_area(
-        f"{ICONS['cap']} {get_text('cap_desc')}",
-        placeholder="Describe corrective action plan for other risks...",
-        height=100,
-        key="other_cap_desc"
-    )
+    # Overall result across all stages
+    st.markdown(f"#### {ICONS['assessment']} {get_text('overall_result')}")
+    render_risk_level(overall_score(record_from_state(st.session_state)))
 
 with tab3:
     # Department Comments and Signatures
@@ -1274,7 +1258,6 @@ with tab3:
         )
         sales_date = st.date_input(
             "Sales Date",
-            datetime.now(),
             key="sales_date"
         )
         
@@ -1285,7 +1268,6 @@ with tab3:
         )
         tech_date = st.date_input(
             "Technical Date",
-            datetime.now(),
             key="tech_date"
         )
     
@@ -1297,47 +1279,305 @@ with tab3:
         )
         qc_date = st.date_input(
             "QC Date",
-            datetime.now(),
             key="qc_date"
         )
 
+with tab4:
+    # Cross-report risk analytics (reads precomputed aggregates only)
+    st.markdown(f"""
+    <div class="section-header">
+        <span class="section-header-icon">{ICONS["analytics"]}</span>
+        {get_text("analytics")}
+    </div>
+    """, unsafe_allow_html=True)
+    
+    report_store = get_report_store()
+    available_months = report_store.months()
+    
+    if not available_months:
+        st.info(f"{ICONS['info']} {get_text('no_saved_reports')}")
+    else:
+        filter_col1, filter_col2, filter_col3 = st.columns(3)
+        with filter_col1:
+            analytics_cities = st.multiselect(
+                f"{ICONS['location']} {get_text('location')}",
+                list(CHINESE_CITIES.keys()),
+                key="analytics_cities"
+            )
+        with filter_col2:
+            stage_labels = {stage["key"]: stage["title"] for stage in ALL_RISK_STAGES}
+            analytics_stage = st.selectbox(
+                f"{ICONS['risk_assessment']} {get_text('risk_stage')}",
+                [None] + list(stage_labels.keys()),
+                format_func=lambda key: "All stages" if key is None else stage_labels[key],
+                key="analytics_stage"
+            )
+        with filter_col3:
+            month_from, month_to = st.select_slider(
+                f"{ICONS['time']} Month range",
+                options=available_months,
+                value=(available_months[0], available_months[-1]),
+                key="analytics_months"
+            ) if len(available_months) > 1 else (available_months[0], available_months[0])
+        
+        query_filters = {"cities": analytics_cities, "month_from": month_from, "month_to": month_to}
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            st.markdown(f"#### {ICONS['factory']} {get_text('top_factories')}")
+            st.dataframe(
+                report_store.top_risk_entries("factory", stage=analytics_stage, **query_filters),
+                use_container_width=True,
+                hide_index=True
+            )
+        with col2:
+            st.markdown(f"#### {ICONS['brand']} {get_text('top_brands')}")
+            st.dataframe(
+                report_store.top_risk_entries("brand", stage=analytics_stage, **query_filters),
+                use_container_width=True,
+                hide_index=True
+            )
+        
+        st.markdown(f"#### {ICONS['warning']} {get_text('riskiest_open_pos')}")
+        st.dataframe(report_store.riskiest_reports(limit=50), use_container_width=True, hide_index=True)
+        
+        st.markdown(f"#### {ICONS['cap']} {get_text('cap_completion')}")
+        st.dataframe(
+            report_store.cap_completion_rates("factory", **query_filters),
+            use_container_width=True,
+            hide_index=True
+        )
+        
+        st.markdown(f"#### {ICONS['analytics']} {get_text('monthly_trend')}")
+        trend = report_store.monthly_stage_trend(**query_filters)
+        if trend:
+            trend_table = {}
+            for row in trend:
+                trend_table.setdefault(row["month"], {})[stage_labels.get(row["stage"], row["stage"])] = row["risk_entries"]
+            st.bar_chart(trend_table)
+        
+        with st.expander(f"{ICONS['download']} {get_text('export_reports')}"):
+            bulk_format = st.radio("Format", EXPORT_FORMATS, horizontal=True, key="bulk_export_format")
+            if st.button(f"{ICONS['download']} Prepare export", key="prepare_bulk_export"):
+                bulk_buffer = io.BytesIO()
+                if bulk_format == "xlsx":
+                    exported_count = bulk_export(report_store, bulk_format, bulk_buffer)
+                else:
+                    text_buffer = io.TextIOWrapper(bulk_buffer, encoding="utf-8", newline="")
+                    exported_count = bulk_export(report_store, bulk_format, text_buffer)
+                    text_buffer.flush()
+                    text_buffer.detach()
+                st.download_button(
+                    label=f"{ICONS['download']} {exported_count} reports ({bulk_format.upper()})",
+                    data=bulk_buffer.getvalue(),
+                    file_name=f"risk_reports_{datetime.now().strftime('%Y%m%d')}.{'jsonl' if bulk_format == 'json' else bulk_format}",
+                    mime=MIME_TYPES[bulk_format],
+                    key="download_bulk_export"
+                )
+        
+        with st.expander(f"{ICONS['compile']} {get_text('compile_review')}"):
+            compile_col1, compile_col2 = st.columns(2)
+            with compile_col1:
+                compile_factory = st.selectbox(
+                    f"{ICONS['factory']} {get_text('factory')}",
+                    [None] + report_store.factories(),
+                    format_func=lambda name: "All factories" if name is None else name,
+                    key="compile_factory"
+                )
+            with compile_col2:
+                compile_lang = st.selectbox(
+                    get_text("report_language"),
+                    list(LANGUAGES),
+                    format_func=language_name,
+                    key="compile_language"
+                )
+            st.caption(f"Uses the location and month filters above ({month_from} to {month_to}).")
+            if st.button(f"{ICONS['generate']} {get_text('compile_review')}", key="start_compile"):
+                st.session_state.compile_job_id = get_compile_manager().submit(
+                    dict(query_filters, factory=compile_factory),
+                    compile_lang
+                )
+            
+            compile_job = get_compile_manager().get(st.session_state.get("compile_job_id"))
+            if compile_job:
+                if not compile_job.finished:
+                    st.progress(compile_job.progress, text=f"{STAGE_LABELS[compile_job.stage]}...")
+                    st.button(f"{ICONS['time']} Refresh status", key="refresh_compile_job")
+                elif compile_job.stage == "failed":
+                    st.error(f"{ICONS['error']} {get_text('error_generating')}: {compile_job.error}")
+                else:
+                    for warning in compile_job.warnings:
+                        st.warning(warning)
+                    compile_slug = (compile_job.record.get("factory") or "all").replace(" ", "_")
+                    st.download_button(
+                        label=f"{ICONS['download']} {get_text('download_pdf')} ({len(compile_job.pdf_bytes) / 1024:.0f} KB)",
+                        data=compile_job.pdf_bytes,
+                        file_name=f"Risk_Review_{compile_slug}_{compile_job.record.get('month_from')}_{compile_job.record.get('month_to')}.pdf",
+                        mime="application/pdf",
+                        key="download_compiled_pdf"
+                    )
+        
+        with st.expander(f"{ICONS['send']} {get_text('end_of_day_delivery')}"):
+            delivery_queue = get_delivery_queue()
+            if not delivery_queue.configured_channels():
+                st.info(get_text("delivery_not_configured"))
+            else:
+                delivery_since = st.date_input(
+                    "Reports saved since", value=datetime.now(CHINA_TZ).date(), key="delivery_since"
+                )
+                # Saves are stamped in UTC; the date is a China-time day
+                todays_reports = report_store.list_reports(limit=1000, updated_since=day_start_utc(delivery_since))
+                st.caption(
+                    f"{len(todays_reports)} reports, emailed to each factory's previous recipients "
+                    f"as {language_name(st.session_state.pdf_language)} PDFs rendered in the background."
+                )
+                bulk_erp = "erp" in delivery_queue.configured_channels() and st.checkbox(
+                    get_text("upload_to_erp"), value=True, key="bulk_delivery_erp"
+                )
+                if todays_reports and st.button(f"{ICONS['send']} {get_text('queue_delivery')}", key="queue_bulk_delivery"):
+                    contacts = {}
+                    for report in todays_reports:
+                        factory = report["factory"]
+                        if factory not in contacts:
+                            contacts[factory] = factory_recipients(factory) if "email" in delivery_queue.configured_channels() else []
+                        delivery_queue.enqueue(
+                            report["report_id"],
+                            delivery_targets(contacts[factory], bulk_erp),
+                            f"Risk_Assessment_Report_{report['po_number'] or ''}_{report['city'] or ''}.pdf",
+                            subject=delivery_subject(report),
+                            pdf_lang=st.session_state.pdf_language
+                        )
+                    st.success(f"{ICONS['success']} {get_text('delivery_queued')}: {len(todays_reports)}")
+                st.markdown(f"**{get_text('delivery_status')}**")
+                status_counts = delivery_queue.status_counts()
+                status_cols = st.columns(len(DELIVERY_STATUSES))
+                for status_col, status in zip(status_cols, DELIVERY_STATUSES):
+                    status_col.metric(status.title(), status_counts.get(status, 0))
+        
+        with st.expander(f"{ICONS['factory']} {get_text('weekly_digests')}"):
+            digest_scheduler = get_digest_scheduler()
+            digest_runs = digest_scheduler.runs()
+            if st.button(f"{ICONS['generate']} {get_text('build_digests')} ({last_week().isoformat()})", key="build_digests"):
+                threading.Thread(
+                    target=digest_scheduler.run, kwargs={"force": True}, name="digest-manual", daemon=True
+                ).start()
+                st.info(f"{ICONS['time']} {get_text('digests_started')}")
+            if digest_runs:
+                st.dataframe(digest_runs, use_container_width=True, hide_index=True)
+                digest_week = st.selectbox(
+                    get_text("week"), [run["week_start"] for run in digest_runs], key="digest_week"
+                )
+                for name, path in digest_scheduler.digest_files(digest_week).items():
+                    with open(path, "rb") as fh:
+                        st.download_button(
+                            label=f"{ICONS['download']} {name}",
+                            data=fh.read(),
+                            file_name=f"Weekly_Digest_{digest_week}_{name}",
+                            mime="application/pdf",
+                            key=f"download_digest_{name}"
+                        )
+        
+        with st.expander(f"{ICONS['archive']} {get_text('archive')}"):
+            st.caption(get_text("archive_settings").format(days=PDF_RETENTION_DAYS))
+            if st.button(f"{ICONS['archive']} {get_text('archive_now').format(days=ARCHIVE_AFTER_DAYS)}", key="run_archive"):
+                archive_counts = run_archive(report_store, get_blob_store(), get_delivery_queue())
+                st.success(f"{ICONS['success']} {get_text('archive_done').format(**archive_counts)}")
+            archive_stats = report_store.archive.stats()
+            archive_cols = st.columns(3)
+            archive_cols[0].metric(get_text("archived_reports"), archive_stats.get("report", {}).get("entries", 0))
+            archive_cols[1].metric(get_text("archived_photos"), archive_stats.get("blob", {}).get("entries", 0))
+            archive_cols[2].metric(
+                get_text("archive_size"),
+                f"{sum(stats['stored'] for stats in archive_stats.values()) / 1e6:.1f} MB"
+            )
+        
+        with st.expander(f"{ICONS['download']} {get_text('export_aggregates')}"):
+            export_format = st.radio("Format", ["parquet", "csv"], horizontal=True, key="aggregate_export_format")
+            if st.button(f"{ICONS['download']} Prepare export", key="prepare_aggregate_export"):
+                for table, data in report_store.export_aggregates(export_format).items():
+                    st.download_button(
+                        label=f"{ICONS['download']} {table}.{export_format}",
+                        data=data,
+                        file_name=f"{table}_{datetime.now().strftime('%Y%m%d')}.{export_format}",
+                        mime="application/octet-stream",
+                        key=f"download_{table}"
+                    )
+
 # Generate PDF Button
 st.markdown("---")
 col1, col2, col3 = st.columns([1, 2, 1])
 with col2:
+    if st.button(f"{ICONS['save']} {get_text('save_report')}", use_container_width=True):
+        if not st.session_state.get('po_number') or not st.session_state.get('factory'):
+            st.error(f"{ICONS['error']} {get_text('fill_required')}")
+        else:
+            record = record_from_state(st.session_state)
+            st.session_state.report_id = get_report_store().save_report(
+                record, author=st.session_state.get("user_name", "").strip() or None
+            )
+            remember_collab_base()
+            get_master_data().add_record(record)
+            get_blob_store().set_refs(st.session_state.report_id, [photo["sha256"] for photo in record["photos"]])
+            st.success(f"{ICONS['success']} {get_text('report_saved')}: {st.session_state.report_id}")
+    
+    if st.session_state.get('report_id'):
+        render_report_history(st.session_state.report_id)
+    
     if st.button(f"{ICONS['generate']} {get_text('generate_pdf')}", use_container_width=True):
         if not st.session_state.get('po_number') or not st.session_state.get('factory'):
             st.error(f"{ICONS['error']} {get_text('fill_required')}")
         else:
-            with st.spinner(f"{ICONS['time']} {get_text('creating_pdf')}"):
-                try:
-                    pdf_buffer = generate_pdf()
-                    st.success(f"{ICONS['success']} {get_text('generate_success')}")
-                    
-                    # Display PDF preview info
-                    with st.expander(f"{ICONS['info']} {get_text('pdf_details')}"):
-                        col_info1, col_info2 = st.columns(2)
-                        with col_info1:
-                            st.metric(get_text("location"), f"{selected_city} ({CHINESE_CITIES[selected_city]})")
-                            st.metric(get_text("report_language"), "Mandarin" if st.session_state.pdf_language == "zh" else "English")
-                        with col_info2:
-                            china_tz = pytz.timezone('Asia/Shanghai')
-                            current_time = datetime.now(china_tz)
-                            st.metric(get_text("generated"), current_time.strftime('%H:%M:%S'))
-                    
-                    # Download button
-                    filename = f"Risk_Assessment_Report_{st.session_state.get('po_number', '')}_{selected_city}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-                    st.download_button(
-                        label=f"{ICONS['download']} {get_text('download_pdf')}",
-                        data=pdf_buffer,
-                        file_name=filename,
-                        mime="application/pdf",
-                        use_container_width=True
-                    )
-                    
-                except Exception as e:
-                    st.error(f"{ICONS['error']} {get_text('error_generating')}: {str(e)}")
-                    st.error(f"Detailed error: {str(e)}")
+            # Submit as a background job; identical inputs reuse the existing job
+            filename = f"Risk_Assessment_Report_{st.session_state.get('po_number', '')}_{selected_city}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+            st.session_state.pdf_job_id = get_job_manager().submit(
+                record_from_state(st.session_state),
+                st.session_state.pdf_language,
+                meta={"filename": filename}
+            )
+    
+    pdf_job = get_job_manager().get(st.session_state.get('pdf_job_id'))
+    if pdf_job is not None:
+        fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+        if fragment and not pdf_job.finished:
+            # Poll only this part of the page until the job finishes, then rerun the app once
+            @fragment(run_every=1.0)
+            def poll_pdf_job():
+                job = get_job_manager().get(st.session_state.get('pdf_job_id'))
+                if job is None or job.finished:
+                    st.rerun()
+                render_pdf_job_status(job)
+            
+            poll_pdf_job()
+        else:
+            render_pdf_job_status(pdf_job)
+            if not pdf_job.finished:
+                st.button(f"{ICONS['process']} Refresh status", key="refresh_pdf_job")
+
+# Live preview, re-rendered in the background shortly after edits stop
+if st.checkbox(f"{ICONS['preview']} {get_text('live_preview')}", key="live_preview"):
+    preview_manager = get_preview_manager()
+    preview_manager.request(current_session_id(), record_from_state(st.session_state), st.session_state.pdf_language)
+    preview_result, preview_pending = preview_manager.status(current_session_id())
+    fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+    if fragment and preview_pending:
+        # Poll only this part of the page until the render finishes, then rerun the app once
+        @fragment(run_every=0.5)
+        def poll_preview():
+            result, pending = get_preview_manager().status(current_session_id())
+            if not pending:
+                st.rerun()
+            st.caption(f"{ICONS['time']} {get_text('updating_preview')}")
+            if result:
+                render_live_preview(result)
+        
+        poll_preview()
+    elif preview_result:
+        render_live_preview(preview_result)
+    elif preview_pending:
+        st.caption(f"{ICONS['time']} {get_text('updating_preview')}")
+        st.button(f"{ICONS['process']} Refresh status", key="refresh_preview")
+else:
+    get_preview_manager().discard(current_session_id())
 
 # Footer
 st.markdown("---")
@@ -1348,7 +1588,7 @@ st.markdown(f"""
     </p>
     <p style='font-size: 0.9rem; color: #666666;'>
         {ICONS['location']} {get_text('location')}: {selected_city} ({CHINESE_CITIES[selected_city]}) | 
-        {ICONS['language']} {get_text('report_language')}: {'Mandarin' if st.session_state.pdf_language == 'zh' else 'English'}
+        {ICONS['language']} {get_text('report_language')}: {language_name(st.session_state.pdf_language)}
     </p>
     <p style='font-size: 0.8rem; color: #999999; margin-top: 1rem;'>
         {get_text('powered_by')} | {get_text('copyright')}